@@ -1,13 +1,17 @@
-from fastapi import FastAPI, Form, HTTPException, Depends, Body, UploadFile, File
+from fastapi import FastAPI, Form, HTTPException, Depends, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import Response
 import prometheus_client
+import re
 import uuid
+import posixpath
 from pathlib import Path
-from minio.error import S3Error
 from typing import Literal, Optional, Tuple, List
 from google.cloud import firestore
-from fastapi.responses import StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import httpx
 import psutil
 from datetime import datetime
 from pydantic import BaseModel  # <--- Asegúrate de tener esto
@@ -17,12 +21,21 @@ from .auth_google import router as google_router
 from .metrics import (
     PrometheusMiddleware,
     api_queue_size,
+    api_queue_leased_jobs,
+    api_queue_consumer_lag_seconds,
+    api_queue_dead_jobs,
     api_jobs_enqueued_total,
     api_media_uploads_total,
+    api_media_upload_bytes_total,
 )
-from . import jobs
+from . import jobs, job_queue, worker_registry, object_store
+from .object_store import ObjectStoreError
+from .form_stream import FormFileStream, FormStreamError
+from . import upload_sessions, direct_uploads, upload_sweeper, hls_delivery
+from .upload_sessions import UploadSessionError
 from .jobs import REDIS_QUEUE
-from .firebase_db import get_db  # <--- Asegúrate de tener esto
+from .firebase_db import async_db
+from .media_probe import probe_media
 
 
 
@@ -38,12 +51,28 @@ app.add_middleware(
 
 app.add_middleware(PrometheusMiddleware)
 
+
+@app.on_event("startup")
+async def start_upload_sweeper():
+    upload_sweeper.start(jobs.get_redis_client())
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await upload_sweeper.stop()
+    await object_store.close()
+    await jobs.get_redis_client().aclose()
+
+
 @app.get("/metrics")
-def metrics():
+async def metrics():
     try:
         r = jobs.get_redis_client()
-        q_len = r.llen(REDIS_QUEUE)
-        api_queue_size.labels(queue_name=REDIS_QUEUE).set(q_len)
+        stats = await job_queue.queue_stats_async(r, REDIS_QUEUE)
+        api_queue_size.labels(queue_name=REDIS_QUEUE).set(stats["pending"])
+        api_queue_leased_jobs.labels(queue_name=REDIS_QUEUE).set(stats["leased"])
+        api_queue_consumer_lag_seconds.labels(queue_name=REDIS_QUEUE).set(stats["lag_seconds"])
+        api_queue_dead_jobs.labels(queue_name=REDIS_QUEUE).set(stats["dead"])
     except Exception:
         api_queue_size.labels(queue_name=REDIS_QUEUE).set(0)
         
@@ -56,7 +85,7 @@ def metrics():
 app.include_router(google_router)
 
 @app.get("/monitor/summary")
-def monitor_summary(user = Depends(current_user)):
+async def monitor_summary(user = Depends(current_user)):
     """
     Resumen ligero para el dashboard de monitoreo (JSON).
     No devuelve todas las métricas Prometheus, solo lo que nos interesa mostrar.
@@ -66,17 +95,35 @@ def monitor_summary(user = Depends(current_user)):
     mem = psutil.virtual_memory().percent
 
     # Tamaño de la cola de trabajos en Redis
+    r = jobs.get_redis_client()
     try:
-        r = jobs.get_redis_client()
-        q_len = r.llen(REDIS_QUEUE)
+        q_stats = await job_queue.queue_stats_async(r, REDIS_QUEUE)
+        q_len = q_stats["pending"]
     except Exception:
+        q_stats = {}
         q_len = None
 
-    # Total de usuarios registrados en Firestore (si falla, lo dejamos en None)
-    db = get_db()
+    # Workers según su registro en Redis (los levante compose o el autoscaler)
+    try:
+        worker_nodes = [
+            {
+                "id": w["worker_id"],
+                "role": "worker de conversión",
+                "status": "online" if w["online"] else "offline",
+                "draining": bool(w.get("draining")),
+                "slots": w.get("slots"),
+                "busy_slots": w.get("busy"),
+            }
+            for w in await worker_registry.list_workers_async(r, include_stale=True)
+        ]
+    except Exception:
+        worker_nodes = []
+
+    # Total de usuarios registrados en Firestore (si falla, lo dejamos en None).
+    # Agregación count(): Firestore cuenta sin mandar los documentos
     try:
-        users_ref = db.collection("users")
-        total_users = len(list(users_ref.stream()))
+        result = await async_db().collection("users").count().get()
+        total_users = result[0][0].value
     except Exception:
         total_users = None
 
@@ -92,6 +139,8 @@ def monitor_summary(user = Depends(current_user)):
         "queue": {
             "name": REDIS_QUEUE,
             "length": q_len,
+            "in_progress": q_stats.get("leased"),
+            "lag_seconds": q_stats.get("lag_seconds"),
         },
         "sessions": {
             # Para el proyecto, basta con reportar la sesión actual y un estimado
@@ -103,31 +152,32 @@ def monitor_summary(user = Depends(current_user)):
             "total_users": total_users,
         },
         "nodes": [
-            {"id": "api",       "role": "API / gateway",          "status": "online"},
-            {"id": "worker_a",  "role": "worker de conversión",   "status": "online"},
-            {"id": "worker_b",  "role": "worker de conversión",   "status": "online"},
+            {"id": "api", "role": "API / gateway", "status": "online"},
+            *worker_nodes,
         ],
     }
 
 
 @app.post("/auth/register")
-def register(username: str = Form(...), password: str = Form(...)):
-    u = auth_create_user(username, password)
+async def register(username: str = Form(...), password: str = Form(...)):
+    u = await auth_create_user(username, password)
     return {"id": u["id"], "username": u["username"]}
 
 @app.post("/auth/token")
-def token(username: str = Form(...), password: str = Form(...)):
-    tok = authenticate(username, password)
+async def token(username: str = Form(...), password: str = Form(...)):
+    tok = await authenticate(username, password)
     if not tok:
         raise HTTPException(status_code=401, detail="Credenciales inválidas")
     return {"access_token": tok, "token_type": "bearer"}
 
 @app.get("/me")
-def me(user = Depends(current_user)):
+async def me(user = Depends(current_user)):
     return {"id": user["id"], "username": user["username"]}
 
 
 SUPPORTED_TARGETS = Literal["mp3", "mp4", "hls"]
+# Variantes de HLS adaptativo (ver HLS_LADDER_PRESETS en worker/ffmpeg_tasks.py)
+HLS_RENDITIONS = Literal["1080p", "720p", "480p", "360p", "audio"]
 SUPPORTED_AUDIO_INPUT_EXT = {".mp3", ".wav", ".flac", ".ogg"}
 SUPPORTED_VIDEO_INPUT_EXT = {".mp4", ".mkv", ".mov"}
 SUPPORTED_INPUT_EXT = SUPPORTED_AUDIO_INPUT_EXT | SUPPORTED_VIDEO_INPUT_EXT
@@ -143,26 +193,30 @@ class ShareWithUserRequest(BaseModel):
 class UserPublic(BaseModel):
     id: str
     username: str
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
         
 
 
 @app.post("/auth/logout")
-def logout(user = Depends(current_user)):
+async def logout(user = Depends(current_user)):
     return {"detail": "Sesión cerrada correctamente", "user": user["username"]}
 
 
 
 @app.get("/users", response_model=List[UserPublic])
-def list_users(user=Depends(current_user)):
+async def list_users(user=Depends(current_user)):
     """
     Devuelve la lista de usuarios registrados (se excluye al usuario actual).
     """
-    db = get_db()
-    users_ref = db.collection("users")
-    docs = users_ref.stream()
+    # Sólo hace falta el username: no se traen los hashes de contraseña
+    docs = async_db().collection("users").select(["username"]).stream()
 
     result: List[UserPublic] = []
-    for doc in docs:
+    async for doc in docs:
         data = doc.to_dict() or {}
         username = data.get("username")
         if not username:
@@ -175,86 +229,368 @@ def list_users(user=Depends(current_user)):
     return result
 
 
-@app.post("/media/upload")
-def upload_media(
-    file: UploadFile = File(...),
-    user = Depends(current_user)):
+def _validate_upload_extension(filename: Optional[str]) -> str:
+    """Extensión (en minúscula) del archivo subido; 400 si no está soportada."""
+    file_ext = Path(filename or "").suffix.lower()
+    if file_ext not in SUPPORTED_INPUT_EXT:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Formato no soportado: {file_ext}. "
+                f"Audio permitidos: {sorted(SUPPORTED_AUDIO_INPUT_EXT)}. "
+                f"Video permitidos: {sorted(SUPPORTED_VIDEO_INPUT_EXT)}."
+            ),
+        )
+    return file_ext
+
+
+async def _register_upload(
+    user: dict,
+    *,
+    filename: str,
+    object_name: str,
+    content_type: Optional[str],
+    file_ext: str,
+    size: int,
+    content_sha256: Optional[str],
+) -> dict:
+    """
+    El original ya está en MinIO: lo analiza con ffprobe y crea su entrada en
+    Firestore. Devuelve el media_entry.
+    """
+    api_media_uploads_total.inc()
+    api_media_upload_bytes_total.inc(size)
+
+    # Leer duración/resolución/códecs (sólo cabecera, vía URL firmada)
+    # para estimar el coste de las conversiones al encolarlas
+    probe = await run_in_threadpool(
+        probe_media, jobs.get_presigned_url_for_download(MINIO_MEDIA_BUCKET, object_name)
+    )
 
+    media_entry = await jobs.create_media_entry(
+        user_id=user["id"],
+        original_filename=filename,
+        source_bucket=MINIO_MEDIA_BUCKET,
+        source_object=object_name,
+        content_type=content_type,
+        original_extension=file_ext,
+        original_size_bytes=size,
+        content_sha256=content_sha256,
+        probe=probe,
+    )
+    print(f"Usuario {user['username']} subió {filename} como {media_entry['id']}")
+    return media_entry
+
+
+@app.post(
+    "/media/upload",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {"file": {"type": "string", "format": "binary"}},
+                        "required": ["file"],
+                    }
+                }
+            },
+        }
+    },
+)
+async def upload_media(request: Request, user = Depends(current_user)):
+    """
+    Sube un original (campo `file` de un multipart/form-data) sin pasar por
+    disco: el cuerpo se lee a medida que llega (form_stream.py) y se manda a
+    MinIO como partes de una subida multipart en paralelo, calculando tamaño
+    y sha256 en la misma pasada (object_store.StreamingUpload).
+    """
     try:
-        # 1. Generar un media_id único
-        media_id = str(uuid.uuid4())
-        user_id = user["id"]
-        
-        # Extensión en minúscula
-        file_ext = Path(file.filename).suffix.lower()
+        form = FormFileStream(request, field="file")
+        filename, content_type = await form.open()
+    except FormStreamError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    file_ext = _validate_upload_extension(filename)
 
-        # 1.1 Validar que el formato sea soportado
-        if file_ext not in SUPPORTED_INPUT_EXT:
-            raise HTTPException(
-                status_code=400,
-                detail=(
-                    f"Formato no soportado: {file_ext}. "
-                    f"Audio permitidos: {sorted(SUPPORTED_AUDIO_INPUT_EXT)}. "
-                    f"Video permitidos: {sorted(SUPPORTED_VIDEO_INPUT_EXT)}."
-                ),
-            )
+    # Ej: uploads/user_123/media_abc/original.mp4
+    media_id = str(uuid.uuid4())
+    object_name = f"uploads/{user['id']}/{media_id}/original{file_ext}"
 
-        # 1.2 Calcular tamaño original del archivo
-        file.file.seek(0, 2)              # ir al final
-        original_size = file.file.tell()  # bytes
-        file.file.seek(0)                 # volver al inicio
+    upload = object_store.StreamingUpload(MINIO_MEDIA_BUCKET, object_name, content_type)
+    try:
+        try:
+            await upload.start()
+            async for chunk in form.chunks():
+                await upload.write(chunk)
+            size, content_sha256 = await upload.finish()
+        except BaseException:
+            # Cualquier salida (también cancelación o desconexión) descarta la
+            # subida multipart para no dejar partes huérfanas en MinIO
+            await upload.abort()
+            raise
+    except FormStreamError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="Error al subir archivo a MinIO")
 
-        # 2. Definir dónde se guardará en MinIO
-        # Ej: uploads/user_123/media_abc/original.mp4
-        object_name = f"uploads/{user_id}/{media_id}/original{file_ext}"
-        
-        # 3. Subir a MinIO
-        jobs.upload_file_to_minio(
-            bucket=MINIO_MEDIA_BUCKET,
+    try:
+        return await _register_upload(
+            user,
+            filename=filename,
             object_name=object_name,
-            file_stream=file.file,
-            file_length=original_size,           # usamos el tamaño calculado
-            content_type=file.content_type
+            content_type=content_type,
+            file_ext=file_ext,
+            size=size,
+            content_sha256=content_sha256,
         )
-        
-        # 4. Incrementar métrica
-        api_media_uploads_total.inc()
-        
-        # 5. Crear entrada en Firestore (ahora con extensión y tamaño)
-        media_entry = jobs.create_media_entry(
-            user_id=user_id,
-            original_filename=file.filename,
-            source_bucket=MINIO_MEDIA_BUCKET,
-            source_object=object_name,
-            content_type=file.content_type,
-            original_extension=file_ext,
-            original_size_bytes=original_size,
+    except Exception as e:
+        print(f"Error en upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Error interno: {e}")
+
+
+# --- Subidas reanudables (ver upload_sessions.py) ---
+
+async def _upload_session(session_id: str, user: dict) -> upload_sessions.UploadSession:
+    try:
+        return await upload_sessions.get_session(jobs.get_redis_client(), session_id, user["id"])
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.post("/media/uploads")
+async def create_upload_session(payload: UploadSessionRequest, user = Depends(current_user)):
+    """
+    Abre una subida reanudable. Devuelve el upload_id y el chunk_size con el
+    que hay que partir el archivo (ver PUT /media/uploads/{upload_id}).
+    """
+    file_ext = _validate_upload_extension(payload.filename)
+    media_id = str(uuid.uuid4())
+    try:
+        session = await upload_sessions.create_session(
+            jobs.get_redis_client(),
+            user_id=user["id"],
+            filename=payload.filename,
+            size=payload.size,
+            content_type=payload.content_type,
+            file_ext=file_ext,
+            bucket=MINIO_MEDIA_BUCKET,
+            object_name=f"uploads/{user['id']}/{media_id}/original{file_ext}",
         )
-        
-        print(f"Usuario {user['username']} subió {file.filename} como {media_id}")
-        
-        # 6. Retornar el nuevo media_id
-        return media_entry
-        
-    except S3Error as e:
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except (ObjectStoreError, httpx.HTTPError) as e:
         print(f"Error de MinIO: {e}")
-        raise HTTPException(status_code=500, detail="Error al subir archivo a MinIO")
+        raise HTTPException(status_code=500, detail="No se pudo iniciar la subida en MinIO")
+    return upload_sessions.progress(session, {})
+
+
+@app.put("/media/uploads/{session_id}")
+async def put_upload_chunk(
+    session_id: str,
+    request: Request,
+    content_range: Optional[str] = Header(None),
+    user = Depends(current_user),
+):
+    """
+    Un chunk del archivo, con `Content-Range: bytes inicio-fin/total`. Se
+    puede reintentar; devuelve el progreso de la subida.
+    """
+    session = await _upload_session(session_id, user)
+    try:
+        index = upload_sessions.chunk_index(session, content_range)
+        expected = session.chunk_length(index)
+        data = bytearray()
+        async for chunk in request.stream():
+            data += chunk
+            if len(data) > expected:
+                raise UploadSessionError(400, f"El chunk {index} debe tener {expected} bytes")
+        return await upload_sessions.put_chunk(
+            jobs.get_redis_client(), session, index, bytes(data)
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=502, detail="No se pudo guardar el chunk: reenvíalo")
+
+
+@app.get("/media/uploads/{session_id}")
+async def upload_session_progress(session_id: str, user = Depends(current_user)):
+    """Progreso de una subida: qué chunks ya llegaron y desde dónde seguir."""
+    session = await _upload_session(session_id, user)
+    parts = await upload_sessions.received_parts(jobs.get_redis_client(), session)
+    return upload_sessions.progress(session, parts)
+
+
+@app.post("/media/uploads/{session_id}/complete")
+async def complete_upload_session(session_id: str, user = Depends(current_user)):
+    """
+    Cierra la subida (409 si faltan chunks) y crea el media igual que
+    /media/upload. Si falla se puede reintentar: la sesión se borra recién
+    cuando el media quedó creado.
+    """
+    session = await _upload_session(session_id, user)
+
+    async def register(size: int, content_sha256: str) -> dict:
+        try:
+            return await _register_upload(
+                user,
+                filename=session.filename,
+                object_name=session.object_name,
+                content_type=session.content_type,
+                file_ext=session.file_ext,
+                size=size,
+                content_sha256=content_sha256,
+            )
+        except Exception as e:
+            print(f"Error en upload: {e}")
+            raise HTTPException(status_code=500, detail=f"Error interno: {e}")
+
+    try:
+        return await upload_sessions.complete_session(jobs.get_redis_client(), session, register)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo finalizar la subida en MinIO")
+
+
+@app.delete("/media/uploads/{session_id}")
+async def abort_upload_session(session_id: str, user = Depends(current_user)):
+    session = await _upload_session(session_id, user)
+    try:
+        await upload_sessions.abort_session(jobs.get_redis_client(), session)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo descartar la subida")
+    return {"detail": "Subida descartada", "upload_id": session_id}
+
+
+# --- Subidas directas a MinIO con URLs firmadas (ver direct_uploads.py) ---
+
+async def _direct_upload(upload_id: str, user: dict) -> direct_uploads.DirectUpload:
+    try:
+        return await direct_uploads.get_direct_upload(jobs.get_redis_client(), upload_id, user["id"])
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@app.post("/media/direct-uploads")
+async def create_direct_upload(payload: UploadSessionRequest, user = Depends(current_user)):
+    """
+    Devuelve URLs firmadas para subir el original directo a MinIO (una sola
+    o una por parte si es grande). Después: POST .../{upload_id}/complete.
+    """
+    file_ext = _validate_upload_extension(payload.filename)
+    media_id = str(uuid.uuid4())
+    try:
+        return await direct_uploads.create_direct_upload(
+            jobs.get_redis_client(),
+            user_id=user["id"],
+            filename=payload.filename,
+            size=payload.size,
+            content_type=payload.content_type,
+            file_ext=file_ext,
+            bucket=MINIO_MEDIA_BUCKET,
+            object_name=f"uploads/{user['id']}/{media_id}/original{file_ext}",
+        )
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo iniciar la subida en MinIO")
+
+
+@app.post("/media/direct-uploads/{upload_id}/complete")
+async def complete_direct_upload(upload_id: str, user = Depends(current_user)):
+    """
+    Comprueba con un HEAD que el objeto está en MinIO con el tamaño declarado
+    (cerrando antes la subida multipart si la hay) y crea el media.
+    """
+    upload = await _direct_upload(upload_id, user)
+    try:
+        info = await direct_uploads.complete_direct_upload(jobs.get_redis_client(), upload)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo finalizar la subida en MinIO")
+
+    try:
+        return await _register_upload(
+            user,
+            filename=upload.filename,
+            object_name=upload.object_name,
+            content_type=info.content_type or upload.content_type,
+            file_ext=upload.file_ext,
+            size=info.size,
+            content_sha256=None,  # la API no vio los bytes: la caché usa ETag + tamaño
+        )
     except Exception as e:
         print(f"Error en upload: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno: {e}")
 
 
+@app.delete("/media/direct-uploads/{upload_id}")
+async def abort_direct_upload(upload_id: str, user = Depends(current_user)):
+    upload = await _direct_upload(upload_id, user)
+    try:
+        await direct_uploads.abort_direct_upload(jobs.get_redis_client(), upload)
+    except (ObjectStoreError, httpx.HTTPError) as e:
+        print(f"Error de MinIO: {e}")
+        raise HTTPException(status_code=500, detail="No se pudo descartar la subida")
+    return {"detail": "Subida descartada", "upload_id": upload_id}
+
+
 @app.post("/media/{media_id}/convert")
-def convert_media(
+async def convert_media(
     media_id: str,
-    target: SUPPORTED_TARGETS = Body(..., embed=True, description="Formato: mp3, mp4, o hls"),
+    target: Optional[SUPPORTED_TARGETS] = Body(None, embed=True, description="Formato: mp3, mp4, o hls"),
+    targets: Optional[List[SUPPORTED_TARGETS]] = Body(
+        None,
+        embed=True,
+        description="Varios formatos del mismo original en un solo job, p.ej. ['mp3', 'mp4', 'hls']",
+    ),
+    hls_ladder: Optional[List[HLS_RENDITIONS]] = Body(
+        None,
+        embed=True,
+        description="Sólo hls: variantes ABR a generar, p.ej. ['1080p', '720p', '480p', 'audio']",
+    ),
+    previews: Optional[bool] = Body(
+        None,
+        embed=True,
+        description=(
+            "mp4/hls: generar póster, sprites de miniaturas y pista WebVTT. "
+            "Por defecto sí, salvo en un remux (obligaría a decodificar el video)"
+        ),
+    ),
     user = Depends(current_user)
 ):
     """
     Encola un trabajo de conversión y deja todo lo necesario en Firestore.
+    Con hls_ladder el worker genera HLS adaptativo (master.m3u8 + una playlist
+    por variante) decodificando el original una sola vez.
+    Con targets (varios formatos) se encola un único job que decodifica el
+    original una vez y escribe todas las salidas; cada salida tiene su propio
+    job_id, consultable por /jobs/{job_id}/status como cualquier otro.
+    Los videos llevan vistas previas (ver /media/{media_id}/previews) salvo
+    previews=false; los que sólo cambian de contenedor (remux), sólo con
+    previews=true.
     """
+    requested = list(dict.fromkeys(([target] if target else []) + (targets or [])))
+    if not requested:
+        raise HTTPException(status_code=400, detail="Indica target o targets")
+    if len(requested) > 1:
+        if hls_ladder:
+            raise HTTPException(status_code=400, detail="hls_ladder no se combina con varios targets")
+        return await _convert_media_fanout(media_id, requested, user, previews)
+    target = requested[0]
+    if hls_ladder and target != "hls":
+        raise HTTPException(status_code=400, detail="hls_ladder sólo aplica al target hls")
     # 1) Validar media y propiedad
-    media_entry = jobs.get_media_entry(media_id)
+    media_entry = await jobs.get_media_entry(media_id)
     if not media_entry:
         raise HTTPException(status_code=404, detail="Media no encontrado")
     if media_entry.get("user_id") != user["id"]:
@@ -272,16 +608,25 @@ def convert_media(
     output_prefix = f"converted/{media_id}/{job_id}"  # mp3/mp4 => archivo; hls => carpeta con index.m3u8
 
 
+    # 4) Coste estimado: la cola atiende primero los jobs cortos
+    estimated_cost = jobs.estimate_job_cost(target, media_entry, hls_ladder)
+
     # 5) Encolar en Redis con toda la info que el worker necesita
     try:
-        jobs.enqueue_conversion_job(
+        await jobs.enqueue_conversion_job(
             media_id=media_id,
             job_id=job_id,              # <- usar el MISMO job_id
             target=target,
             source_bucket=source_bucket,
             source_object=source_object,
             output_bucket=output_bucket,
-            output_prefix=output_prefix  # <- importantísimo
+            output_prefix=output_prefix,  # <- importantísimo
+            content_sha256=media_entry.get("content_sha256"),  # clave de la caché de conversiones
+            estimated_cost=estimated_cost,
+            source_duration=(media_entry.get("probe") or {}).get("duration"),
+            source_probe=media_entry.get("probe"),
+            hls_ladder=hls_ladder,
+            previews=previews,
         )
 
         # 6) Métricas (si ya definiste el collector)
@@ -291,21 +636,82 @@ def convert_media(
             "media_id": media_id,
             "job_id": job_id,
             "status": "enqueued",
-            "target": target
+            "target": target,
+            "estimated_cost_seconds": estimated_cost,
         }
 
     except Exception as e:
         print(f"[convert_media] Error encolando {job_id}: {e}")
         raise HTTPException(status_code=500, detail="Error al encolar trabajo")
 
+async def _convert_media_fanout(
+    media_id: str, targets: List[str], user, previews: Optional[bool] = None
+) -> dict:
+    """Encola un job fan-out (varios targets, una decodificación) para el media."""
+    media_entry = await jobs.get_media_entry(media_id)
+    if not media_entry:
+        raise HTTPException(status_code=404, detail="Media no encontrado")
+    if media_entry.get("user_id") != user["id"]:
+        raise HTTPException(status_code=403, detail="No autorizado para este media")
+
+    source_bucket = media_entry.get("source_bucket")
+    source_object = media_entry.get("source_object")
+    if not source_bucket or not source_object:
+        raise HTTPException(500, "Metadatos de media incompletos (sin bucket/object)")
+
+    # Un job_id y un prefijo de salida por target, igual que con jobs sueltos
+    outputs = []
+    for target in targets:
+        job_id = str(uuid.uuid4())
+        outputs.append({
+            "job_id": job_id,
+            "target": target,
+            "output_prefix": f"converted/{media_id}/{job_id}",
+            "estimated_cost": jobs.estimate_job_cost(target, media_entry),
+        })
+
+    try:
+        fanout_id = await jobs.enqueue_fanout_job(
+            media_id=media_id,
+            outputs=outputs,
+            source_bucket=source_bucket,
+            source_object=source_object,
+            output_bucket=source_bucket,
+            content_sha256=media_entry.get("content_sha256"),
+            source_duration=(media_entry.get("probe") or {}).get("duration"),
+            source_probe=media_entry.get("probe"),
+            previews=previews,
+        )
+    except Exception as e:
+        print(f"[convert_media] Error encolando fan-out de {media_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error al encolar trabajo")
+
+    for o in outputs:
+        api_jobs_enqueued_total.labels(target_format=o["target"]).inc()
+
+    return {
+        "media_id": media_id,
+        "fanout_id": fanout_id,
+        "status": "enqueued",
+        "jobs": [
+            {
+                "job_id": o["job_id"],
+                "target": o["target"],
+                "estimated_cost_seconds": o["estimated_cost"],
+            }
+            for o in outputs
+        ],
+        "estimated_cost_seconds": round(sum(o["estimated_cost"] for o in outputs), 2),
+    }
+
 @app.get("/jobs/{job_id}/status")
-def job_status(
+async def job_status(
     job_id: str,
     media_id: Optional[str] = None,
     user = Depends(current_user)
 ):
     # Permite pasar media_id para evitar la búsqueda por array_contains
-    media = jobs.get_media_entry(media_id) if media_id else jobs.get_media_by_job_id(job_id)
+    media = await (jobs.get_media_entry(media_id) if media_id else jobs.get_media_by_job_id(job_id))
     if not media:
         raise HTTPException(404, "No se encontró media para este job")
 
@@ -375,7 +781,8 @@ def _resolve_media_output_for_job(media_entry: dict, job_id: Optional[str]) -> T
     if target in ("mp3", "mp4"):
         object_name = f"{output_prefix}/output.{target}"
     elif target == "hls":
-        object_name = f"{output_prefix}/index.m3u8"
+        # HLS adaptativo publica master.m3u8; el worker guarda el nombre real
+        object_name = job_details.get("output_object") or f"{output_prefix}/index.m3u8"
     else:
         raise HTTPException(
             status_code=500,
@@ -385,7 +792,7 @@ def _resolve_media_output_for_job(media_entry: dict, job_id: Optional[str]) -> T
     return bucket, object_name, target, target_job_id
 
 @app.get("/media/{media_id}/share")
-def share_media(
+async def share_media(
     media_id: str,
     job_id: Optional[str] = None,
     user = Depends(current_user)
@@ -395,7 +802,7 @@ def share_media(
     Si 'job_id' no se provee, busca el primer job completado.
     """
     # 1. Obtener media_entry de Firestore
-    media_entry = jobs.get_media_entry(media_id)
+    media_entry = await jobs.get_media_entry(media_id)
     if not media_entry:
         raise HTTPException(status_code=404, detail="Media no encontrado")
 
@@ -425,7 +832,7 @@ def share_media(
 
 
 @app.post("/media/{media_id}/share-with-user")
-def share_with_user(
+async def share_with_user(
     media_id: str,
     payload: ShareWithUserRequest,
     user = Depends(current_user),
@@ -437,11 +844,11 @@ def share_with_user(
     - Verifica que el job_id indicado pertenezca a ese media.
     - Agrega al destinatario en el array 'shared_with' y en un array 'shares'.
     """
-    db = get_db()
+    db = async_db()
 
     # 1. Obtener el documento de media
     media_ref = db.collection("media").document(media_id)
-    media_doc = media_ref.get()
+    media_doc = await media_ref.get()
     if not media_doc.exists:
         raise HTTPException(status_code=404, detail="Media no existe")
 
@@ -459,7 +866,10 @@ def share_with_user(
     username_to_share = payload.username_to_share.strip()
     users_ref = db.collection("users")
     target_stream = users_ref.where("username", "==", username_to_share).limit(1).stream()
-    target_doc = next(target_stream, None)
+    target_doc = None
+    async for doc in target_stream:
+        target_doc = doc
+        break
 
     if not target_doc:
         raise HTTPException(status_code=404, detail="Usuario destino no existe")
@@ -494,7 +904,7 @@ def share_with_user(
     if share_entry not in shares:
         shares.append(share_entry)
 
-    media_ref.update(
+    await media_ref.update(
         {
             "shared_with": shared_with,
             "shares": shares,
@@ -512,19 +922,16 @@ def share_with_user(
 
 
 @app.get("/media/shared-with-me")
-def media_shared_with_me(user = Depends(current_user)):
+async def media_shared_with_me(user = Depends(current_user)):
     """
     Devuelve la lista de medias que han sido compartidos con el usuario actual.
     Busca en Firestore documentos 'media' donde 'shared_with' contenga el id del usuario.
     """
-    db = get_db()
-
-    media_ref = db.collection("media")
+    media_ref = async_db().collection("media")
     query = media_ref.where("shared_with", "array_contains", user["id"])
-    docs = list(query.stream())
 
     items = []
-    for d in docs:
+    async for d in query.stream():
         data = d.to_dict() or {}
         items.append(
             {
@@ -541,18 +948,131 @@ def media_shared_with_me(user = Depends(current_user)):
 
 
 
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Headers de la respuesta de MinIO que /stream reenvía tal cual
+STREAM_PASSTHROUGH_HEADERS = ("content-length", "content-range", "etag", "last-modified")
+
+
+def _stream_minio_headers(
+    range_: Optional[str],
+    if_range: Optional[str],
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> dict:
+    """
+    Headers condicionales y de rango para el GET a MinIO. If-Range no lo
+    entiende S3: se traduce a If-Match / If-Unmodified-Since (si no se
+    cumple, MinIO responde 412 y se pide el objeto entero).
+    """
+    headers = {}
+    # S3 no soporta multirango: en ese caso se responde el objeto entero
+    if range_ and "," not in range_:
+        if_range = (if_range or "").strip()
+        if not if_range:
+            headers["Range"] = range_
+        elif if_range.startswith('"'):
+            headers["Range"] = range_
+            headers["If-Match"] = if_range
+        elif not if_range.startswith("W/"):  # un ETag débil nunca valida un rango
+            headers["Range"] = range_
+            headers["If-Unmodified-Since"] = if_range
+    if if_none_match:
+        headers["If-None-Match"] = if_none_match
+    elif if_modified_since:
+        headers["If-Modified-Since"] = if_modified_since
+    return headers
+
+
+async def _proxy_object(
+    bucket: str,
+    object_name: str,
+    *,
+    media_type: str,
+    cache_control: str,
+    range_: Optional[str],
+    if_range: Optional[str],
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+) -> Response:
+    """
+    Reenvía un objeto de MinIO (o el rango pedido) en streaming: 200/206/304
+    según responda MinIO, 416 si el rango queda fuera del archivo.
+    """
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": cache_control}
+
+    # Obtener objeto (o el rango pedido) desde MinIO (sin bloquear: ver object_store.py)
+    minio_headers = _stream_minio_headers(range_, if_range, if_none_match, if_modified_since)
+    try:
+        try:
+            obj = await object_store.open_object(bucket, object_name, minio_headers)
+        except ObjectStoreError as e:
+            if e.status_code != 412 or "Range" not in minio_headers:
+                raise
+            # El objeto cambió desde el If-Range: se manda entero
+            for name in ("Range", "If-Match", "If-Unmodified-Since"):
+                minio_headers.pop(name, None)
+            obj = await object_store.open_object(bucket, object_name, minio_headers)
+    except ObjectStoreError as e:
+        if e.status_code == 416:
+            try:
+                stat = await object_store.stat_object(bucket, object_name)
+                headers["Content-Range"] = f"bytes */{stat.size}"
+            except (ObjectStoreError, httpx.HTTPError):
+                pass
+            return Response(status_code=416, headers=headers)
+        if e.status_code == 404:
+            raise HTTPException(status_code=404, detail="Archivo no encontrado en MinIO")
+        print(f"Error al obtener objeto de MinIO: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="No se pudo obtener el archivo desde MinIO"
+        )
+    except (httpx.HTTPError, OSError) as e:
+        print(f"Error al obtener objeto de MinIO: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail="No se pudo obtener el archivo desde MinIO"
+        )
+
+    for name in STREAM_PASSTHROUGH_HEADERS:
+        if name in obj.headers:
+            headers[name] = obj.headers[name]
+
+    if obj.status_code == 304:
+        await obj.aclose()
+        headers.pop("content-length", None)
+        return Response(status_code=304, headers=headers)
+
+    # Stream (200 o 206) en chunks de 32KB, con los bytes tal cual de MinIO
+    return StreamingResponse(
+        obj.aiter_raw(32 * 1024),
+        status_code=obj.status_code,
+        media_type=media_type,
+        headers=headers,
+        background=BackgroundTask(obj.aclose),
+    )
+
+
 @app.get("/media/{media_id}/stream")
-def stream_media(
+async def stream_media(
     media_id: str,
     job_id: Optional[str] = None,
+    range_: Optional[str] = Header(None, alias="range"),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
 ):
     """
     Devuelve un streaming del archivo convertido (mp3/mp4)
     para que el frontend lo use en el <audio> sin necesitar Authorization.
     Es equivalente a una URL presignada: quien tenga media_id + job_id puede acceder.
+
+    Soporta Range (206, un GET con rango a MinIO: saltar en el reproductor no
+    vuelve a bajar desde el byte 0), If-Range, y ETag / Last-Modified con 304.
+    Los jobs HLS redirigen a /media/{media_id}/hls/.
     """
     # 1. Obtener media_entry
-    media_entry = jobs.get_media_entry(media_id)
+    media_entry = await jobs.get_media_entry(media_id)
     if not media_entry:
         raise HTTPException(status_code=404, detail="Media no encontrado")
 
@@ -562,18 +1082,13 @@ def stream_media(
         job_id
     )
 
-    # 3. Obtener objeto desde MinIO
-    client = jobs.get_minio_client()
-    try:
-        obj = client.get_object(bucket, object_name)
-    except S3Error as e:
-        print(f"Error al obtener objeto de MinIO: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail="No se pudo obtener el archivo desde MinIO"
-        )
+    if target == "hls":
+        output_prefix = media_entry["jobs"][target_job_id]["output_prefix"]
+        playlist = object_name[len(output_prefix) + 1:]
+        # Relativa: /media/{id}/stream -> /media/{id}/hls/<playlist>
+        return RedirectResponse(f"hls/{playlist}?job_id={target_job_id}", status_code=307)
 
-    # 4. Tipo de contenido según target
+    # 3. Tipo de contenido según target
     if target == "mp3":
         media_type = "audio/mpeg"
     elif target == "mp4":
@@ -581,6 +1096,236 @@ def stream_media(
     else:
         media_type = "application/octet-stream"
 
-    # 5. Devolver stream en chunks de 32KB
-    return StreamingResponse(obj.stream(32 * 1024), media_type=media_type)
+    # 4. Reenviar desde MinIO. El resultado de un job no cambia; sin job_id
+    # puede pasar a ser otro job
+    return await _proxy_object(
+        bucket,
+        object_name,
+        media_type=media_type,
+        cache_control=IMMUTABLE_CACHE_CONTROL if job_id else "no-cache",
+        range_=range_,
+        if_range=if_range,
+        if_none_match=if_none_match,
+        if_modified_since=if_modified_since,
+    )
+
+
+@app.get("/media/{media_id}/hls/{path:path}")
+async def media_hls(
+    media_id: str,
+    path: str,
+    job_id: Optional[str] = None,
+    range_: Optional[str] = Header(None, alias="range"),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+):
+    """
+    Reproducción HLS de una conversión `hls`: playlists (master.m3u8 o
+    index.m3u8) con su MIME y las URIs reescritas, y segmentos reenviados
+    desde MinIO con caché inmutable (ver hls_delivery.py). Sin Authorization,
+    como /stream. Sin job_id redirige a la misma ruta con el primer job HLS
+    terminado, para que todas las URIs queden fijadas a una conversión.
+    """
+    if not hls_delivery.valid_path(path):
+        raise HTTPException(status_code=404, detail="Archivo HLS no encontrado")
+
+    media_entry = await jobs.get_media_entry(media_id)
+    if not media_entry:
+        raise HTTPException(status_code=404, detail="Media no encontrado")
+
+    all_jobs = media_entry.get("jobs", {}) or {}
+    if not job_id:
+        job_id = next(
+            (
+                j_id for j_id, j_details in all_jobs.items()
+                if j_details.get("status") == "done" and j_details.get("target") == "hls"
+            ),
+            None,
+        )
+        if not job_id:
+            raise HTTPException(status_code=404, detail="No hay conversiones HLS para este media")
+        # Relativa: se resuelve contra el directorio de la ruta pedida
+        return RedirectResponse(f"{posixpath.basename(path)}?job_id={job_id}", status_code=307)
+
+    bucket, _, target, job_id = _resolve_media_output_for_job(media_entry, job_id)
+    if target != "hls":
+        raise HTTPException(status_code=404, detail=f"El job {job_id} no es HLS")
+    output_prefix = all_jobs[job_id]["output_prefix"]
+    object_name = f"{output_prefix}/{path}"
+    suffix = posixpath.splitext(path)[1]
+
+    if suffix != hls_delivery.PLAYLIST_SUFFIX:
+        return await _proxy_object(
+            bucket,
+            object_name,
+            media_type=hls_delivery.HLS_CONTENT_TYPES[suffix],
+            cache_control=IMMUTABLE_CACHE_CONTROL,
+            range_=range_,
+            if_range=if_range,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+        )
+
+    # Con URLs firmadas un 304 devolvería una playlist con firmas vencidas
+    cache_control = hls_delivery.playlist_cache_control()
+    data, headers = await _immutable_object(
+        bucket,
+        object_name,
+        None if cache_control else if_none_match,
+        "Playlist no encontrada",
+    )
+    if data is None:
+        return Response(status_code=304, headers=headers)
+    if cache_control:
+        headers = {"Cache-Control": cache_control}
+    playlist = await run_in_threadpool(
+        hls_delivery.rewrite_playlist,
+        data.decode("utf-8"), path, bucket, output_prefix, job_id,
+    )
+    return Response(
+        content=playlist,
+        media_type=hls_delivery.HLS_CONTENT_TYPES[suffix],
+        headers=headers,
+    )
+
+
+def _done_job_with(all_jobs: dict, field: str) -> Optional[str]:
+    """Primer job terminado del media que tenga `field` (peaks_object, previews_prefix)."""
+    return next(
+        (
+            j_id for j_id, j_details in all_jobs.items()
+            if j_details.get("status") == "done" and j_details.get(field)
+        ),
+        None,
+    )
+
+
+async def _immutable_object(
+    bucket: str,
+    object_name: str,
+    if_none_match: Optional[str],
+    not_found: str,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL,
+) -> Tuple[Optional[bytes], dict]:
+    """
+    Lee un archivo auxiliar de una conversión (no cambia nunca) y arma los
+    headers de caché: ETag de MinIO y Cache-Control (inmutable por defecto;
+    "no-cache" si la URL no fija el job y puede pasar a otra conversión).
+    Devuelve (None, headers) si el ETag coincide con If-None-Match (-> 304).
+    """
+    try:
+        stat = await object_store.stat_object(bucket, object_name)
+    except ObjectStoreError as e:
+        print(f"Error al obtener {object_name} de MinIO: {e}")
+        raise HTTPException(status_code=404, detail=not_found)
+
+    etag = f'"{stat.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+    }
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or etag in (tag.strip() for tag in if_none_match.split(","))
+    ):
+        return None, headers
+
+    try:
+        data = await object_store.read_object(bucket, object_name)
+    except ObjectStoreError as e:
+        print(f"Error al obtener {object_name} de MinIO: {e}")
+        raise HTTPException(status_code=404, detail=not_found)
+    return data, headers
+
+
+@app.get("/media/{media_id}/peaks")
+async def media_peaks(
+    media_id: str,
+    job_id: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Picos de la forma de onda (peaks.bin, formato en worker/waveform.py) de
+    una conversión mp3, para dibujarla sin decodificar el audio en el navegador.
+    Igual que /stream no pide Authorization. Si no se indica job_id se usa el
+    primer job terminado que tenga picos. El archivo de un job no cambia: con
+    job_id se cachea como inmutable; sin él (el job elegido puede cambiar si
+    se reconvierte el media) con no-cache. En ambos casos se responde 304 si
+    el ETag coincide.
+    """
+    media_entry = await jobs.get_media_entry(media_id)
+    if not media_entry:
+        raise HTTPException(status_code=404, detail="Media no encontrado")
+
+    all_jobs = media_entry.get("jobs", {}) or {}
+    cache_control = IMMUTABLE_CACHE_CONTROL if job_id else "no-cache"
+    if not job_id:
+        job_id = _done_job_with(all_jobs, "peaks_object")
+        if not job_id:
+            raise HTTPException(status_code=404, detail="No hay forma de onda para este media")
+
+    bucket, _, _, job_id = _resolve_media_output_for_job(media_entry, job_id)
+    peaks_object = all_jobs[job_id].get("peaks_object")
+    if not peaks_object:
+        raise HTTPException(status_code=404, detail=f"El job {job_id} no tiene forma de onda")
+
+    data, headers = await _immutable_object(
+        bucket, peaks_object, if_none_match, "Forma de onda no encontrada", cache_control
+    )
+    if data is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="application/octet-stream", headers=headers)
+
+
+# Archivos que genera worker/previews.py en <output_prefix>/previews/
+PREVIEW_NAME_RE = re.compile(r"^(poster\.jpg|thumbnails\.vtt|sprite_\d{3,}\.jpg)$")
+PREVIEW_SPRITE_REF_RE = re.compile(r"^(sprite_\d{3,}\.jpg)(#xywh=)", re.MULTILINE)
+
+
+@app.get("/media/{media_id}/previews/{name}")
+async def media_previews(
+    media_id: str,
+    name: str,
+    job_id: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Vistas previas de un video (mp4/hls): poster.jpg, las hojas de
+    miniaturas sprite_NNN.jpg y thumbnails.vtt, la pista WebVTT que el
+    reproductor usa para mostrar la miniatura al recorrer la barra.
+    Mismas reglas que /peaks (sin Authorization, primer job con vistas previas
+    si no hay job_id, ETag; caché inmutable sólo con job_id). Las referencias a las hojas
+    dentro del .vtt llevan el job_id para que apunten a la misma conversión.
+    """
+    if not PREVIEW_NAME_RE.match(name):
+        raise HTTPException(status_code=404, detail="Vista previa no encontrada")
+
+    media_entry = await jobs.get_media_entry(media_id)
+    if not media_entry:
+        raise HTTPException(status_code=404, detail="Media no encontrado")
+
+    all_jobs = media_entry.get("jobs", {}) or {}
+    cache_control = IMMUTABLE_CACHE_CONTROL if job_id else "no-cache"
+    if not job_id:
+        job_id = _done_job_with(all_jobs, "previews_prefix")
+        if not job_id:
+            raise HTTPException(status_code=404, detail="No hay vistas previas para este media")
+
+    bucket, _, _, job_id = _resolve_media_output_for_job(media_entry, job_id)
+    previews_prefix = all_jobs[job_id].get("previews_prefix")
+    if not previews_prefix:
+        raise HTTPException(status_code=404, detail=f"El job {job_id} no tiene vistas previas")
+
+    data, headers = await _immutable_object(
+        bucket, f"{previews_prefix}/{name}", if_none_match, "Vista previa no encontrada",
+        cache_control,
+    )
+    if data is None:
+        return Response(status_code=304, headers=headers)
+    if name.endswith(".vtt"):
+        vtt = data.decode("utf-8")
+        vtt = PREVIEW_SPRITE_REF_RE.sub(rf"\1?job_id={job_id}\2", vtt)
+        return Response(content=vtt, media_type="text/vtt", headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
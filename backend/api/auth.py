@@ -2,8 +2,9 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from passlib.hash import pbkdf2_sha256
+from starlette.concurrency import run_in_threadpool
 import jwt, os, datetime
-from .firebase_db import get_user_by_username, create_user as fb_create_user
+from .firebase_db import get_user_by_username_async, create_user_async as fb_create_user
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
@@ -14,20 +15,25 @@ def _hash_pwd(pwd: str) -> str:
     # pbkdf2_sha256 no tiene el límite de 72 bytes de bcrypt
     return pbkdf2_sha256.hash(pwd)
 
-def create_user(username: str, password: str):
+# register/token son async: Firestore va por el cliente asíncrono y sólo
+# pbkdf2 (CPU, a propósito lento) pasa por el threadpool.
+async def create_user(username: str, password: str):
     if not username or len(username) < 3:
         raise HTTPException(status_code=422, detail="username inválido (min 3)")
     if not password or len(password) < 8:
         raise HTTPException(status_code=422, detail="password inválido (min 8)")
     try:
-        u = fb_create_user(username=username, hashed_password=_hash_pwd(password))
+        hashed = await run_in_threadpool(_hash_pwd, password)
+        u = await fb_create_user(username=username, hashed_password=hashed)
         return {"id": u["id"], "username": u["username"]}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-def authenticate(username: str, password: str):
-    u = get_user_by_username(username)
-    if not u or not pbkdf2_sha256.verify(password, u.get("hashed_password", "")):
+async def authenticate(username: str, password: str):
+    u = await get_user_by_username_async(username)
+    if not u or not await run_in_threadpool(
+        pbkdf2_sha256.verify, password, u.get("hashed_password", "")
+    ):
         return None
     payload = {
         "sub": u["username"],
@@ -37,7 +43,8 @@ def authenticate(username: str, password: str):
     token = jwt.encode(payload, SECRET, algorithm="HS256")
     return token
 
-def current_user(token: str = Depends(oauth2_scheme)):
+async def current_user(token: str = Depends(oauth2_scheme)):
+    # async: decodificar el JWT es inmediato y así no pasa por el threadpool
     try:
         data = jwt.decode(token, SECRET, algorithms=["HS256"])
     except jwt.PyJWTError:
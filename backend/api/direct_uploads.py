@@ -0,0 +1,236 @@
+# backend/api/direct_uploads.py
+"""
+Subidas directas a MinIO: la API sólo firma URLs y valida el resultado, los
+bytes van del cliente a MinIO sin pasar por ella.
+
+    POST   /media/direct-uploads                 nombre y tamaño -> URL(s) firmada(s)
+    (cliente) PUT <url> ...                       sube el archivo a MinIO
+    POST   /media/direct-uploads/{id}/complete   HEAD del objeto y alta del media
+    DELETE /media/direct-uploads/{id}            la descarta
+
+Hasta DIRECT_UPLOAD_MULTIPART_THRESHOLD bytes se entrega una sola URL de PUT
+para el objeto entero. Por encima se abre una subida multipart y se firma una
+URL por parte (de UPLOAD_CHUNK_SIZE bytes, como las subidas reanudables); al
+finalizar, la API lista las partes en MinIO (el cliente no tiene que leer los
+ETags) y cierra el objeto.
+
+El estado vive en Redis (direct_uploads:{id}) hasta que expiran las URLs (más
+un margen); si para entonces no se finalizó, upload_sweeper.py aborta la
+subida multipart o borra el objeto. El
+sha256 no se calcula: la API no ve los bytes, y la caché de conversiones usa
+entonces ETag + tamaño del objeto como huella del original.
+"""
+import os
+import math
+import time
+import uuid
+import datetime
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+import redis.asyncio
+from starlette.concurrency import run_in_threadpool
+
+from . import object_store, upload_sweeper
+from .object_store import ObjectInfo, ObjectStoreError
+from .upload_sessions import UPLOAD_CHUNK_SIZE, MAX_UPLOAD_PARTS, UploadSessionError
+
+DIRECT_UPLOAD_URL_TTL = int(os.getenv("DIRECT_UPLOAD_URL_TTL", "3600"))
+DIRECT_UPLOAD_MULTIPART_THRESHOLD = int(
+    os.getenv("DIRECT_UPLOAD_MULTIPART_THRESHOLD", str(256 * 1024**2))
+)
+# Máximo de un PUT simple en S3
+MAX_SINGLE_PUT_SIZE = 5 * 1024**3
+
+
+@dataclass
+class DirectUpload:
+    upload_id: str
+    user_id: str
+    filename: str
+    content_type: str
+    file_ext: str
+    bucket: str
+    object_name: str
+    size: int
+    # Vacío si es un PUT simple
+    multipart_id: str
+    part_size: int
+    created_at: float
+
+    @property
+    def total_parts(self) -> int:
+        return math.ceil(self.size / self.part_size)
+
+    def part_length(self, number: int) -> int:
+        return min(self.part_size, self.size - (number - 1) * self.part_size)
+
+
+def _key(upload_id: str) -> str:
+    return f"direct_uploads:{upload_id}"
+
+
+def _sweeper_entry(upload: DirectUpload) -> str:
+    return upload_sweeper.entry(
+        _key(upload.upload_id), upload.bucket, upload.object_name, upload.multipart_id
+    )
+
+
+def _instructions(upload: DirectUpload) -> Dict[str, Any]:
+    """URLs firmadas que el cliente usa para subir (cálculo local, sin red)."""
+    expires = datetime.timedelta(seconds=DIRECT_UPLOAD_URL_TTL)
+    info = {
+        "upload_id": upload.upload_id,
+        "size": upload.size,
+        "expires_in": DIRECT_UPLOAD_URL_TTL,
+        "multipart": bool(upload.multipart_id),
+    }
+    if not upload.multipart_id:
+        info["method"] = "PUT"
+        info["url"] = object_store.presigned_url(
+            "PUT", upload.bucket, upload.object_name, expires=expires
+        )
+        return info
+    info["part_size"] = upload.part_size
+    info["parts"] = [
+        {
+            "part_number": n,
+            "offset": (n - 1) * upload.part_size,
+            "size": upload.part_length(n),
+            "url": object_store.presigned_url(
+                "PUT", upload.bucket, upload.object_name,
+                {"partNumber": str(n), "uploadId": upload.multipart_id},
+                expires=expires,
+            ),
+        }
+        for n in range(1, upload.total_parts + 1)
+    ]
+    return info
+
+
+async def create_direct_upload(
+    r: redis.asyncio.Redis,
+    *,
+    user_id: str,
+    filename: str,
+    size: int,
+    content_type: Optional[str],
+    file_ext: str,
+    bucket: str,
+    object_name: str,
+) -> Dict[str, Any]:
+    """Registra la subida y devuelve las URLs firmadas para hacerla."""
+    if size <= 0:
+        raise UploadSessionError(400, "El tamaño del archivo debe ser mayor que 0")
+    multipart = size > min(DIRECT_UPLOAD_MULTIPART_THRESHOLD, MAX_SINGLE_PUT_SIZE)
+    if multipart and math.ceil(size / UPLOAD_CHUNK_SIZE) > MAX_UPLOAD_PARTS:
+        raise UploadSessionError(
+            413, f"Archivo demasiado grande (máximo {UPLOAD_CHUNK_SIZE * MAX_UPLOAD_PARTS} bytes)"
+        )
+    content_type = content_type or "application/octet-stream"
+    await object_store.ensure_bucket(bucket)
+    multipart_id = ""
+    if multipart:
+        multipart_id = await object_store.create_multipart_upload(bucket, object_name, content_type)
+    upload = DirectUpload(
+        upload_id=str(uuid.uuid4()),
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        file_ext=file_ext,
+        bucket=bucket,
+        object_name=object_name,
+        size=size,
+        multipart_id=multipart_id,
+        part_size=UPLOAD_CHUNK_SIZE if multipart else size,
+        created_at=time.time(),
+    )
+    pipe = r.pipeline()
+    pipe.hset(_key(upload.upload_id), mapping={k: str(v) for k, v in asdict(upload).items()})
+    # Un margen tras expirar las URLs para poder finalizar la última subida
+    pipe.expire(_key(upload.upload_id), DIRECT_UPLOAD_URL_TTL + 3600)
+    upload_sweeper.track(pipe, _sweeper_entry(upload), DIRECT_UPLOAD_URL_TTL + 3600)
+    await pipe.execute()
+    # Hasta 10000 firmas HMAC: fuera del event loop
+    return await run_in_threadpool(_instructions, upload)
+
+
+async def get_direct_upload(r: redis.asyncio.Redis, upload_id: str, user_id: str) -> DirectUpload:
+    raw = await r.hgetall(_key(upload_id))
+    if not raw:
+        raise UploadSessionError(404, "Subida no encontrada o expirada")
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    if data["user_id"] != user_id:
+        raise UploadSessionError(403, "No autorizado para esta subida")
+    return DirectUpload(
+        **{
+            **data,
+            "size": int(data["size"]),
+            "part_size": int(data["part_size"]),
+            "created_at": float(data["created_at"]),
+        }
+    )
+
+
+async def complete_direct_upload(r: redis.asyncio.Redis, upload: DirectUpload) -> ObjectInfo:
+    """
+    Cierra la subida multipart (si la hay) y comprueba el objeto con un HEAD.
+    409 si faltan partes, el objeto no está o no tiene el tamaño declarado.
+    """
+    lock_key = f"{_key(upload.upload_id)}:completing"
+    if not await r.set(lock_key, "1", nx=True, ex=600):
+        raise UploadSessionError(409, "La subida ya se está finalizando")
+    try:
+        parts = None
+        if upload.multipart_id:
+            try:
+                parts = await object_store.list_parts(
+                    upload.bucket, upload.object_name, upload.multipart_id
+                )
+            except ObjectStoreError as e:
+                # Ya cerrada por un intento anterior: sólo falta el HEAD
+                if e.status_code != 404:
+                    raise
+        if parts is not None:
+            bad = [
+                n for n in range(1, upload.total_parts + 1)
+                if n not in parts or parts[n][1] != upload.part_length(n)
+            ]
+            if bad:
+                raise UploadSessionError(409, f"Faltan partes o están incompletas: {bad[:20]}")
+            await object_store.complete_multipart_upload(
+                upload.bucket, upload.object_name, upload.multipart_id,
+                [(n, etag) for n, (etag, _) in parts.items() if n <= upload.total_parts],
+            )
+
+        try:
+            info = await object_store.stat_object(upload.bucket, upload.object_name)
+        except ObjectStoreError as e:
+            if e.status_code == 404:
+                raise UploadSessionError(409, "El archivo todavía no se subió")
+            raise
+        if info.size != upload.size:
+            raise UploadSessionError(
+                409, f"El objeto subido tiene {info.size} bytes, se declararon {upload.size}"
+            )
+        await _forget(r, upload)
+        return info
+    finally:
+        await r.delete(lock_key)
+
+
+async def abort_direct_upload(r: redis.asyncio.Redis, upload: DirectUpload) -> None:
+    if upload.multipart_id:
+        await object_store.abort_multipart_upload(
+            upload.bucket, upload.object_name, upload.multipart_id
+        )
+    else:
+        await object_store.delete_object(upload.bucket, upload.object_name)
+    await _forget(r, upload)
+
+
+async def _forget(r: redis.asyncio.Redis, upload: DirectUpload) -> None:
+    pipe = r.pipeline()
+    pipe.delete(_key(upload.upload_id))
+    upload_sweeper.untrack(pipe, _sweeper_entry(upload))
+    await pipe.execute()
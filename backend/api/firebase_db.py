@@ -1,5 +1,10 @@
 import os
+import time
+import logging
+import threading
+from collections import OrderedDict
 from typing import Optional, Dict, Any
+from google.api_core import exceptions as gexc
 from google.cloud import firestore
 # (Opcional) para filtros sin warning:
 # from google.cloud.firestore_v1.base_query import FieldFilter
@@ -7,6 +12,8 @@ from google.cloud import firestore
 PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 _db = None
 
+logger = logging.getLogger(__name__)
+
 def db() -> firestore.Client:
     """Cliente cacheado de Firestore (compatible con tu código actual)."""
     global _db
@@ -17,6 +24,21 @@ def db() -> firestore.Client:
 # Alias conveniente (así puedes from firebase_db import get_db)
 get_db = db
 
+_async_db = None
+
+def async_db() -> firestore.AsyncClient:
+    """
+    Cliente asíncrono de Firestore para los endpoints `async def` de la API:
+    las lecturas no ocupan un hilo del threadpool mientras esperan a Firestore.
+    Se crea dentro del event loop de uvicorn (la primera vez que se usa).
+    """
+    global _async_db
+    if _async_db is None:
+        _async_db = (
+            firestore.AsyncClient(project=PROJECT_ID) if PROJECT_ID else firestore.AsyncClient()
+        )
+    return _async_db
+
 # ---------------------------
 # Usuarios (lo tuyo, intacto)
 # ---------------------------
@@ -47,6 +69,25 @@ def create_user(username: str, hashed_password: str) -> Dict[str, Any]:
     data["id"] = ref.id
     return data
 
+async def get_user_by_username_async(username: str) -> Optional[Dict[str, Any]]:
+    """get_user_by_username para los endpoints async (cliente asíncrono)."""
+    docs = async_db().collection("users").where("username", "==", username).limit(1).stream()
+    async for d in docs:
+        data = d.to_dict()
+        data["id"] = d.id
+        return data
+    return None
+
+async def create_user_async(username: str, hashed_password: str) -> Dict[str, Any]:
+    existing = await get_user_by_username_async(username)
+    if existing:
+        raise ValueError("Usuario ya existe")
+    ref = async_db().collection("users").document()
+    await ref.set({"username": username, "hashed_password": hashed_password})
+    data = (await ref.get()).to_dict() or {}
+    data["id"] = ref.id
+    return data
+
 # --------------------------------------
 # Media + Jobs (helpers para API/worker)
 # --------------------------------------
@@ -117,3 +158,194 @@ def mark_media_job_failed(media_id: str, job_id: str, *, details: Optional[str]
     if details:
         payload["details"] = details
     update_media_job_fields(media_id, job_id, **payload)
+
+# --------------------------------------------------------
+# Escritor de estados en segundo plano (workers)
+# --------------------------------------------------------
+
+# Cada cuánto se vuelcan a Firestore los cambios acumulados (segundos)
+FIRESTORE_FLUSH_INTERVAL = float(os.getenv("FIRESTORE_FLUSH_INTERVAL", "1.0"))
+FIRESTORE_WRITE_RETRIES = int(os.getenv("FIRESTORE_WRITE_RETRIES", "5"))
+# Firestore admite hasta 500 escrituras por batch
+FIRESTORE_BATCH_SIZE = 500
+
+# Un estado sólo avanza: un 'processing' que llega después de 'done' es viejo
+_STATUS_RANK = {"enqueued": 0, "processing": 1, "done": 2, "failed": 2}
+# Errores que no se arreglan reintentando (p.ej. el media se borró)
+_REJECTED_ERRORS = (gexc.NotFound, gexc.InvalidArgument, gexc.FailedPrecondition)
+
+
+def _merge_value(old: Any, new: Any) -> Any:
+    """El valor nuevo pisa al viejo, salvo incrementos, que se suman."""
+    if isinstance(old, firestore.Increment) and isinstance(new, firestore.Increment):
+        return firestore.Increment(old.value + new.value)
+    return new
+
+
+class JobStatusWriter:
+    """
+    Escribe en segundo plano los cambios de jobs.<job_id>.* de los workers:
+    - update_job() sólo encola: el slot que convierte nunca espera a Firestore,
+    - los cambios de un mismo media se fusionan en una sola escritura por
+      volcado (respeta el límite de escrituras por documento),
+    - descarta transiciones redundantes (done -> done) o viejas (done -> processing),
+    - vuelca cada FIRESTORE_FLUSH_INTERVAL con batches y reintentos; si
+      Firestore no responde los cambios vuelven a la cola sin pisar otros más nuevos.
+    Llamar a close() al apagar para no perder lo pendiente.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = FIRESTORE_FLUSH_INTERVAL,
+        max_retries: int = FIRESTORE_WRITE_RETRIES,
+    ):
+        self.flush_interval = flush_interval
+        self.max_retries = max(1, max_retries)
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Dict[str, Any]] = {}   # media_id -> {ruta de campo: valor}
+        self._statuses: "OrderedDict[tuple, str]" = OrderedDict()  # último estado por job
+        self._inflight = False
+        self._stopped = False
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- API para el worker ----
+
+    def update_job(self, media_id: str, job_id: str, **fields) -> None:
+        """Encola cambios de jobs.{job_id}.* (equivalente asíncrono de update_media_job_fields)."""
+        if not media_id or not job_id or not fields:
+            return
+        with self._cond:
+            status = fields.get("status")
+            if status is not None:
+                known = self._statuses.get((media_id, job_id))
+                if known is not None and _STATUS_RANK.get(status, 0) < _STATUS_RANK.get(known, 0):
+                    return
+                if status == known:
+                    fields = {k: v for k, v in fields.items() if k != "status"}
+                    if set(fields) <= {"updated_at"}:
+                        return
+                self._remember_status(media_id, job_id, status)
+
+            doc = self._pending.setdefault(media_id, {})
+            for key, value in fields.items():
+                path = f"jobs.{job_id}.{key}"
+                doc[path] = _merge_value(doc.get(path), value)
+            self._start()
+            self._cond.notify_all()
+
+    def mark_processing(self, media_id: str, job_id: str) -> None:
+        self.update_job(media_id, job_id, status="processing", updated_at=firestore.SERVER_TIMESTAMP)
+
+    def mark_done(self, media_id: str, job_id: str, **fields) -> None:
+        self.update_job(
+            media_id, job_id, **fields, status="done", updated_at=firestore.SERVER_TIMESTAMP
+        )
+
+    def mark_failed(self, media_id: str, job_id: str, *, details: Optional[str] = None) -> None:
+        payload = {"status": "failed", "updated_at": firestore.SERVER_TIMESTAMP}
+        if details:
+            payload["details"] = details
+        self.update_job(media_id, job_id, **payload)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que todo lo encolado hasta ahora esté escrito. False si venció el timeout."""
+        self._wake.set()
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._inflight, timeout
+            )
+
+    def close(self, timeout: Optional[float] = 30) -> None:
+        """Vuelca lo pendiente y detiene el hilo de escritura."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ---- internos ----
+
+    def _remember_status(self, media_id: str, job_id: str, status: str) -> None:
+        self._statuses[(media_id, job_id)] = status
+        self._statuses.move_to_end((media_id, job_id))
+        while len(self._statuses) > 10000:
+            self._statuses.popitem(last=False)
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="firestore-status-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if not self._pending and self._stopped:
+                    return
+            # Deja que se acumulen más cambios de los mismos documentos
+            if not self._stopped:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+            with self._cond:
+                updates, self._pending = self._pending, {}
+                self._inflight = True
+            try:
+                items = list(updates.items())
+                for i in range(0, len(items), FIRESTORE_BATCH_SIZE):
+                    self._write(items[i:i + FIRESTORE_BATCH_SIZE])
+            except Exception as e:
+                logger.exception(f"[status-writer] unexpected error: {e}")
+            finally:
+                with self._cond:
+                    self._inflight = False
+                    self._cond.notify_all()
+
+    def _write(self, items: list) -> None:
+        for attempt in range(self.max_retries):
+            try:
+                batch = db().batch()
+                for media_id, fields in items:
+                    batch.update(db().collection("media").document(media_id), fields)
+                batch.commit()
+                return
+            except _REJECTED_ERRORS as e:
+                # El batch es atómico: un documento inválido lo tumba entero.
+                # Se aíslan los documentos y se descarta sólo el rechazado.
+                if len(items) == 1:
+                    logger.error(f"[status-writer] dropped update for media {items[0][0]}: {e}")
+                    return
+                for item in items:
+                    self._write([item])
+                return
+            except Exception as e:
+                logger.warning(f"[status-writer] batch write failed (attempt {attempt + 1}): {e}")
+                if self._stopped and attempt + 1 >= self.max_retries:
+                    break
+                time.sleep(min(5.0, 0.2 * 2 ** attempt))
+
+        if self._stopped:
+            logger.error(f"[status-writer] giving up on {len(items)} media update(s) at shutdown")
+            return
+        # Firestore no responde: de vuelta a la cola, sin pisar cambios más nuevos
+        with self._cond:
+            for media_id, fields in items:
+                doc = self._pending.setdefault(media_id, {})
+                for path, value in fields.items():
+                    doc[path] = _merge_value(value, doc[path]) if path in doc else value
+
+
+_status_writer: Optional[JobStatusWriter] = None
+_status_writer_lock = threading.Lock()
+
+
+def get_job_status_writer() -> JobStatusWriter:
+    """Escritor de estados compartido por todo el proceso."""
+    global _status_writer
+    with _status_writer_lock:
+        if _status_writer is None:
+            _status_writer = JobStatusWriter()
+        return _status_writer
@@ -0,0 +1,118 @@
+# backend/api/form_stream.py
+"""
+Lectura en streaming de un archivo enviado como multipart/form-data.
+
+UploadFile hace que Starlette vuelque todo el cuerpo a un archivo temporal
+antes de llamar al endpoint. FormFileStream, en cambio, pasa el cuerpo por
+el parser incremental de python-multipart a medida que llega y entrega los
+bytes del campo de archivo por chunks, sin tocar disco:
+
+    form = FormFileStream(request, field="file")
+    filename, content_type = await form.open()
+    async for chunk in form.chunks():
+        ...
+"""
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+class FormStreamError(ValueError):
+    """El cuerpo no es un multipart válido o le falta el campo de archivo."""
+
+
+class FormFileStream:
+    def __init__(self, request: Request, field: str = "file"):
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise FormStreamError("Se esperaba multipart/form-data")
+        self.field = field
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self._body = request.stream()
+        self._parser = MultipartParser(params[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_started = False
+        self._file_done = False
+        self._pending: List[bytes] = []
+
+    # --- callbacks del parser ---
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        self._in_file = name == self.field and not self._file_started and b"filename" in options
+        if self._in_file:
+            self._file_started = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            content_type = self._headers.get(b"content-type")
+            self.content_type = content_type.decode("latin-1") if content_type else None
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    # --- lectura ---
+
+    async def _feed(self) -> bool:
+        """Pasa el siguiente chunk del cuerpo al parser; False si ya no hay más."""
+        while True:
+            try:
+                chunk = await self._body.__anext__()
+            except StopAsyncIteration:
+                return False
+            if chunk:
+                self._parser.write(chunk)
+                return True
+
+    async def open(self) -> Tuple[str, Optional[str]]:
+        """Lee hasta las cabeceras del archivo; devuelve (filename, content_type)."""
+        while not self._file_started:
+            if not await self._feed():
+                raise FormStreamError(f"Falta el campo de archivo '{self.field}'")
+        return self.filename, self.content_type
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Contenido del archivo, tal como llega."""
+        while True:
+            pending, self._pending = self._pending, []
+            for chunk in pending:
+                yield chunk
+            if self._file_done:
+                return
+            if not await self._feed():
+                raise FormStreamError("El cuerpo terminó antes que el archivo")
@@ -0,0 +1,93 @@
+# backend/api/hls_delivery.py
+"""
+Entrega de los resultados HLS a través de la API (GET /media/{id}/hls/...).
+
+El worker publica en <output_prefix>/ la misma estructura que escribe ffmpeg:
+index.m3u8 + seg_NNNNN.ts, o con ABR master.m3u8 + <variante>/index.m3u8 +
+<variante>/seg_NNNNN.ts. Las playlists se sirven con su MIME y con las URIs
+reescritas para que el reproductor pueda seguirlas:
+
+- Playlists (.m3u8): URI relativa con ?job_id=, así la resuelve contra la
+  ruta de la API y se queda en la misma conversión.
+- Segmentos: según HLS_SEGMENT_MODE,
+    proxy      URI relativa con ?job_id=; la API los reenvía desde MinIO con
+               caché inmutable (funciona aunque MinIO no sea accesible).
+    presigned  URL firmada de MinIO válida HLS_SEGMENT_URL_TTL segundos; los
+               bytes no pasan por la API (MINIO_ENDPOINT debe ser accesible
+               para el cliente, como con /share).
+"""
+import os
+import re
+import datetime
+import posixpath
+from typing import Optional
+
+from . import object_store
+
+HLS_SEGMENT_MODE = os.getenv("HLS_SEGMENT_MODE", "proxy").lower()
+HLS_SEGMENT_URL_TTL = int(os.getenv("HLS_SEGMENT_URL_TTL", "3600"))
+
+# Mismos tipos que sube worker/hls_publisher.py
+HLS_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+PLAYLIST_SUFFIX = ".m3u8"
+
+_PATH_PART_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.\-]*$")
+_URI_ATTR_RE = re.compile(r'URI="([^"]*)"')
+
+
+def valid_path(path: str) -> bool:
+    """Ruta relativa al output_prefix, sin '..' y con extensión HLS conocida."""
+    parts = path.split("/")
+    return (
+        all(_PATH_PART_RE.match(p) for p in parts)
+        and posixpath.splitext(path)[1] in HLS_CONTENT_TYPES
+    )
+
+
+def playlist_cache_control() -> Optional[str]:
+    """
+    Con URLs firmadas la playlist no puede cachearse más de lo que duran;
+    None = la de un archivo inmutable (la playlist de un job terminado no cambia).
+    """
+    if HLS_SEGMENT_MODE == "presigned":
+        return f"private, max-age={HLS_SEGMENT_URL_TTL // 2}"
+    return None
+
+
+def rewrite_playlist(
+    text: str,
+    playlist_path: str,
+    bucket: str,
+    output_prefix: str,
+    job_id: str,
+) -> str:
+    """Reescribe las URIs (líneas y atributos URI="...") de una playlist."""
+    base_dir = posixpath.dirname(playlist_path)
+    expires = datetime.timedelta(seconds=HLS_SEGMENT_URL_TTL)
+
+    def rewrite(uri: str) -> str:
+        # Absolutas (http://, /...) se dejan como están
+        if not uri or "://" in uri or uri.startswith("/"):
+            return uri
+        target = posixpath.normpath(posixpath.join(base_dir, uri))
+        if target.startswith(".."):
+            return uri
+        if HLS_SEGMENT_MODE == "presigned" and not target.endswith(PLAYLIST_SUFFIX):
+            return object_store.presigned_url(
+                "GET", bucket, f"{output_prefix}/{target}", expires=expires
+            )
+        return f"{uri}?job_id={job_id}"
+
+    lines = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            line = _URI_ATTR_RE.sub(lambda m: f'URI="{rewrite(m.group(1))}"', line)
+        elif line.strip():
+            line = rewrite(line.strip())
+        lines.append(line)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,361 @@
+# backend/api/job_queue.py
+"""
+Cola de trabajos confiable sobre Redis (la usan la API y los workers).
+
+Planificación: los jobs pendientes se atienden por menor score, con
+score = llegada + min(coste estimado * QUEUE_COST_WEIGHT, QUEUE_MAX_COST_DELAY).
+Es "el más corto primero" con envejecimiento: un job largo sólo cede el paso
+a jobs que lleguen, como mucho, QUEUE_MAX_COST_DELAY segundos después que él;
+pasado ese tiempo cualquier job nuevo queda detrás, así que nunca se queda sin
+atender. Con coste 0 el orden es FIFO.
+
+Un job no desaparece al tomarlo: queda "arrendado" (lease) con un plazo de
+visibilidad. El worker lo confirma (ack) al terminar; si el worker muere,
+el plazo vence y cualquier worker sano lo devuelve a la cola (reclaim).
+Tras QUEUE_MAX_ATTEMPTS arrendamientos fallidos pasa a la cola de muertos.
+
+Claves (para la cola "convert"):
+- convert:pending   zset job_id -> score (orden de atención)
+- convert:arrivals  zset job_id -> hora de llegada de los pendientes (lag)
+- convert:leases    zset job_id -> vencimiento del lease (epoch)
+- convert:jobs      hash job_id -> payload JSON
+- convert:attempts  hash job_id -> veces que se arrendó
+- convert:owners    hash job_id -> consumidor que lo tiene ("worker_a/slot0")
+- convert:dead      lista de payloads que agotaron los intentos
+
+Los jobs que quedaron en la lista de la versión anterior (RPUSH/BLPOP sobre
+la clave "convert") se pasan a esta estructura con migrate_legacy_list.
+"""
+import os
+import json
+import uuid
+from typing import Optional, Dict, Any, List, Tuple
+
+import redis
+import redis.asyncio
+
+QUEUE_VISIBILITY_TIMEOUT = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "300"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_DEAD_LETTER_MAX = 1000
+# Segundos de retraso en la cola por cada segundo de coste estimado
+QUEUE_COST_WEIGHT = float(os.getenv("QUEUE_COST_WEIGHT", "1.0"))
+# Tope del retraso: garantiza que los jobs largos no esperen indefinidamente
+QUEUE_MAX_COST_DELAY = float(os.getenv("QUEUE_MAX_COST_DELAY", "1800"))
+
+# Todas las operaciones usan el reloj de Redis (TIME) para que los plazos no
+# dependan del reloj de cada worker.
+_NOW_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+"""
+
+# Agrega al payload JSON (un objeto no vacío) la hora de llegada y el score,
+# calculados con el reloj de Redis, sin decodificarlo (cjson alteraría
+# números y listas vacías).
+_STAMP_LUA = """
+local function stamp(payload, arrived, score)
+  local body = string.match(payload, '^(.*)}%s*$')
+  return body .. string.format(',"enqueued_ts":%.6f,"queue_score":%.6f}', arrived, score)
+end
+"""
+
+_ENQUEUE_LUA = _NOW_LUA + _STAMP_LUA + """
+local score = now + tonumber(ARGV[3])
+redis.call('HSET', KEYS[1], ARGV[1], stamp(ARGV[2], now, score))
+redis.call('ZADD', KEYS[2], score, ARGV[1])
+redis.call('ZADD', KEYS[3], now, ARGV[1])
+return 1
+"""
+
+# Jobs que dejó en la lista antigua (RPUSH/BLPOP sobre la clave `queue`) una
+# versión anterior: se pasan a la cola en su orden, con coste 0. Los payloads
+# sin job_id van a la cola de muertos.
+_MIGRATE_LUA = _NOW_LUA + _STAMP_LUA + """
+if redis.call('TYPE', KEYS[4])['ok'] ~= 'list' then
+  return 0
+end
+local moved = 0
+while moved < tonumber(ARGV[1]) do
+  local payload = redis.call('LPOP', KEYS[4])
+  if not payload then
+    break
+  end
+  local ok, job = pcall(cjson.decode, payload)
+  if ok and type(job) == 'table' and type(job['job_id']) == 'string' then
+    local id = job['job_id']
+    local t = now + moved / 1000000
+    if redis.call('HSETNX', KEYS[1], id, stamp(payload, t, t)) == 1 then
+      redis.call('ZADD', KEYS[2], t, id)
+      redis.call('ZADD', KEYS[3], t, id)
+    end
+  else
+    redis.call('LPUSH', KEYS[5], payload)
+  end
+  moved = moved + 1
+end
+return moved
+"""
+
+_LEASE_LUA = _NOW_LUA + """
+while true do
+  local ids = redis.call('ZRANGE', KEYS[1], 0, 0)
+  if #ids == 0 then
+    return nil
+  end
+  local id = ids[1]
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('ZREM', KEYS[6], id)
+  local payload = redis.call('HGET', KEYS[3], id)
+  if payload then
+    local vt = tonumber(ARGV[2])
+    local ok, job = pcall(cjson.decode, payload)
+    if ok and type(job) == 'table' and tonumber(job['visibility_timeout']) then
+      vt = tonumber(job['visibility_timeout'])
+    end
+    redis.call('ZADD', KEYS[2], now + vt, id)
+    redis.call('HSET', KEYS[5], id, ARGV[1])
+    local attempt = redis.call('HINCRBY', KEYS[4], id, 1)
+    return {id, payload, attempt, tostring(vt)}
+  end
+end
+"""
+
+_HEARTBEAT_LUA = _NOW_LUA + """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+  return 0
+end
+redis.call('ZADD', KEYS[1], 'XX', now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+_ACK_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return 1
+"""
+
+_RECLAIM_LUA = _NOW_LUA + """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+local requeued = {}
+local dead = {}
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[2], id)
+  redis.call('HDEL', KEYS[5], id)
+  local payload = redis.call('HGET', KEYS[3], id)
+  if payload then
+    local attempts = tonumber(redis.call('HGET', KEYS[4], id) or '0')
+    if attempts >= tonumber(ARGV[1]) then
+      redis.call('LPUSH', KEYS[6], payload)
+      redis.call('LTRIM', KEYS[6], 0, tonumber(ARGV[3]) - 1)
+      redis.call('HDEL', KEYS[3], id)
+      redis.call('HDEL', KEYS[4], id)
+      table.insert(dead, payload)
+    else
+      local score = now
+      local arrived = now
+      local ok, job = pcall(cjson.decode, payload)
+      if ok and type(job) == 'table' then
+        score = tonumber(job['queue_score']) or score
+        arrived = tonumber(job['enqueued_ts']) or arrived
+      end
+      redis.call('ZADD', KEYS[1], score, id)
+      redis.call('ZADD', KEYS[7], arrived, id)
+      table.insert(requeued, id)
+    end
+  end
+end
+return {requeued, dead}
+"""
+
+
+def _keys(queue: str) -> Dict[str, str]:
+    return {
+        name: f"{queue}:{name}"
+        for name in ("pending", "arrivals", "leases", "jobs", "attempts", "owners", "dead")
+    }
+
+
+def _enqueue_args(
+    queue: str,
+    payload: Dict[str, Any],
+    visibility_timeout: Optional[int],
+    estimated_cost: float,
+) -> Tuple[List[str], List[Any]]:
+    """Claves y argumentos de _ENQUEUE_LUA (la hora la pone Redis)."""
+    k = _keys(queue)
+    job_id = payload.get("job_id") or str(uuid.uuid4())
+    delay = min(max(0.0, estimated_cost) * QUEUE_COST_WEIGHT, QUEUE_MAX_COST_DELAY)
+    # Un payload reencolado (p. ej. el merge de un video partido) trae los de antes
+    payload = {f: v for f, v in payload.items() if f not in ("enqueued_ts", "queue_score")}
+    payload.update(job_id=job_id, estimated_cost=estimated_cost)
+    if visibility_timeout:
+        payload["visibility_timeout"] = int(visibility_timeout)
+    return [k["jobs"], k["pending"], k["arrivals"]], [job_id, json.dumps(payload), delay]
+
+
+def enqueue(
+    r: redis.Redis,
+    queue: str,
+    payload: Dict[str, Any],
+    *,
+    visibility_timeout: Optional[int] = None,
+    estimated_cost: float = 0.0,
+) -> str:
+    """
+    Publica un job. `payload["job_id"]` identifica el job en la cola
+    (se genera uno si falta). `estimated_cost` son los segundos de
+    codificación estimados y decide su turno. Devuelve el job_id.
+    """
+    keys, args = _enqueue_args(queue, payload, visibility_timeout, estimated_cost)
+    r.register_script(_ENQUEUE_LUA)(keys=keys, args=args)
+    return args[0]
+
+
+async def enqueue_async(
+    r: redis.asyncio.Redis,
+    queue: str,
+    payload: Dict[str, Any],
+    *,
+    visibility_timeout: Optional[int] = None,
+    estimated_cost: float = 0.0,
+) -> str:
+    """enqueue para la API (cliente redis.asyncio)."""
+    keys, args = _enqueue_args(queue, payload, visibility_timeout, estimated_cost)
+    await r.register_script(_ENQUEUE_LUA)(keys=keys, args=args)
+    return args[0]
+
+
+def migrate_legacy_list(r: redis.Redis, queue: str, batch: int = 500) -> int:
+    """
+    Pasa a la cola los jobs que quedaron en la lista de la versión anterior
+    (clave `queue`). Idempotente y barato si no hay nada (un TYPE). Devuelve
+    cuántos movió.
+    """
+    k = _keys(queue)
+    script = r.register_script(_MIGRATE_LUA)
+    total = 0
+    while True:
+        moved = script(
+            keys=[k["jobs"], k["pending"], k["arrivals"], queue, k["dead"]],
+            args=[batch],
+        )
+        total += moved
+        if moved < batch:
+            return total
+
+
+def lease(r: redis.Redis, queue: str, consumer: str) -> Optional[Dict[str, Any]]:
+    """
+    Toma el siguiente job y lo deja arrendado a `consumer`.
+    Devuelve {"job_id", "raw", "attempt", "visibility_timeout"} o None si no hay.
+    `raw` es el payload sin decodificar (bytes).
+    """
+    k = _keys(queue)
+    res = r.register_script(_LEASE_LUA)(
+        keys=[k["pending"], k["leases"], k["jobs"], k["attempts"], k["owners"], k["arrivals"]],
+        args=[consumer, QUEUE_VISIBILITY_TIMEOUT],
+    )
+    if not res:
+        return None
+    job_id, raw, attempt, vt = res
+    return {
+        "job_id": job_id.decode(),
+        "raw": raw,
+        "attempt": int(attempt),
+        "visibility_timeout": float(vt),
+    }
+
+
+def heartbeat(
+    r: redis.Redis, queue: str, job_id: str, consumer: str, visibility_timeout: float
+) -> bool:
+    """Extiende el lease. False si el job ya no pertenece a este consumidor."""
+    k = _keys(queue)
+    return bool(r.register_script(_HEARTBEAT_LUA)(
+        keys=[k["leases"], k["owners"]],
+        args=[job_id, consumer, visibility_timeout],
+    ))
+
+
+def ack(r: redis.Redis, queue: str, job_id: str, consumer: str) -> bool:
+    """Confirma el job (terminado o fallido definitivamente) y lo borra de la cola."""
+    k = _keys(queue)
+    return bool(r.register_script(_ACK_LUA)(
+        keys=[k["leases"], k["owners"], k["jobs"], k["attempts"]],
+        args=[job_id, consumer],
+    ))
+
+
+def reclaim_expired(
+    r: redis.Redis,
+    queue: str,
+    *,
+    max_attempts: int = QUEUE_MAX_ATTEMPTS,
+    limit: int = 100,
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Devuelve a la cola los jobs cuyo lease venció (worker caído o colgado).
+    Los que ya agotaron `max_attempts` van a la cola de muertos.
+    Devuelve (job_ids reencolados, payloads muertos).
+    """
+    k = _keys(queue)
+    requeued, dead = r.register_script(_RECLAIM_LUA)(
+        keys=[k["pending"], k["leases"], k["jobs"], k["attempts"], k["owners"], k["dead"], k["arrivals"]],
+        args=[max_attempts, limit, QUEUE_DEAD_LETTER_MAX],
+    )
+    dead_jobs = []
+    for raw in dead:
+        try:
+            dead_jobs.append(json.loads(raw))
+        except json.JSONDecodeError:
+            continue
+    return [j.decode() for j in requeued], dead_jobs
+
+
+def _queue_stats_pipeline(pipe, queue: str) -> None:
+    k = _keys(queue)
+    pipe.zcard(k["pending"])
+    pipe.zcard(k["leases"])
+    pipe.llen(k["dead"])
+    pipe.zrange(k["arrivals"], 0, 0, withscores=True)
+    pipe.time()
+
+
+def _queue_stats_result(results: list) -> Dict[str, Any]:
+    pending, leased, dead, oldest, (sec, usec) = results
+    lag = 0.0
+    if oldest:
+        lag = max(0.0, sec + usec / 1_000_000 - oldest[0][1])
+    return {
+        "pending": pending,
+        "leased": leased,
+        "dead": dead,
+        "lag_seconds": lag,
+    }
+
+
+def queue_stats(r: redis.Redis, queue: str) -> Dict[str, Any]:
+    """
+    Estado de la cola: jobs pendientes, arrendados, muertos y el lag del
+    consumidor (segundos que lleva esperando el job pendiente más antiguo).
+    """
+    pipe = r.pipeline()
+    _queue_stats_pipeline(pipe, queue)
+    return _queue_stats_result(pipe.execute())
+
+
+async def queue_stats_async(r: redis.asyncio.Redis, queue: str) -> Dict[str, Any]:
+    """queue_stats para la API (cliente redis.asyncio)."""
+    pipe = r.pipeline()
+    _queue_stats_pipeline(pipe, queue)
+    return _queue_stats_result(await pipe.execute())
+
+
+def pending_count(r: redis.Redis, queue: str) -> int:
+    """Jobs esperando worker (equivalente al antiguo LLEN de la lista)."""
+    return r.zcard(_keys(queue)["pending"])
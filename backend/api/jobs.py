@@ -1,17 +1,17 @@
 # backend/api/jobs.py
 import os
-import json
 import uuid
-import redis
+import redis.asyncio
 import datetime
-from typing import Optional, Dict, Any, BinaryIO
+from typing import Optional, Dict, Any, List
 from minio import Minio
 from minio.error import S3Error
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 
 # Importar la DB de Firestore
-from .firebase_db import db
+from .firebase_db import db, async_db
+from . import job_queue
 
 # --- Configuración de Redis (SIN CAMBIOS) ---
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
@@ -21,13 +21,16 @@ REDIS_QUEUE = os.getenv("REDIS_QUEUE", "convert")
 
 _redis_client = None
 
-def get_redis_client() -> redis.Redis:
+def get_redis_client() -> redis.asyncio.Redis:
+    """
+    Cliente redis.asyncio compartido por los endpoints (pool de conexiones
+    perezoso: no conecta hasta el primer comando).
+    """
     global _redis_client
     if _redis_client is None:
-        _redis_client = redis.Redis(
+        _redis_client = redis.asyncio.Redis(
             host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB
         )
-        _redis_client.ping()
     return _redis_client
 
 # --- Configuración de MinIO ---
@@ -35,6 +38,8 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
+# Con la región fija firmar URLs no consulta a MinIO (ver object_store.py)
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
 
 _minio_client = None
 
@@ -46,31 +51,12 @@ def get_minio_client() -> Minio:
             access_key=MINIO_ACCESS_KEY,
             secret_key=MINIO_SECRET_KEY,
             secure=MINIO_SECURE,
+            region=MINIO_REGION,
         )
     return _minio_client
 
 # --- Lógica de Almacenamiento (MinIO) ---
 
-def upload_file_to_minio(
-    bucket: str, 
-    object_name: str, 
-    file_stream: BinaryIO, 
-    file_length: int,
-    content_type: str
-) -> None:
-    # ... (Esta función está implementada en el paso anterior - SIN CAMBIOS)
-    client = get_minio_client()
-    found = client.bucket_exists(bucket)
-    if not found:
-        client.make_bucket(bucket)
-    client.put_object(
-        bucket_name=bucket,
-        object_name=object_name,
-        data=file_stream,
-        length=file_length,
-        content_type=content_type
-    )
-
 def get_presigned_url_for_download(bucket: str, object_name: str, expires_in_hours: int = 1) -> str:
     """
     Genera una URL firmada temporal para descargar un objeto en MinIO.
@@ -90,7 +76,7 @@ def get_presigned_url_for_download(bucket: str, object_name: str, expires_in_hou
 
 # --- Lógica de Media (Firestore) ---
 
-def create_media_entry(
+async def create_media_entry(
     user_id: str, 
     original_filename: str, 
     source_bucket: str, 
@@ -98,8 +84,10 @@ def create_media_entry(
     content_type: str,
     original_extension: str,
     original_size_bytes: int,
+    content_sha256: Optional[str] = None,
+    probe: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    media_ref = db().collection("media").document()
+    media_ref = async_db().collection("media").document()
     media_data = {
         "user_id": user_id,
         "original_filename": original_filename,
@@ -108,34 +96,35 @@ def create_media_entry(
         "content_type": content_type,
         "original_extension": original_extension,
         "original_size_bytes": original_size_bytes,
+        "content_sha256": content_sha256,
+        "probe": probe,
         "created_at": datetime.datetime.utcnow(),
         "status": "uploaded",
         "jobs": {},
         "job_ids": [],
         "shared_with": [],   # 🔹 NUEVO: lista de usuarios con acceso
     }
-    media_ref.set(media_data)
+    await media_ref.set(media_data)
     
     media_data["id"] = media_ref.id
     return media_data
 
-def get_media_entry(media_id: str) -> Optional[Dict[str, Any]]:
-    # ... (Esta función está implementada en el paso anterior - SIN CAMBIOS)
-    doc = db().collection("media").document(media_id).get()
+async def get_media_entry(media_id: str) -> Optional[Dict[str, Any]]:
+    doc = await async_db().collection("media").document(media_id).get()
     if not doc.exists:
         return None
     data = doc.to_dict()
     data["id"] = doc.id
     return data
 
-def get_media_by_job_id(job_id: str) -> Optional[Dict[str, Any]]:
+async def get_media_by_job_id(job_id: str) -> Optional[Dict[str, Any]]:
     try:
-        docs = (db()
+        docs = (async_db()
             .collection("media")
             .where(filter=FieldFilter("job_ids", "array_contains", job_id))
             .limit(1)
             .stream())
-        for d in docs:
+        async for d in docs:
             data = d.to_dict() or {}
             data["id"] = d.id
             return data
@@ -168,9 +157,48 @@ def update_job_status(media_id: str, job_id: str, status: str, details: Dict[str
     print(f"Estado de job {job_id} actualizado a {status}")
     pass
 
+# --- Estimación de coste (planificación de la cola) ---
+
+# Segundos de codificación por segundo de media. Para video la referencia es
+# 720p y se escala por número de píxeles.
+TARGET_COST_FACTORS = {"mp3": 0.02, "mp4": 0.35, "hls": 0.6}
+REFERENCE_PIXELS = 1280 * 720
+# Bitrates supuestos para deducir la duración del tamaño cuando no hay probe
+FALLBACK_AUDIO_BYTES_PER_SEC = 192_000 / 8
+FALLBACK_VIDEO_BYTES_PER_SEC = 5_000_000 / 8
+
+
+def estimate_job_cost(
+    target: str,
+    media_entry: Dict[str, Any],
+    hls_ladder: Optional[List[str]] = None,
+) -> float:
+    """
+    Estima los segundos de CPU que costará convertir el media al target,
+    a partir de la duración y resolución (probe de la subida) o, si no hay
+    probe, del tamaño del original. En HLS adaptativo cada variante de
+    video extra suma su propio encode (la decodificación se comparte).
+    """
+    probe = media_entry.get("probe") or {}
+    duration = probe.get("duration")
+    if not duration:
+        size = media_entry.get("original_size_bytes") or 0
+        is_audio = (media_entry.get("content_type") or "").startswith("audio/")
+        rate = FALLBACK_AUDIO_BYTES_PER_SEC if is_audio else FALLBACK_VIDEO_BYTES_PER_SEC
+        duration = size / rate
+
+    factor = TARGET_COST_FACTORS.get(target, 1.0)
+    width, height = probe.get("width"), probe.get("height")
+    if target != "mp3" and width and height:
+        factor *= max(0.25, (width * height) / REFERENCE_PIXELS)
+    if target == "hls" and hls_ladder:
+        factor *= max(1, sum(1 for name in hls_ladder if name != "audio"))
+    return round(duration * factor, 2)
+
+
 # --- Lógica de Jobs (Redis) ---
 
-def enqueue_conversion_job(
+async def enqueue_conversion_job(
     *,
     media_id: str,
     job_id: str,
@@ -178,11 +206,18 @@ def enqueue_conversion_job(
     source_bucket: str,
     source_object: str,
     output_bucket: str,
-    output_prefix: str
+    output_prefix: str,
+    content_sha256: Optional[str] = None,
+    estimated_cost: float = 0.0,
+    source_duration: Optional[float] = None,
+    source_probe: Optional[Dict[str, Any]] = None,
+    hls_ladder: Optional[List[str]] = None,
+    previews: Optional[bool] = None,
 ) -> None:
     """
     Publica en la cola (Redis) el JSON que el worker necesita.
     NO generar job_id aquí: viene del API para que coincida en todo lado.
+    `estimated_cost` (ver estimate_job_cost) decide el turno en la cola.
     """
     payload = {
         "media_id": media_id,
@@ -192,22 +227,96 @@ def enqueue_conversion_job(
         "source_object": source_object,
         "output_bucket": output_bucket,
         "output_prefix": output_prefix,
+        "content_sha256": content_sha256,
+        "source_duration": source_duration,  # el worker parte los videos largos
+        "source_probe": source_probe,        # resolución/códecs del original
     }
+    if hls_ladder:
+        payload["hls_ladder"] = hls_ladder   # HLS adaptativo (varias variantes)
+    if previews is not None:
+        payload["previews"] = previews       # None: vistas previas salvo en remux (mp4/hls)
 
-    # 1) Encolar en Redis
+    # 1) Encolar en Redis (cola con lease/ack: ver job_queue.py)
     r = get_redis_client()
-    r.rpush(REDIS_QUEUE, json.dumps(payload))
+    await job_queue.enqueue_async(r, REDIS_QUEUE, payload, estimated_cost=estimated_cost)
 
     # 2) Guardar/mergear estado inicial del job en Firestore
-    media_ref = db().collection("media").document(media_id)
-    media_ref.set({
-        "status": "processing",  
-        "job_ids": firestore.ArrayUnion([job_id]),
-        f"jobs.{job_id}": {
-            "target": target,
+    await _register_enqueued_jobs(media_id, [{
+        "job_id": job_id,
+        "target": target,
+        "output_prefix": output_prefix,
+        "estimated_cost_seconds": estimated_cost,
+        "hls_ladder": hls_ladder,
+    }])
+
+
+async def _register_enqueued_jobs(media_id: str, entries: List[Dict[str, Any]]) -> None:
+    """Estado inicial en Firestore (jobs.<job_id> = enqueued) de uno o varios jobs."""
+    data = {
+        "status": "processing",
+        "job_ids": firestore.ArrayUnion([e["job_id"] for e in entries]),
+    }
+    for entry in entries:
+        fields = {k: v for k, v in entry.items() if k != "job_id"}
+        data[f"jobs.{entry['job_id']}"] = {
+            **fields,
             "status": "enqueued",
-            "output_prefix": output_prefix,
-            "enqueued_at": firestore.SERVER_TIMESTAMP,   
+            "enqueued_at": firestore.SERVER_TIMESTAMP,
             "updated_at": firestore.SERVER_TIMESTAMP,
         }
-    }, merge=True)
+    await async_db().collection("media").document(media_id).set(data, merge=True)
+
+
+async def enqueue_fanout_job(
+    *,
+    media_id: str,
+    outputs: List[Dict[str, Any]],  # [{"job_id", "target", "output_prefix", "estimated_cost"}]
+    source_bucket: str,
+    source_object: str,
+    output_bucket: str,
+    content_sha256: Optional[str] = None,
+    source_duration: Optional[float] = None,
+    source_probe: Optional[Dict[str, Any]] = None,
+    previews: Optional[bool] = None,
+) -> str:
+    """
+    Varios targets del mismo original en UN job de la cola: el worker
+    decodifica una vez y escribe todas las salidas. Cada salida conserva su
+    propio job_id y su entrada jobs.<job_id> en Firestore, así que status,
+    share y stream funcionan igual que con jobs sueltos.
+    Devuelve el id del job de la cola (fanout_id).
+    """
+    fanout_id = str(uuid.uuid4())
+    estimated_cost = round(sum(o.get("estimated_cost") or 0.0 for o in outputs), 2)
+    payload = {
+        "kind": "fanout",
+        "media_id": media_id,
+        "job_id": fanout_id,
+        "outputs": [
+            {"job_id": o["job_id"], "target": o["target"], "output_prefix": o["output_prefix"]}
+            for o in outputs
+        ],
+        "source_bucket": source_bucket,
+        "source_object": source_object,
+        "output_bucket": output_bucket,
+        "content_sha256": content_sha256,
+        "source_duration": source_duration,
+        "source_probe": source_probe,
+    }
+    if previews is not None:
+        payload["previews"] = previews
+
+    r = get_redis_client()
+    await job_queue.enqueue_async(r, REDIS_QUEUE, payload, estimated_cost=estimated_cost)
+
+    await _register_enqueued_jobs(media_id, [
+        {
+            "job_id": o["job_id"],
+            "target": o["target"],
+            "output_prefix": o["output_prefix"],
+            "estimated_cost_seconds": o.get("estimated_cost") or 0.0,
+            "fanout_id": fanout_id,
+        }
+        for o in outputs
+    ])
+    return fanout_id
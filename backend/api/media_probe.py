@@ -0,0 +1,66 @@
+# backend/api/media_probe.py
+import json
+import subprocess
+from typing import Optional, Dict, Any
+
+
+def probe_media(source: str, timeout: int = 30) -> Optional[Dict[str, Any]]:
+    """
+    Ejecuta ffprobe sobre un archivo local o una URL (p.ej. URL firmada de MinIO)
+    y devuelve un resumen con duración, resolución y códecs.
+    Sólo lee la cabecera del contenedor, no decodifica el archivo.
+    Devuelve None si ffprobe no está disponible o falla.
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        source,
+    ]
+    try:
+        proc = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0:
+        return None
+    try:
+        info = json.loads(proc.stdout or "{}")
+    except json.JSONDecodeError:
+        return None
+
+    fmt = info.get("format") or {}
+    streams = info.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not (s.get("disposition") or {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    def _float(value) -> Optional[float]:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    duration = _float(fmt.get("duration"))
+    if duration is None:
+        duration = _float((video or audio or {}).get("duration"))
+
+    return {
+        "duration": duration,
+        "format_name": fmt.get("format_name"),
+        "bit_rate": _float(fmt.get("bit_rate")),
+        "width": video.get("width") if video else None,
+        "height": video.get("height") if video else None,
+        "video_codec": video.get("codec_name") if video else None,
+        "video_pix_fmt": video.get("pix_fmt") if video else None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "audio_sample_rate": int(audio["sample_rate"]) if audio and audio.get("sample_rate") else None,
+        "audio_channels": audio.get("channels") if audio else None,
+    }
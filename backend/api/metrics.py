@@ -35,6 +35,10 @@ api_media_uploads_total = Counter(
     "api_media_uploads_total",
     "Total de archivos subidos"
 )
+api_media_upload_bytes_total = Counter(
+    "api_media_upload_bytes_total",
+    "Bytes de originales subidos (en streaming a MinIO)"
+)
 
 # 5. Métrica de tamaño de cola (Gauge)
 # (Lo implementaremos en app.py usando la conexión a Redis de jobs.py)
@@ -45,6 +49,23 @@ api_queue_size = Gauge(
     ["queue_name"]
 )
 
+# 6. Estado de la cola confiable (lease/ack)
+api_queue_leased_jobs = Gauge(
+    "api_queue_leased_jobs",
+    "Jobs tomados por un worker y aún sin confirmar",
+    ["queue_name"]
+)
+api_queue_consumer_lag_seconds = Gauge(
+    "api_queue_consumer_lag_seconds",
+    "Segundos que lleva esperando el job pendiente más antiguo",
+    ["queue_name"]
+)
+api_queue_dead_jobs = Gauge(
+    "api_queue_dead_jobs",
+    "Jobs que agotaron sus intentos (cola de muertos)",
+    ["queue_name"]
+)
+
 # --- Métricas de uso de recursos del sistema (CPU, RAM, red) ---
 
 system_cpu_percent = Gauge(
@@ -72,6 +93,11 @@ system_net_bytes_recv = Gauge(
 )
 
 
+# Cada lectura de psutil recorre /proc: en el middleware basta una por segundo
+SYSTEM_METRICS_INTERVAL = 1.0
+_last_system_update = 0.0
+
+
 def update_system_metrics(service_name: str = "api") -> None:
     """Actualiza métricas de CPU, RAM y red para el proceso actual."""
     cpu = psutil.cpu_percent(interval=0)
@@ -118,6 +144,9 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             ).inc()
 
             # <<< NUEVO: actualizar métricas de CPU / RAM / red del servicio API >>>
-            update_system_metrics("api")
+            global _last_system_update
+            if end_time - _last_system_update >= SYSTEM_METRICS_INTERVAL:
+                _last_system_update = end_time
+                update_system_metrics("api")
 
         return response
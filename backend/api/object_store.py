@@ -0,0 +1,344 @@
+# backend/api/object_store.py
+"""
+Acceso no bloqueante a MinIO para los endpoints `async def` de la API.
+
+minio-py es síncrono: cada stat_object/get_object ocupa un hilo mientras
+espera a MinIO. Aquí la petición se firma localmente (URL presignada con el
+cliente de jobs.get_minio_client; con MINIO_REGION fija no hay ida y vuelta)
+y se ejecuta con un httpx.AsyncClient compartido, así que leer o servir en
+streaming un objeto no bloquea el event loop ni el threadpool.
+
+Las subidas usan multipart de S3 con las mismas peticiones firmadas:
+StreamingUpload manda un stream de tamaño desconocido como partes en
+paralelo, calculando tamaño y sha256 al vuelo (sin pasar por disco).
+"""
+import os
+import asyncio
+import hashlib
+import datetime
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from . import jobs
+
+OBJECT_STORE_TIMEOUT = float(os.getenv("OBJECT_STORE_TIMEOUT", "30"))
+OBJECT_STORE_MAX_CONNECTIONS = int(os.getenv("OBJECT_STORE_MAX_CONNECTIONS", "100"))
+# Las URLs se usan en el acto: basta con una validez corta
+SIGNED_REQUEST_TTL = datetime.timedelta(minutes=5)
+# Subidas: tamaño de cada parte (S3 exige >= 5 MiB salvo la última) y partes
+# en vuelo por subida. La memoria por subida es ~ (concurrencia + 1) partes.
+UPLOAD_PART_SIZE = max(5 * 1024**2, int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024**2))))
+UPLOAD_PART_CONCURRENCY = max(1, int(os.getenv("UPLOAD_PART_CONCURRENCY", "4")))
+
+
+class ObjectStoreError(Exception):
+    """MinIO respondió con error (status_code 404 si el objeto no existe)."""
+
+    def __init__(self, status_code: int, object_name: str):
+        super().__init__(f"MinIO respondió {status_code} para {object_name}")
+        self.status_code = status_code
+        self.object_name = object_name
+
+
+@dataclass
+class ObjectInfo:
+    size: int
+    etag: str  # sin comillas, como minio-py
+    content_type: Optional[str]
+    last_modified: Optional[str]  # header HTTP tal como lo devuelve MinIO
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Cliente HTTP compartido (keep-alive con MinIO entre peticiones)."""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=OBJECT_STORE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=OBJECT_STORE_MAX_CONNECTIONS,
+                max_keepalive_connections=OBJECT_STORE_MAX_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+async def close() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def presigned_url(
+    method: str,
+    bucket: str,
+    object_name: str,
+    query: Optional[Dict[str, str]] = None,
+    expires: datetime.timedelta = SIGNED_REQUEST_TTL,
+) -> str:
+    """URL firmada localmente (sin ir a MinIO), también para entregar a clientes."""
+    return jobs.get_minio_client().get_presigned_url(
+        method, bucket, object_name, expires=expires, extra_query_params=query
+    )
+
+
+def _object_info(response: httpx.Response) -> ObjectInfo:
+    return ObjectInfo(
+        size=int(response.headers.get("content-length") or 0),
+        etag=(response.headers.get("etag") or "").strip('"'),
+        content_type=response.headers.get("content-type"),
+        last_modified=response.headers.get("last-modified"),
+    )
+
+
+async def stat_object(bucket: str, object_name: str) -> ObjectInfo:
+    response = await get_http_client().head(presigned_url("HEAD", bucket, object_name))
+    if response.status_code != 200:
+        raise ObjectStoreError(response.status_code, object_name)
+    return _object_info(response)
+
+
+async def read_object(bucket: str, object_name: str) -> bytes:
+    """Contenido completo (para objetos chicos: picos, miniaturas, playlists)."""
+    response = await get_http_client().get(presigned_url("GET", bucket, object_name))
+    if response.status_code != 200:
+        raise ObjectStoreError(response.status_code, object_name)
+    return response.content
+
+
+async def open_object(
+    bucket: str,
+    object_name: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> httpx.Response:
+    """
+    GET en streaming: el llamador consume `aiter_bytes()` y cierra la
+    respuesta con `aclose()` (p. ej. como BackgroundTask de la StreamingResponse).
+    `headers` se reenvían a MinIO (Range, If-None-Match...).
+    """
+    client = get_http_client()
+    request = client.build_request("GET", presigned_url("GET", bucket, object_name), headers=headers)
+    response = await client.send(request, stream=True)
+    if response.status_code >= 400:
+        await response.aclose()
+        raise ObjectStoreError(response.status_code, object_name)
+    return response
+
+
+async def delete_object(bucket: str, object_name: str) -> None:
+    response = await get_http_client().delete(presigned_url("DELETE", bucket, object_name))
+    if response.status_code not in (204, 404):
+        raise ObjectStoreError(response.status_code, object_name)
+
+
+# --- Subidas multipart ---
+
+_S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+_known_buckets: Set[str] = set()
+
+
+def _xml_text(body: bytes, tag: str) -> Optional[str]:
+    root = ET.fromstring(body)
+    node = root.find(f"{_S3_NS}{tag}")
+    if node is None:
+        node = root.find(tag)
+    return node.text if node is not None else None
+
+
+async def ensure_bucket(bucket: str) -> None:
+    """Crea el bucket si falta (se comprueba una vez por proceso)."""
+    if bucket in _known_buckets:
+        return
+
+    def _ensure():
+        client = jobs.get_minio_client()
+        if not client.bucket_exists(bucket):
+            client.make_bucket(bucket)
+
+    await run_in_threadpool(_ensure)
+    _known_buckets.add(bucket)
+
+
+async def create_multipart_upload(bucket: str, object_name: str, content_type: str) -> str:
+    """Inicia una subida multipart; devuelve su upload_id."""
+    response = await get_http_client().post(
+        presigned_url("POST", bucket, object_name, {"uploads": ""}),
+        headers={"Content-Type": content_type or "application/octet-stream"},
+    )
+    if response.status_code != 200:
+        raise ObjectStoreError(response.status_code, object_name)
+    return _xml_text(response.content, "UploadId")
+
+
+async def upload_part(
+    bucket: str, object_name: str, upload_id: str, part_number: int, data: bytes
+) -> str:
+    """Sube una parte; devuelve su ETag (sin comillas)."""
+    response = await get_http_client().put(
+        presigned_url(
+            "PUT", bucket, object_name,
+            {"partNumber": str(part_number), "uploadId": upload_id},
+        ),
+        content=data,
+    )
+    if response.status_code != 200:
+        raise ObjectStoreError(response.status_code, object_name)
+    return (response.headers.get("etag") or "").strip('"')
+
+
+async def list_parts(bucket: str, object_name: str, upload_id: str) -> Dict[int, Tuple[str, int]]:
+    """Partes ya subidas: número -> (etag, tamaño). Recorre todas las páginas."""
+    parts: Dict[int, Tuple[str, int]] = {}
+    marker = "0"
+    while True:
+        response = await get_http_client().get(
+            presigned_url(
+                "GET", bucket, object_name,
+                {"uploadId": upload_id, "part-number-marker": marker},
+            )
+        )
+        if response.status_code != 200:
+            raise ObjectStoreError(response.status_code, object_name)
+        root = ET.fromstring(response.content)
+        for part in root.iter(f"{_S3_NS}Part"):
+            number = int(part.findtext(f"{_S3_NS}PartNumber"))
+            parts[number] = (
+                (part.findtext(f"{_S3_NS}ETag") or "").strip('"'),
+                int(part.findtext(f"{_S3_NS}Size") or 0),
+            )
+        if root.findtext(f"{_S3_NS}IsTruncated") != "true":
+            return parts
+        marker = root.findtext(f"{_S3_NS}NextPartNumberMarker")
+
+
+async def complete_multipart_upload(
+    bucket: str, object_name: str, upload_id: str, parts: List[Tuple[int, str]]
+) -> str:
+    """Cierra la subida con las partes (número, etag); devuelve el ETag del objeto."""
+    body = "".join(
+        f"<Part><PartNumber>{n}</PartNumber><ETag>\"{etag}\"</ETag></Part>"
+        for n, etag in sorted(parts)
+    )
+    response = await get_http_client().post(
+        presigned_url("POST", bucket, object_name, {"uploadId": upload_id}),
+        content=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode(),
+        headers={"Content-Type": "application/xml"},
+    )
+    # S3 puede responder 200 con un <Error> en el cuerpo
+    if response.status_code != 200 or b"<Error>" in response.content:
+        raise ObjectStoreError(response.status_code, object_name)
+    return (_xml_text(response.content, "ETag") or "").strip('"')
+
+
+async def abort_multipart_upload(bucket: str, object_name: str, upload_id: str) -> None:
+    response = await get_http_client().delete(
+        presigned_url("DELETE", bucket, object_name, {"uploadId": upload_id})
+    )
+    if response.status_code not in (204, 404):
+        raise ObjectStoreError(response.status_code, object_name)
+
+
+class StreamingUpload:
+    """
+    Sube a MinIO un stream de tamaño desconocido: `write` acumula hasta
+    UPLOAD_PART_SIZE y despacha cada parte en segundo plano, con hasta
+    UPLOAD_PART_CONCURRENCY en vuelo (si no, espera: contrapresión sobre
+    quien lee el stream). El sha256 se calcula parte por parte en el
+    threadpool, en orden, sin bloquear el event loop.
+
+        upload = StreamingUpload(bucket, object_name, content_type)
+        await upload.start()
+        try:
+            async for chunk in stream:
+                await upload.write(chunk)
+            size, sha256 = await upload.finish()
+        except BaseException:
+            await upload.abort()
+            raise
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        object_name: str,
+        content_type: Optional[str] = None,
+        part_size: int = UPLOAD_PART_SIZE,
+        concurrency: int = UPLOAD_PART_CONCURRENCY,
+    ):
+        self.bucket = bucket
+        self.object_name = object_name
+        self.content_type = content_type or "application/octet-stream"
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.upload_id: Optional[str] = None
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._next_part = 1
+        self._parts: List[Tuple[int, str]] = []
+        self._in_flight: Dict[asyncio.Task, int] = {}  # tarea -> número de parte
+
+    async def start(self) -> None:
+        await ensure_bucket(self.bucket)
+        self.upload_id = await create_multipart_upload(
+            self.bucket, self.object_name, self.content_type
+        )
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._dispatch(part)
+
+    async def _dispatch(self, data: bytes) -> None:
+        self.size += len(data)
+        await run_in_threadpool(self._hash.update, data)
+        while len(self._in_flight) >= self.concurrency:
+            done, _ = await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+            self._collect(done)
+        number = self._next_part
+        self._next_part += 1
+        task = asyncio.create_task(
+            upload_part(self.bucket, self.object_name, self.upload_id, number, data)
+        )
+        self._in_flight[task] = number
+
+    def _collect(self, done: Set[asyncio.Task]) -> None:
+        for task in done:
+            number = self._in_flight.pop(task)
+            self._parts.append((number, task.result()))
+
+    async def finish(self) -> Tuple[int, str]:
+        """Sube lo que queda y cierra el objeto; devuelve (tamaño, sha256)."""
+        # La última parte puede ser chica (o vacía si el stream no trajo nada)
+        if self._buffer or self._next_part == 1:
+            await self._dispatch(bytes(self._buffer))
+            self._buffer.clear()
+        if self._in_flight:
+            done, _ = await asyncio.wait(self._in_flight)
+            self._collect(done)
+        await complete_multipart_upload(
+            self.bucket, self.object_name, self.upload_id, self._parts
+        )
+        return self.size, self._hash.hexdigest()
+
+    async def abort(self) -> None:
+        """Cancela las partes en vuelo y descarta la subida en MinIO."""
+        for task in self._in_flight:
+            task.cancel()
+        if self._in_flight:
+            await asyncio.wait(self._in_flight)
+        self._in_flight.clear()
+        if self.upload_id:
+            try:
+                await abort_multipart_upload(self.bucket, self.object_name, self.upload_id)
+            except (ObjectStoreError, httpx.HTTPError) as e:
+                print(f"No se pudo abortar la subida {self.upload_id}: {e}")
@@ -0,0 +1,8 @@
+# backend/api/tests/conftest.py
+# Como en el contenedor: backend/ en el path para importar el paquete api.
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
@@ -0,0 +1,180 @@
+# backend/api/tests/test_upload_sessions.py
+"""
+Finalizar una subida reanudable (complete_session) con Redis y MinIO
+simulados en memoria: un reintento tras un fallo a mitad de camino tiene
+que terminar bien aunque MinIO ya haya cerrado la subida.
+"""
+import asyncio
+import hashlib
+
+import pytest
+
+from api import object_store, upload_sessions
+from api.object_store import ObjectInfo, ObjectStoreError
+from api.upload_sessions import UploadSession, UploadSessionError
+
+CHUNK = 5 * 1024**2
+DATA = b"x" * (CHUNK + 1000)
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.ops = []
+
+    def delete(self, *keys):
+        self.ops.append(lambda: self.r.delete_now(*keys))
+
+    def zrem(self, key, member):
+        self.ops.append(lambda: self.r.zsets.setdefault(key, set()).discard(member))
+
+    async def execute(self):
+        return [op() for op in self.ops]
+
+
+class FakeRedis:
+    """Sólo lo que usa complete_session."""
+
+    def __init__(self):
+        self.data = {}
+        self.zsets = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete_now(self, *keys):
+        return sum(self.data.pop(k, None) is not None for k in keys)
+
+    async def delete(self, *keys):
+        return self.delete_now(*keys)
+
+    async def hgetall(self, key):
+        return self.data.get(key, {})
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakeStore:
+    """Una subida multipart de MinIO: se cierra una vez, después NoSuchUpload."""
+
+    def __init__(self):
+        self.open_uploads = {"mp1"}
+        self.objects = {}
+        self.completes = 0
+
+    async def complete_multipart_upload(self, bucket, object_name, upload_id, parts):
+        self.completes += 1
+        if upload_id not in self.open_uploads:
+            raise ObjectStoreError(404, object_name)
+        self.open_uploads.discard(upload_id)
+        self.objects[object_name] = DATA
+        return "etag"
+
+    async def stat_object(self, bucket, object_name):
+        if object_name not in self.objects:
+            raise ObjectStoreError(404, object_name)
+        return ObjectInfo(len(self.objects[object_name]), "etag", None, None)
+
+    async def open_object(self, bucket, object_name):
+        data = self.objects[object_name]
+
+        class Response:
+            async def aiter_bytes(self, size):
+                for i in range(0, len(data), size):
+                    yield data[i:i + size]
+
+            async def aclose(self):
+                pass
+
+        return Response()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    for name in ("complete_multipart_upload", "stat_object", "open_object"):
+        monkeypatch.setattr(object_store, name, getattr(store, name))
+    return store
+
+
+@pytest.fixture
+def session():
+    return UploadSession(
+        session_id="s1", user_id="u1", filename="a.mp4", content_type="video/mp4",
+        file_ext=".mp4", bucket="media", object_name="uploads/u1/m1/original.mp4",
+        upload_id="mp1", size=len(DATA), chunk_size=CHUNK, created_at=0.0,
+    )
+
+
+@pytest.fixture
+def r(session):
+    r = FakeRedis()
+    r.data["uploads:s1"] = {b"session_id": b"s1"}
+    r.data["uploads:s1:parts"] = {b"1": b"e1", b"2": b"e2"}
+    return r
+
+
+def test_complete_registers_and_forgets_session(r, session, store):
+    registered = []
+
+    async def register(size, sha256):
+        registered.append((size, sha256))
+        return {"media_id": "m1"}
+
+    result = asyncio.run(upload_sessions.complete_session(r, session, register))
+    assert result == {"media_id": "m1"}
+    assert registered == [(len(DATA), hashlib.sha256(DATA).hexdigest())]
+    assert "uploads:s1" not in r.data and "uploads:s1:parts" not in r.data
+    assert "uploads:s1:completing" not in r.data
+
+
+def test_retry_after_failed_register_uses_completed_object(r, session, store):
+    async def failing(size, sha256):
+        raise RuntimeError("firestore caído")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(upload_sessions.complete_session(r, session, failing))
+    # MinIO ya cerró la subida, pero la sesión sigue para reintentar
+    assert "mp1" not in store.open_uploads
+    assert "uploads:s1" in r.data
+    assert "uploads:s1:completing" not in r.data
+
+    registered = []
+
+    async def register(size, sha256):
+        registered.append((size, sha256))
+        return {"media_id": "m1"}
+
+    result = asyncio.run(upload_sessions.complete_session(r, session, register))
+    assert result == {"media_id": "m1"}
+    assert store.completes == 2  # el segundo recibió NoSuchUpload
+    assert registered == [(len(DATA), hashlib.sha256(DATA).hexdigest())]
+    assert "uploads:s1" not in r.data
+
+
+def test_retry_without_object_is_a_conflict(r, session, store):
+    store.open_uploads.clear()  # la subida ya no está y el objeto tampoco
+
+    async def register(size, sha256):
+        raise AssertionError("no debería registrarse")
+
+    with pytest.raises(UploadSessionError) as exc:
+        asyncio.run(upload_sessions.complete_session(r, session, register))
+    assert exc.value.status_code == 409
+    assert "uploads:s1" in r.data
+
+
+def test_missing_chunks_is_a_conflict(r, session, store):
+    del r.data["uploads:s1:parts"]
+
+    async def register(size, sha256):
+        raise AssertionError("no debería registrarse")
+
+    with pytest.raises(UploadSessionError) as exc:
+        asyncio.run(upload_sessions.complete_session(r, session, register))
+    assert exc.value.status_code == 409
+    assert store.completes == 0
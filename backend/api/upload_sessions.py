@@ -0,0 +1,349 @@
+# backend/api/upload_sessions.py
+"""
+Subidas reanudables: el archivo llega en chunks de tamaño fijo y cada chunk
+es una parte de una subida multipart de MinIO, así que si se corta la
+conexión el cliente sólo reenvía los chunks que faltan.
+
+    POST   /media/uploads                    crea la sesión (nombre y tamaño)
+    PUT    /media/uploads/{id}               un chunk (Content-Range: bytes a-b/total)
+    GET    /media/uploads/{id}               progreso: bytes y chunks recibidos
+    POST   /media/uploads/{id}/complete      cierra la subida y crea el media
+    DELETE /media/uploads/{id}               la descarta
+
+El chunk i va en los bytes [i * chunk_size, (i + 1) * chunk_size) y es la
+parte i + 1; el último puede ser más corto. Los chunks se pueden mandar en
+cualquier orden (también en paralelo) y reintentar.
+
+Estado en Redis (expira UPLOAD_SESSION_TTL segundos después del último chunk):
+- uploads:{id}         hash con los datos de la sesión
+- uploads:{id}:parts   hash número de parte -> ETag
+
+Una sesión que vence sin cerrarse se aborta en MinIO (upload_sweeper.py).
+
+El sha256 del contenido (clave de la caché de conversiones) se calcula al
+vuelo si los chunks llegan en orden al mismo proceso; si no (chunks en
+paralelo, reinicio de la API), se calcula al finalizar releyendo el objeto.
+"""
+import os
+import re
+import math
+import time
+import uuid
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import redis.asyncio
+from starlette.concurrency import run_in_threadpool
+
+from . import object_store, upload_sweeper
+from .object_store import ObjectStoreError
+
+UPLOAD_CHUNK_SIZE = max(5 * 1024**2, int(os.getenv("UPLOAD_CHUNK_SIZE", str(16 * 1024**2))))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+# Límite de partes de una subida multipart de S3
+MAX_UPLOAD_PARTS = 10_000
+# Sesiones con sha256 al vuelo que se recuerdan en este proceso
+MAX_RUNNING_HASHES = 1024
+# Releer el objeto para el sha256: tamaño de cada lectura
+_REHASH_READ_SIZE = 4 * 1024**2
+
+T = TypeVar("T")
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadSessionError(Exception):
+    """Error de la sesión con el status HTTP a devolver."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class UploadSession:
+    session_id: str
+    user_id: str
+    filename: str
+    content_type: str
+    file_ext: str
+    bucket: str
+    object_name: str
+    upload_id: str
+    size: int
+    chunk_size: int
+    created_at: float
+
+    @property
+    def total_chunks(self) -> int:
+        return math.ceil(self.size / self.chunk_size)
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+
+def _key(session_id: str) -> str:
+    return f"uploads:{session_id}"
+
+
+def _sweeper_entry(session: "UploadSession") -> str:
+    return upload_sweeper.entry(
+        _key(session.session_id), session.bucket, session.object_name, session.upload_id
+    )
+
+
+def _parts_key(session_id: str) -> str:
+    return f"uploads:{session_id}:parts"
+
+
+class _RunningHash:
+    """sha256 de los chunks que llegan en orden; se invalida si no."""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+        self.next_part = 1
+        self.etags: Dict[int, str] = {}
+        self.broken = False
+        self.lock = asyncio.Lock()
+
+    async def feed(self, part_number: int, etag: str, data: bytes) -> None:
+        if self.broken:
+            return
+        if part_number < self.next_part:
+            # Reintento de un chunk ya contado: sólo vale si es el mismo contenido
+            if self.etags.get(part_number) != etag:
+                self.broken = True
+            return
+        if part_number > self.next_part:
+            self.broken = True
+            return
+        self.next_part += 1
+        self.etags[part_number] = etag
+        async with self.lock:  # FIFO: respeta el orden aunque el hash vaya a otro hilo
+            await run_in_threadpool(self.hash.update, data)
+
+
+_running_hashes: "OrderedDict[str, _RunningHash]" = OrderedDict()
+
+
+def _running_hash(session_id: str, create: bool = False) -> Optional[_RunningHash]:
+    running = _running_hashes.get(session_id)
+    if running is None and create:
+        running = _running_hashes[session_id] = _RunningHash()
+        while len(_running_hashes) > MAX_RUNNING_HASHES:
+            _running_hashes.popitem(last=False)
+    return running
+
+
+async def create_session(
+    r: redis.asyncio.Redis,
+    *,
+    user_id: str,
+    filename: str,
+    size: int,
+    content_type: Optional[str],
+    file_ext: str,
+    bucket: str,
+    object_name: str,
+) -> UploadSession:
+    if size <= 0:
+        raise UploadSessionError(400, "El tamaño del archivo debe ser mayor que 0")
+    if math.ceil(size / UPLOAD_CHUNK_SIZE) > MAX_UPLOAD_PARTS:
+        raise UploadSessionError(
+            413, f"Archivo demasiado grande (máximo {UPLOAD_CHUNK_SIZE * MAX_UPLOAD_PARTS} bytes)"
+        )
+    content_type = content_type or "application/octet-stream"
+    await object_store.ensure_bucket(bucket)
+    upload_id = await object_store.create_multipart_upload(bucket, object_name, content_type)
+    session = UploadSession(
+        session_id=str(uuid.uuid4()),
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        file_ext=file_ext,
+        bucket=bucket,
+        object_name=object_name,
+        upload_id=upload_id,
+        size=size,
+        chunk_size=UPLOAD_CHUNK_SIZE,
+        created_at=time.time(),
+    )
+    pipe = r.pipeline()
+    pipe.hset(_key(session.session_id), mapping={k: str(v) for k, v in asdict(session).items()})
+    pipe.expire(_key(session.session_id), UPLOAD_SESSION_TTL)
+    upload_sweeper.track(pipe, _sweeper_entry(session), UPLOAD_SESSION_TTL)
+    await pipe.execute()
+    _running_hash(session.session_id, create=True)
+    return session
+
+
+async def get_session(r: redis.asyncio.Redis, session_id: str, user_id: str) -> UploadSession:
+    raw = await r.hgetall(_key(session_id))
+    if not raw:
+        raise UploadSessionError(404, "Sesión de subida no encontrada o expirada")
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    if data["user_id"] != user_id:
+        raise UploadSessionError(403, "No autorizado para esta subida")
+    return UploadSession(
+        **{
+            **data,
+            "size": int(data["size"]),
+            "chunk_size": int(data["chunk_size"]),
+            "created_at": float(data["created_at"]),
+        }
+    )
+
+
+async def received_parts(r: redis.asyncio.Redis, session: UploadSession) -> Dict[int, str]:
+    raw = await r.hgetall(_parts_key(session.session_id))
+    return {int(k): v.decode() for k, v in raw.items()}
+
+
+def chunk_index(session: UploadSession, content_range: Optional[str]) -> int:
+    """Valida el Content-Range de un chunk y devuelve su índice."""
+    match = _CONTENT_RANGE_RE.match((content_range or "").strip())
+    if not match:
+        raise UploadSessionError(400, "Content-Range inválido (bytes inicio-fin/total)")
+    start, end, total = (int(g) for g in match.groups())
+    if total != session.size:
+        raise UploadSessionError(400, f"El total del Content-Range no coincide ({session.size})")
+    if start % session.chunk_size:
+        raise UploadSessionError(400, f"El chunk debe empezar en un múltiplo de {session.chunk_size}")
+    index = start // session.chunk_size
+    if index >= session.total_chunks:
+        raise UploadSessionError(400, "El chunk queda fuera del archivo")
+    if end - start + 1 != session.chunk_length(index):
+        raise UploadSessionError(400, f"El chunk {index} debe tener {session.chunk_length(index)} bytes")
+    return index
+
+
+async def put_chunk(
+    r: redis.asyncio.Redis, session: UploadSession, index: int, data: bytes
+) -> Dict[str, Any]:
+    """Sube el chunk `index` como la parte index + 1 y devuelve el progreso."""
+    if len(data) != session.chunk_length(index):
+        raise UploadSessionError(400, "Chunk incompleto: reenvíalo")
+    part_number = index + 1
+    etag = await object_store.upload_part(
+        session.bucket, session.object_name, session.upload_id, part_number, data
+    )
+    pipe = r.pipeline()
+    pipe.hset(_parts_key(session.session_id), str(part_number), etag)
+    pipe.expire(_parts_key(session.session_id), UPLOAD_SESSION_TTL)
+    pipe.expire(_key(session.session_id), UPLOAD_SESSION_TTL)
+    upload_sweeper.track(pipe, _sweeper_entry(session), UPLOAD_SESSION_TTL)
+    pipe.hgetall(_parts_key(session.session_id))
+    *_, raw_parts = await pipe.execute()
+
+    running = _running_hash(session.session_id)
+    if running is not None:
+        await running.feed(part_number, etag, data)
+    return progress(session, {int(k): v.decode() for k, v in raw_parts.items()})
+
+
+def progress(session: UploadSession, parts: Dict[int, str]) -> Dict[str, Any]:
+    received = sorted(n - 1 for n in parts)
+    contiguous = 0
+    while contiguous + 1 in parts:
+        contiguous += 1
+    return {
+        "upload_id": session.session_id,
+        "filename": session.filename,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received_chunks": received,
+        "received_bytes": sum(session.chunk_length(i) for i in received),
+        # Desde dónde seguir si se manda en orden
+        "offset": min(session.size, contiguous * session.chunk_size),
+        "complete": len(received) == session.total_chunks,
+        "expires_in": UPLOAD_SESSION_TTL,
+    }
+
+
+def missing_chunks(session: UploadSession, parts: Dict[int, str]) -> List[int]:
+    return [i for i in range(session.total_chunks) if i + 1 not in parts]
+
+
+async def _rehash_object(bucket: str, object_name: str) -> str:
+    h = hashlib.sha256()
+    response = await object_store.open_object(bucket, object_name)
+    try:
+        async for chunk in response.aiter_bytes(_REHASH_READ_SIZE):
+            await run_in_threadpool(h.update, chunk)
+    finally:
+        await response.aclose()
+    return h.hexdigest()
+
+
+async def complete_session(
+    r: redis.asyncio.Redis,
+    session: UploadSession,
+    on_complete: Callable[[int, str], Awaitable[T]],
+) -> T:
+    """
+    Cierra la subida multipart con todas las partes, llama a
+    `on_complete(tamaño, sha256)` (el alta del media) y sólo entonces borra
+    la sesión, así que si algo falla a mitad de camino el cliente puede
+    reintentar. Si MinIO ya no conoce la subida (NoSuchUpload: un intento
+    anterior la cerró) se sigue con el objeto ya armado.
+    409 si faltan chunks, ya se está cerrando o el objeto no está completo.
+    """
+    lock_key = f"{_key(session.session_id)}:completing"
+    if not await r.set(lock_key, "1", nx=True, ex=600):
+        raise UploadSessionError(409, "La subida ya se está finalizando")
+    try:
+        parts = await received_parts(r, session)
+        missing = missing_chunks(session, parts)
+        if missing:
+            raise UploadSessionError(409, f"Faltan chunks: {missing[:20]}")
+        try:
+            await object_store.complete_multipart_upload(
+                session.bucket, session.object_name, session.upload_id, list(parts.items())
+            )
+        except ObjectStoreError as e:
+            if e.status_code != 404:
+                raise
+            # Ya cerrada por un intento anterior: el objeto tiene que estar entero
+            try:
+                info = await object_store.stat_object(session.bucket, session.object_name)
+            except ObjectStoreError as e:
+                if e.status_code == 404:
+                    raise UploadSessionError(409, "La subida ya no existe en MinIO")
+                raise
+            if info.size != session.size:
+                raise UploadSessionError(
+                    409, f"El objeto tiene {info.size} bytes, se declararon {session.size}"
+                )
+
+        running = _running_hashes.pop(session.session_id, None)
+        if running is not None and not running.broken and running.next_part > session.total_chunks:
+            async with running.lock:
+                content_sha256 = running.hash.hexdigest()
+        else:
+            content_sha256 = await _rehash_object(session.bucket, session.object_name)
+
+        result = await on_complete(session.size, content_sha256)
+        await _forget(r, session)
+        return result
+    finally:
+        await r.delete(lock_key)
+
+
+async def abort_session(r: redis.asyncio.Redis, session: UploadSession) -> None:
+    _running_hashes.pop(session.session_id, None)
+    await object_store.abort_multipart_upload(
+        session.bucket, session.object_name, session.upload_id
+    )
+    await _forget(r, session)
+
+
+async def _forget(r: redis.asyncio.Redis, session: UploadSession) -> None:
+    pipe = r.pipeline()
+    pipe.delete(_key(session.session_id), _parts_key(session.session_id))
+    upload_sweeper.untrack(pipe, _sweeper_entry(session))
+    await pipe.execute()
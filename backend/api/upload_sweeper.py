@@ -0,0 +1,114 @@
+# backend/api/upload_sweeper.py
+"""
+Limpieza de subidas abandonadas (upload_sessions.py y direct_uploads.py).
+
+Su estado en Redis expira solo, pero lo que dejaron en MinIO no: una subida
+multipart sin cerrar conserva sus partes y un PUT directo sin finalizar deja
+un objeto que ningún media referencia. Cada subida se anota en el sorted set
+uploads:expiries con la hora en que vence su estado; cerrarla o descartarla
+la quita. Cada proceso de la API barre periódicamente las vencidas:
+
+- multipart (sesiones y subidas directas grandes): se aborta en MinIO
+- PUT directo: se borra el objeto
+
+Con varias réplicas de la API sólo barre una entrada la que logra quitarla
+del set (ZREM). Si el estado todavía existe (se renovó) se reprograma.
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Optional
+
+import redis.asyncio
+import httpx
+
+from . import object_store
+from .object_store import ObjectStoreError
+
+UPLOAD_SWEEP_INTERVAL = int(os.getenv("UPLOAD_SWEEP_INTERVAL", "300"))
+EXPIRIES_KEY = "uploads:expiries"
+# Entradas vencidas por pasada
+_SWEEP_BATCH = 100
+
+_task: Optional[asyncio.Task] = None
+
+
+def entry(state_key: str, bucket: str, object_name: str, multipart_id: str) -> str:
+    """Miembro del set: todo lo necesario para limpiar cuando el estado ya no existe."""
+    return json.dumps(
+        {"key": state_key, "bucket": bucket, "object": object_name, "multipart_id": multipart_id},
+        sort_keys=True,
+    )
+
+
+def track(pipe: redis.asyncio.client.Pipeline, member: str, ttl: int) -> None:
+    """Anota (o renueva) el vencimiento de una subida dentro del pipeline del llamador."""
+    pipe.zadd(EXPIRIES_KEY, {member: time.time() + ttl})
+
+
+def untrack(pipe: redis.asyncio.client.Pipeline, member: str) -> None:
+    pipe.zrem(EXPIRIES_KEY, member)
+
+
+async def _discard(upload: dict) -> None:
+    if upload["multipart_id"]:
+        await object_store.abort_multipart_upload(
+            upload["bucket"], upload["object"], upload["multipart_id"]
+        )
+    else:
+        try:
+            await object_store.delete_object(upload["bucket"], upload["object"])
+        except ObjectStoreError as e:
+            if e.status_code != 404:
+                raise
+
+
+async def sweep(r: redis.asyncio.Redis) -> int:
+    """Una pasada: limpia hasta _SWEEP_BATCH subidas vencidas. Devuelve cuántas."""
+    now = time.time()
+    swept = 0
+    for member in await r.zrangebyscore(EXPIRIES_KEY, "-inf", now, start=0, num=_SWEEP_BATCH):
+        if not await r.zrem(EXPIRIES_KEY, member):
+            continue  # la tomó otra réplica
+        upload = json.loads(member)
+        ttl = await r.ttl(upload["key"])
+        if ttl != -2:  # el estado sigue vivo
+            await r.zadd(EXPIRIES_KEY, {member: now + (ttl if ttl > 0 else UPLOAD_SWEEP_INTERVAL)})
+            continue
+        try:
+            await _discard(upload)
+        except (ObjectStoreError, httpx.HTTPError) as e:
+            print(f"No se pudo limpiar la subida {upload['object']}: {e}")
+            await r.zadd(EXPIRIES_KEY, {member: now + UPLOAD_SWEEP_INTERVAL})
+            continue
+        swept += 1
+    return swept
+
+
+async def _run(r: redis.asyncio.Redis) -> None:
+    while True:
+        try:
+            swept = await sweep(r)
+            if swept:
+                print(f"Subidas abandonadas limpiadas: {swept}")
+        except Exception as e:
+            print(f"Error limpiando subidas abandonadas: {e}")
+        await asyncio.sleep(UPLOAD_SWEEP_INTERVAL)
+
+
+def start(r: redis.asyncio.Redis) -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(r))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
@@ -0,0 +1,75 @@
+# backend/api/worker_registry.py
+"""
+Registro de workers vivos en Redis (lo escriben los workers, lo leen la API
+y el autoscaler).
+
+- workers:registry  hash worker_id -> JSON con slots, slots ocupados,
+                    contadores acumulados (jobs, segundos de media y de
+                    encode) y last_seen (epoch del último latido).
+
+Un worker que deja de latir más de WORKER_REGISTRY_TTL segundos se considera
+caído; pasado 10 veces ese tiempo se borra del registro.
+"""
+import os
+import json
+import time
+from typing import Any, Dict, List, Tuple
+
+import redis
+import redis.asyncio
+
+WORKER_REGISTRY_KEY = "workers:registry"
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "5"))
+WORKER_REGISTRY_TTL = float(os.getenv("WORKER_REGISTRY_TTL", "30"))
+
+
+def heartbeat(r: redis.Redis, worker_id: str, info: Dict[str, Any]) -> None:
+    """Publica el estado actual del worker."""
+    entry = {**info, "worker_id": worker_id, "last_seen": time.time()}
+    r.hset(WORKER_REGISTRY_KEY, worker_id, json.dumps(entry))
+
+
+def unregister(r: redis.Redis, worker_id: str) -> None:
+    """El worker se apagó limpiamente: deja de aparecer de inmediato."""
+    r.hdel(WORKER_REGISTRY_KEY, worker_id)
+
+
+def _parse_registry(registry: dict, include_stale: bool) -> Tuple[List[Dict[str, Any]], list]:
+    """(workers ordenados por id, ids a purgar) a partir del hash del registro."""
+    now = time.time()
+    workers, expired = [], []
+    for worker_id, raw in registry.items():
+        try:
+            entry = json.loads(raw)
+        except json.JSONDecodeError:
+            expired.append(worker_id)
+            continue
+        age = now - float(entry.get("last_seen") or 0)
+        if age > 10 * WORKER_REGISTRY_TTL:
+            expired.append(worker_id)
+            continue
+        entry["online"] = age <= WORKER_REGISTRY_TTL
+        if entry["online"] or include_stale:
+            workers.append(entry)
+    return sorted(workers, key=lambda w: w["worker_id"]), expired
+
+
+def list_workers(r: redis.Redis, include_stale: bool = False) -> List[Dict[str, Any]]:
+    """
+    Workers registrados, ordenados por id. Cada uno lleva `online` (latió
+    hace menos de WORKER_REGISTRY_TTL). Los caídos hace mucho se purgan.
+    """
+    workers, expired = _parse_registry(r.hgetall(WORKER_REGISTRY_KEY), include_stale)
+    if expired:
+        r.hdel(WORKER_REGISTRY_KEY, *expired)
+    return workers
+
+
+async def list_workers_async(
+    r: redis.asyncio.Redis, include_stale: bool = False
+) -> List[Dict[str, Any]]:
+    """list_workers para la API (cliente redis.asyncio)."""
+    workers, expired = _parse_registry(await r.hgetall(WORKER_REGISTRY_KEY), include_stale)
+    if expired:
+        await r.hdel(WORKER_REGISTRY_KEY, *expired)
+    return workers
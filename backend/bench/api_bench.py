@@ -0,0 +1,191 @@
+# backend/bench/api_bench.py
+"""
+Benchmark de la API: RPS sostenido y latencias (p50/p90/p99) bajo carga.
+
+Lazo cerrado: `--concurrency` clientes piden las rutas en ronda durante
+`--duration` segundos (tras `--warmup` segundos que no cuentan). Las
+respuestas se leen enteras, así que /stream mide también la transferencia.
+
+Para comparar antes/después se guarda cada corrida con --out y luego:
+
+    python bench/api_bench.py --compare antes.json despues.json
+
+Ejemplo (dentro del contenedor de la API):
+
+    python bench/api_bench.py --base-url http://localhost:8000 \\
+        --username bench --password benchbench \\
+        --media-id <media_id> --job-id <job_id> \\
+        --concurrency 128 --duration 30 --out despues.json
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+def default_paths(media_id: Optional[str], job_id: Optional[str]) -> List[str]:
+    """Rutas representativas: sin E/S, Firestore, Redis y MinIO."""
+    paths = ["/me", "/monitor/summary"]
+    if media_id and job_id:
+        paths += [
+            f"/jobs/{job_id}/status?media_id={media_id}",
+            f"/media/{media_id}/share?job_id={job_id}",
+            f"/media/{media_id}/stream?job_id={job_id}",
+        ]
+    return paths
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    resp = await client.post("/auth/token", data={"username": username, "password": password})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+async def run_client(
+    client: httpx.AsyncClient,
+    paths: List[str],
+    offset: int,
+    start_at: float,
+    end_at: float,
+    latencies: Dict[str, List[float]],
+    errors: Dict[str, int],
+) -> None:
+    i = offset
+    while True:
+        now = time.perf_counter()
+        if now >= end_at:
+            return
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            resp = await client.get(path)
+            await resp.aread()
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        t1 = time.perf_counter()
+        if t0 < start_at:
+            continue  # calentamiento
+        if ok:
+            latencies[path].append(t1 - t0)
+        else:
+            errors[path] += 1
+
+
+async def bench(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        token = args.token
+        if not token and args.username:
+            token = await login(client, args.username, args.password)
+        if token:
+            client.headers["Authorization"] = f"Bearer {token}"
+
+        paths = args.path or default_paths(args.media_id, args.job_id)
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        start_at = time.perf_counter() + args.warmup
+        end_at = start_at + args.duration
+        await asyncio.gather(*(
+            run_client(client, paths, n, start_at, end_at, latencies, errors)
+            for n in range(args.concurrency)
+        ))
+
+    return summarize(paths, latencies, errors, args)
+
+
+def summarize(paths: List[str], latencies: Dict[str, List[float]], errors: Dict[str, int], args) -> dict:
+    def stats(values: List[float], errs: int) -> dict:
+        values = sorted(values)
+        ms = lambda v: round(v * 1000, 2) if v is not None else None
+        return {
+            "requests": len(values),
+            "errors": errs,
+            "rps": round(len(values) / args.duration, 1),
+            "p50_ms": ms(percentile(values, 50)),
+            "p90_ms": ms(percentile(values, 90)),
+            "p99_ms": ms(percentile(values, 99)),
+            "max_ms": ms(values[-1] if values else None),
+        }
+
+    return {
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "total": stats([v for p in paths for v in latencies[p]], sum(errors.values())),
+        "paths": {p: stats(latencies[p], errors[p]) for p in paths},
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"{result['base_url']}  concurrency={result['concurrency']}  duration={result['duration']}s")
+    header = f"{'ruta':60} {'rps':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'err':>6}"
+    print(header)
+    print("-" * len(header))
+    rows = [*result["paths"].items(), ("TOTAL", result["total"])]
+    for path, s in rows:
+        print(
+            f"{path[:60]:60} {s['rps']:>8} {s['p50_ms'] or '-':>8} {s['p90_ms'] or '-':>8} "
+            f"{s['p99_ms'] or '-':>8} {s['max_ms'] or '-':>8} {s['errors']:>6}"
+        )
+
+
+def print_comparison(before: dict, after: dict) -> None:
+    """RPS, p50 y p99 de dos corridas guardadas con --out."""
+    cols = [("rps", "rps"), ("p50", "p50_ms"), ("p99", "p99_ms")]
+    header = f"{'ruta':44}" + "".join(f" {name + ' antes':>10} {name + ' desp.':>10}" for name, _ in cols)
+    print(header)
+    print("-" * len(header))
+    rows = [(p, s, after["paths"].get(p)) for p, s in before["paths"].items()]
+    rows.append(("TOTAL", before["total"], after["total"]))
+    for path, b, a in rows:
+        if a is None:
+            continue
+        print(f"{path[:44]:44}" + "".join(f" {b[key] or '-':>10} {a[key] or '-':>10}" for _, key in cols))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", help="JWT ya emitido (si no, --username/--password)")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--media-id")
+    parser.add_argument("--job-id")
+    parser.add_argument("--path", action="append", help="ruta a pedir (repetible); por defecto un set representativo")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--out", help="guardar el resultado en JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_before, open(args.compare[1]) as f_after:
+            print_comparison(json.load(f_before), json.load(f_after))
+        return 0
+
+    result = asyncio.run(bench(args))
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0 if result["total"]["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
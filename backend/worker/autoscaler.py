@@ -0,0 +1,388 @@
+# backend/worker/autoscaler.py
+"""
+Autoscaler local de workers según la cola.
+
+Cada AUTOSCALER_INTERVAL segundos mira:
+
+- la cola (job_queue.queue_stats): jobs pendientes y en curso;
+- el registro de workers (api/worker_registry.py): slots, jobs terminados y
+  segundos de media / de encode acumulados por cada worker.
+
+Con las diferencias entre dos muestras estima cuánto tarda un job por slot
+(media móvil) y la velocidad de encode de la flota (segundos de media por
+segundo de reloj; < 1 es más lento que tiempo real). Los workers que hacen
+falta son los que vacían la cola en AUTOSCALER_TARGET_DRAIN_SECONDS:
+
+    slots = max(en curso, (pendientes + en curso) * seg_por_job / drain)
+    workers = ceil(slots / slots_por_worker)
+
+Los workers que no arrancó el autoscaler (p. ej. worker_a/worker_b de
+compose) cuentan como capacidad fija; el autoscaler sólo gestiona los suyos,
+entre AUTOSCALER_MIN_WORKERS y AUTOSCALER_MAX_WORKERS.
+
+Histéresis:
+- subir: en cuanto hace falta, pero no antes de AUTOSCALER_SCALE_UP_COOLDOWN
+  desde la última subida (los nuevos tardan en tomar jobs) ni si la flota ya
+  codifica por debajo de AUTOSCALER_MIN_ENCODE_SPEED: en la misma máquina más
+  procesos sólo se reparten la misma CPU.
+- bajar: de a uno, sólo si sobra capacidad durante AUTOSCALER_SCALE_DOWN_STABLE
+  seguidos. Se detiene el worker con menos slots ocupados, con SIGTERM: termina
+  sus jobs en curso antes de salir (drenado).
+
+Los procesos se arrancan con un WorkerLauncher; SubprocessLauncher lanza
+worker.py (o AUTOSCALER_WORKER_COMMAND, útil para probar con un proceso
+cualquiera como `sleep 3600`).
+"""
+import os
+import abc
+import sys
+import math
+import time
+import shlex
+import signal
+import logging
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import redis
+from prometheus_client import start_http_server, Counter, Gauge
+
+from api import job_queue, worker_registry
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+REDIS_QUEUE = os.getenv("REDIS_QUEUE", "convert")
+
+AUTOSCALER_METRICS_PORT = int(os.getenv("AUTOSCALER_METRICS_PORT", "9110"))
+AUTOSCALER_INTERVAL = float(os.getenv("AUTOSCALER_INTERVAL", "10"))
+# Workers gestionados por el autoscaler (no cuenta los levantados por fuera)
+AUTOSCALER_MIN_WORKERS = int(os.getenv("AUTOSCALER_MIN_WORKERS", "1"))
+AUTOSCALER_MAX_WORKERS = int(os.getenv("AUTOSCALER_MAX_WORKERS", "4"))
+# Tiempo en el que debería poder vaciarse la cola con los workers deseados
+AUTOSCALER_TARGET_DRAIN_SECONDS = float(os.getenv("AUTOSCALER_TARGET_DRAIN_SECONDS", "300"))
+AUTOSCALER_SCALE_UP_COOLDOWN = float(os.getenv("AUTOSCALER_SCALE_UP_COOLDOWN", "30"))
+AUTOSCALER_SCALE_DOWN_STABLE = float(os.getenv("AUTOSCALER_SCALE_DOWN_STABLE", "300"))
+# Por debajo de esta velocidad de encode (x tiempo real) no se agregan workers
+AUTOSCALER_MIN_ENCODE_SPEED = float(os.getenv("AUTOSCALER_MIN_ENCODE_SPEED", "0.3"))
+# Duración supuesta de un job mientras no haya jobs terminados para medirla
+AUTOSCALER_DEFAULT_JOB_SECONDS = float(os.getenv("AUTOSCALER_DEFAULT_JOB_SECONDS", "60"))
+# Espera máxima al apagar para que los workers gestionados terminen sus jobs
+AUTOSCALER_SHUTDOWN_TIMEOUT = float(os.getenv("AUTOSCALER_SHUTDOWN_TIMEOUT", "600"))
+
+AUTOSCALER_WORKER_PREFIX = os.getenv("AUTOSCALER_WORKER_PREFIX", "autoscaled_")
+# Comando de cada worker; por defecto este mismo intérprete con worker.py
+AUTOSCALER_WORKER_COMMAND = os.getenv("AUTOSCALER_WORKER_COMMAND", "")
+# El worker N expone métricas en AUTOSCALER_WORKER_METRICS_PORT + N
+AUTOSCALER_WORKER_METRICS_PORT = int(os.getenv("AUTOSCALER_WORKER_METRICS_PORT", "9120"))
+OUTPUT_BASE_DIR = os.getenv("OUTPUT_BASE_DIR", "/tmp/media_jobs")
+WORKER_CONCURRENCY = max(1, int(os.getenv("WORKER_CONCURRENCY", "1")))
+
+# Peso de la última muestra en la media móvil de segundos por job
+_EWMA_ALPHA = 0.3
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+autoscaler_desired_workers = Gauge(
+    "autoscaler_desired_workers",
+    "Workers gestionados que el autoscaler quiere tener",
+)
+autoscaler_managed_workers = Gauge(
+    "autoscaler_managed_workers",
+    "Workers arrancados por el autoscaler",
+    ["state"],  # running | draining
+)
+autoscaler_decisions_total = Counter(
+    "autoscaler_decisions_total",
+    "Decisiones del autoscaler en cada ciclo",
+    ["action"],  # scale_up | scale_down | hold | cooldown | slow_encode
+)
+autoscaler_queue_jobs = Gauge(
+    "autoscaler_queue_jobs",
+    "Jobs en la cola vistos en el último ciclo",
+    ["state"],  # pending | leased
+)
+autoscaler_job_seconds = Gauge(
+    "autoscaler_job_seconds",
+    "Segundos por job y slot estimados (media móvil)",
+)
+autoscaler_encode_speed = Gauge(
+    "autoscaler_encode_speed",
+    "Segundos de media codificados por segundo de encode en la flota",
+)
+autoscaler_worker_throughput = Gauge(
+    "autoscaler_worker_throughput_jobs_per_second",
+    "Jobs terminados por segundo en el último ciclo",
+    ["worker_id"],
+)
+
+
+class WorkerLauncher(abc.ABC):
+    """
+    Arranca y detiene procesos worker. SubprocessLauncher es el real; las
+    pruebas (tests/test_autoscaler.py) usan uno en memoria.
+    """
+
+    @abc.abstractmethod
+    def start(self, worker_id: str, index: int) -> None:
+        ...
+
+    @abc.abstractmethod
+    def stop(self, worker_id: str) -> None:
+        """Pide un apagado ordenado: el worker termina sus jobs y sale."""
+
+    @abc.abstractmethod
+    def running(self) -> List[str]:
+        """Workers vivos a los que no se pidió detenerse."""
+
+    @abc.abstractmethod
+    def draining(self) -> List[str]:
+        """Workers a los que se pidió detenerse y todavía no salieron."""
+
+    @abc.abstractmethod
+    def shutdown(self, timeout: float) -> None:
+        """Detiene todos y espera hasta `timeout` antes de matarlos."""
+
+
+class SubprocessLauncher(WorkerLauncher):
+    def __init__(self, command: Optional[List[str]] = None):
+        if command is None:
+            if AUTOSCALER_WORKER_COMMAND:
+                command = shlex.split(AUTOSCALER_WORKER_COMMAND)
+            else:
+                command = [sys.executable, str(Path(__file__).with_name("worker.py"))]
+        self.command = command
+        self._procs: Dict[str, subprocess.Popen] = {}
+        self._stopping: Dict[str, subprocess.Popen] = {}
+
+    def start(self, worker_id: str, index: int) -> None:
+        env = {
+            **os.environ,
+            "WORKER_ID": worker_id,
+            "METRICS_PORT": str(AUTOSCALER_WORKER_METRICS_PORT + index),
+            # Cada proceso limpia su carpeta al arrancar: no se comparten
+            "OUTPUT_BASE_DIR": os.path.join(OUTPUT_BASE_DIR, worker_id),
+        }
+        self._procs[worker_id] = subprocess.Popen(self.command, env=env)
+        logger.info(f"[autoscaler] started {worker_id} (pid {self._procs[worker_id].pid})")
+
+    def stop(self, worker_id: str) -> None:
+        proc = self._procs.pop(worker_id, None)
+        if proc is None:
+            return
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            self._stopping[worker_id] = proc
+        logger.info(f"[autoscaler] stopping {worker_id}")
+
+    def _reap(self) -> None:
+        for procs in (self._procs, self._stopping):
+            for worker_id, proc in list(procs.items()):
+                code = proc.poll()
+                if code is None:
+                    continue
+                del procs[worker_id]
+                if procs is self._procs:
+                    logger.warning(f"[autoscaler] {worker_id} exited unexpectedly (code {code})")
+
+    def running(self) -> List[str]:
+        self._reap()
+        return sorted(self._procs)
+
+    def draining(self) -> List[str]:
+        self._reap()
+        return sorted(self._stopping)
+
+    def shutdown(self, timeout: float) -> None:
+        for worker_id in list(self._procs):
+            self.stop(worker_id)
+        deadline = time.monotonic() + timeout
+        for worker_id, proc in list(self._stopping.items()):
+            try:
+                proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"[autoscaler] {worker_id} did not drain in time, killing it")
+                proc.kill()
+                proc.wait()
+        self._stopping.clear()
+
+
+class Autoscaler:
+    def __init__(
+        self,
+        r: redis.Redis,
+        launcher: WorkerLauncher,
+        queue: str = REDIS_QUEUE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.r = r
+        self.launcher = launcher
+        self.queue = queue
+        self.clock = clock
+        self.job_seconds = AUTOSCALER_DEFAULT_JOB_SECONDS
+        self.encode_speed: Optional[float] = None
+        self._samples: Dict[str, dict] = {}  # worker_id -> última entrada del registro
+        self._last_scale_up: Optional[float] = None
+        self._surplus_since: Optional[float] = None
+
+    def _worker_name(self, index: int) -> str:
+        return f"{AUTOSCALER_WORKER_PREFIX}{index}"
+
+    def _observe(self, workers: List[dict]) -> None:
+        """Actualiza segundos por job, velocidad de encode y throughput por worker."""
+        slot_seconds = jobs = media = encode = 0.0
+        seen = set()
+        for w in workers:
+            worker_id = w["worker_id"]
+            seen.add(worker_id)
+            prev = self._samples.get(worker_id)
+            self._samples[worker_id] = w
+            if prev is None:
+                continue
+            dt = float(w["last_seen"]) - float(prev["last_seen"])
+            finished = (
+                (w.get("jobs_done", 0) + w.get("jobs_failed", 0))
+                - (prev.get("jobs_done", 0) + prev.get("jobs_failed", 0))
+            )
+            if dt <= 0 or finished < 0:
+                continue  # mismo latido o el worker se reinició
+            autoscaler_worker_throughput.labels(worker_id=worker_id).set(finished / dt)
+            # Slots ocupados promedio entre las dos muestras
+            slot_seconds += dt * (w.get("busy", 0) + prev.get("busy", 0)) / 2
+            jobs += finished
+            media += w.get("media_seconds", 0.0) - prev.get("media_seconds", 0.0)
+            encode += w.get("encode_seconds", 0.0) - prev.get("encode_seconds", 0.0)
+
+        for worker_id in set(self._samples) - seen:
+            del self._samples[worker_id]
+            try:
+                autoscaler_worker_throughput.remove(worker_id)
+            except KeyError:
+                pass
+
+        if jobs > 0 and slot_seconds > 0:
+            sample = slot_seconds / jobs
+            self.job_seconds = _EWMA_ALPHA * sample + (1 - _EWMA_ALPHA) * self.job_seconds
+        if encode > 0:
+            self.encode_speed = media / encode
+        autoscaler_job_seconds.set(self.job_seconds)
+        if self.encode_speed is not None:
+            autoscaler_encode_speed.set(self.encode_speed)
+
+    def desired_total(self, pending: int, leased: int, slots_per_worker: float) -> int:
+        """Workers (de toda la flota) para vaciar la cola en el tiempo objetivo."""
+        backlog_slots = (pending + leased) * self.job_seconds / AUTOSCALER_TARGET_DRAIN_SECONDS
+        slots = max(float(leased), backlog_slots)
+        return math.ceil(slots / slots_per_worker)
+
+    def step(self) -> str:
+        """Un ciclo: mide, decide y actúa. Devuelve la acción tomada."""
+        now = self.clock()
+        stats = job_queue.queue_stats(self.r, self.queue)
+        pending, leased = stats["pending"], stats["leased"]
+        workers = worker_registry.list_workers(self.r)
+        self._observe(workers)
+
+        running = self.launcher.running()
+        managed = set(running) | set(self.launcher.draining())
+        fixed = [w for w in workers if w["worker_id"] not in managed and not w.get("draining")]
+        slots = [w.get("slots") or WORKER_CONCURRENCY for w in workers] or [WORKER_CONCURRENCY]
+        slots_per_worker = sum(slots) / len(slots)
+
+        wanted = self.desired_total(pending, leased, slots_per_worker) - len(fixed)
+        target = min(AUTOSCALER_MAX_WORKERS, max(AUTOSCALER_MIN_WORKERS, wanted))
+
+        autoscaler_queue_jobs.labels(state="pending").set(pending)
+        autoscaler_queue_jobs.labels(state="leased").set(leased)
+        autoscaler_desired_workers.set(target)
+
+        action = "hold"
+        if target > len(running):
+            self._surplus_since = None
+            # Por debajo del mínimo (arranque o un worker caído) no se espera
+            below_min = len(running) < AUTOSCALER_MIN_WORKERS
+            if (
+                not below_min
+                and self._last_scale_up is not None
+                and now - self._last_scale_up < AUTOSCALER_SCALE_UP_COOLDOWN
+            ):
+                action = "cooldown"
+            elif (
+                not below_min
+                and self.encode_speed is not None
+                and self.encode_speed < AUTOSCALER_MIN_ENCODE_SPEED
+            ):
+                action = "slow_encode"
+            else:
+                index = 0
+                for _ in range(target - len(running)):
+                    while self._worker_name(index) in managed:
+                        index += 1
+                    name = self._worker_name(index)
+                    self.launcher.start(name, index)
+                    managed.add(name)
+                self._last_scale_up = now
+                action = "scale_up"
+        elif target < len(running):
+            if self._surplus_since is None:
+                self._surplus_since = now
+            elif now - self._surplus_since >= AUTOSCALER_SCALE_DOWN_STABLE:
+                busy = {w["worker_id"]: w.get("busy", 0) for w in workers}
+                victim = min(running, key=lambda worker_id: (busy.get(worker_id, 0), worker_id))
+                self.launcher.stop(victim)
+                # El siguiente paso hacia abajo vuelve a esperar el periodo completo
+                self._surplus_since = now
+                action = "scale_down"
+        else:
+            self._surplus_since = None
+
+        autoscaler_decisions_total.labels(action=action).inc()
+        autoscaler_managed_workers.labels(state="running").set(len(self.launcher.running()))
+        autoscaler_managed_workers.labels(state="draining").set(len(self.launcher.draining()))
+        if action in ("scale_up", "scale_down"):
+            logger.info(
+                f"[autoscaler] {action}: pending={pending} leased={leased} "
+                f"job_seconds={self.job_seconds:.1f} target={target} "
+                f"running={len(self.launcher.running())}"
+            )
+        return action
+
+
+def main() -> None:
+    start_http_server(AUTOSCALER_METRICS_PORT)
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    launcher = SubprocessLauncher()
+    autoscaler = Autoscaler(r, launcher)
+
+    stop_event = threading.Event()
+
+    def _request_stop(signum, _frame):
+        logger.info(f"[autoscaler] received signal {signum}, stopping managed workers")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    logger.info(
+        f"[autoscaler] watching queue '{REDIS_QUEUE}', "
+        f"{AUTOSCALER_MIN_WORKERS}-{AUTOSCALER_MAX_WORKERS} worker(s)"
+    )
+    while not stop_event.is_set():
+        try:
+            autoscaler.step()
+        except redis.RedisError as e:
+            logger.warning(f"[autoscaler] redis error: {e}")
+        stop_event.wait(AUTOSCALER_INTERVAL)
+
+    launcher.shutdown(AUTOSCALER_SHUTDOWN_TIMEOUT)
+    logger.info("[autoscaler] shutdown complete")
+
+
+if __name__ == "__main__":
+    main()
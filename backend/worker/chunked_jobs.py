@@ -0,0 +1,218 @@
+# backend/worker/chunked_jobs.py
+"""
+Conversión por partes (split & merge) de videos largos.
+
+1. split:  el worker que toma el job original corta el video en keyframes
+           (stream copy), sube las partes a work/<job_id>/parts/ y encola un
+           sub-job "chunk" por parte. El job original queda en 'processing'.
+2. chunk:  cualquier worker codifica una parte (sólo video) y la deja en
+           work/<job_id>/encoded/. El último chunk en terminar encola el merge.
+3. merge:  une las partes sin recodificar, codifica el audio del original y
+           publica la salida final en el output_prefix del job original.
+
+Al terminar el merge, o en cuanto falla una parte o el merge, se borra
+work/<job_id>/ de MinIO.
+
+El estado vive en Redis (chunks:<job_id>) y el progreso se refleja en
+Firestore en jobs.<job_id> (chunks_total, chunks_done).
+"""
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import redis
+from google.cloud import firestore
+
+from api import job_queue
+from api.firebase_db import get_job_status_writer
+from ffmpeg_tasks import split_video_at_keyframes
+from minio_client import get_shared_minio_client, upload_object, MINIO_UPLOAD_THREADS
+
+logger = logging.getLogger(__name__)
+
+CHUNKED_ENCODING_ENABLED = os.getenv("CHUNKED_ENCODING_ENABLED", "true").lower() == "true"
+# Sólo se parte un video si dura al menos esto (segundos)
+CHUNK_MIN_DURATION = float(os.getenv("CHUNK_MIN_DURATION", "600"))
+# Duración aproximada de cada parte (los cortes caen en el keyframe siguiente)
+CHUNK_SECONDS = int(os.getenv("CHUNK_SECONDS", "120"))
+CHUNKED_TARGETS = ("mp4", "hls")
+
+STATE_KEY = "chunks:{}"
+DONE_KEY = "chunks:{}:done"
+STATE_TTL = 2 * 24 * 3600
+
+
+def should_chunk(job: dict) -> bool:
+    """Un job normal de video, largo y sin chunked=false, se convierte por partes."""
+    if not CHUNKED_ENCODING_ENABLED or job.get("chunked") is False:
+        return False
+    if (job.get("kind") or "convert") != "convert":
+        return False
+    if job.get("target") not in CHUNKED_TARGETS:
+        return False
+    if job.get("hls_ladder"):
+        return False  # el ABR ya decodifica una vez para todas las variantes
+    if not job.get("output_bucket") or not job.get("output_prefix"):
+        return False
+    duration = job.get("source_duration") or 0
+    return duration >= CHUNK_MIN_DURATION
+
+
+def work_prefix(parent_job_id: str) -> str:
+    return f"work/{parent_job_id}"
+
+
+def start_chunked_job(r: redis.Redis, queue: str, job: dict, src_path: str, work_dir: Path) -> int:
+    """
+    Fase split. Devuelve el número de partes encoladas; 0 si el video no
+    llegó a partirse (el llamador lo convierte de una pasada).
+    """
+    parent_id = job["job_id"]
+    bucket = job["output_bucket"]
+    parts = split_video_at_keyframes(src_path, str(work_dir / "parts"), CHUNK_SECONDS)
+    if len(parts) < 2:
+        return 0
+
+    prefix = work_prefix(parent_id)
+    client = get_shared_minio_client()
+    part_objects = [f"{prefix}/parts/{Path(p).name}" for p in parts]
+    with ThreadPoolExecutor(max_workers=MINIO_UPLOAD_THREADS) as pool:
+        list(pool.map(
+            lambda args: upload_object(bucket, args[1], args[0], "video/x-matroska", client=client),
+            zip(parts, part_objects),
+        ))
+
+    total = len(parts)
+    state_key = STATE_KEY.format(parent_id)
+    pipe = r.pipeline()
+    pipe.delete(state_key, DONE_KEY.format(parent_id))
+    pipe.hset(state_key, mapping={"total": total, "failed": 0, "parent": json.dumps(job)})
+    pipe.expire(state_key, STATE_TTL)
+    pipe.execute()
+
+    if job.get("media_id"):
+        get_job_status_writer().update_job(
+            job["media_id"],
+            parent_id,
+            mode="chunked",
+            chunks_total=total,
+            chunks_done=0,
+            updated_at=firestore.SERVER_TIMESTAMP,
+        )
+
+    chunk_cost = (job.get("estimated_cost") or 0.0) / total
+    for index, part_object in enumerate(part_objects):
+        job_queue.enqueue(
+            r,
+            queue,
+            {
+                "kind": "chunk",
+                "job_id": f"{parent_id}.chunk{index:04d}",
+                "parent_job_id": parent_id,
+                "media_id": job.get("media_id"),
+                "target": job["target"],
+                "index": index,
+                "source_bucket": bucket,
+                "source_object": part_object,
+                "output_bucket": bucket,
+                "output_object": f"{prefix}/encoded/part_{index:04d}.mkv",
+                "encoder_preset": job.get("encoder_preset"),  # mismo preset en todas las partes
+            },
+            estimated_cost=chunk_cost,
+        )
+    return total
+
+
+def complete_chunk(r: redis.Redis, job: dict) -> Optional[dict]:
+    """
+    Registra una parte terminada (idempotente si el chunk se reintenta).
+    Si era la última devuelve el payload del job de merge, si no None.
+    """
+    parent_id = job["parent_job_id"]
+    state_key = STATE_KEY.format(parent_id)
+    done_key = DONE_KEY.format(parent_id)
+
+    pipe = r.pipeline()
+    pipe.sadd(done_key, job["index"])
+    pipe.expire(done_key, STATE_TTL)
+    pipe.scard(done_key)
+    pipe.hmget(state_key, "total", "failed", "parent")
+    added, _, done, (total, failed, parent_raw) = pipe.execute()
+
+    if total is None or int(failed or 0):
+        # Estado perdido o el job ya falló: no se une. Si falló, la limpieza
+        # de fail_chunked_job pudo pasar antes de esta subida: se borra aquí
+        if failed is not None and int(failed):
+            remove_object(job["output_bucket"], job["output_object"])
+        return None
+    if added and job.get("media_id"):
+        get_job_status_writer().update_job(
+            job["media_id"],
+            parent_id,
+            chunks_done=firestore.Increment(1),
+            updated_at=firestore.SERVER_TIMESTAMP,
+        )
+    # Sólo el chunk que completa el conjunto (added) dispara el merge
+    if not added or done < int(total):
+        return None
+
+    parent = json.loads(parent_raw)
+    prefix = work_prefix(parent_id)
+    return {
+        **parent,
+        "kind": "merge",
+        "job_id": f"{parent_id}.merge",
+        "parent_job_id": parent_id,
+        "chunk_objects": [
+            f"{prefix}/encoded/part_{i:04d}.mkv" for i in range(int(total))
+        ],
+    }
+
+
+def fail_chunked_job(r: redis.Redis, job: dict) -> None:
+    """
+    Una parte falló: el merge ya no se encola y se borran de MinIO las partes
+    intermedias. El estado de Redis se conserva hasta que expira para que las
+    partes que siguen en la cola o en curso vean el fallo y no dejen su
+    salida. El job original se marca failed en Firestore como cualquier otro
+    job (handle_job).
+    """
+    parent_id = job["parent_job_id"]
+    state_key = STATE_KEY.format(parent_id)
+    pipe = r.pipeline()
+    pipe.hincrby(state_key, "failed", 1)
+    pipe.expire(state_key, STATE_TTL)
+    failed, _ = pipe.execute()
+    if failed == 1:  # sólo la primera parte que falla limpia
+        remove_work_objects(job["output_bucket"], parent_id)
+
+
+def chunked_job_failed(r: redis.Redis, parent_id: str) -> bool:
+    return int(r.hget(STATE_KEY.format(parent_id), "failed") or 0) > 0
+
+
+def remove_object(bucket: str, object_name: str) -> None:
+    try:
+        get_shared_minio_client().remove_object(bucket, object_name)
+    except Exception as e:
+        logger.warning(f"could not remove {object_name}: {e}")
+
+
+def remove_work_objects(bucket: str, parent_id: str) -> None:
+    """Borra de MinIO las partes intermedias (work/<job_id>/) de un video partido."""
+    client = get_shared_minio_client()
+    prefix = work_prefix(parent_id)
+    try:
+        for obj in client.list_objects(bucket, prefix=f"{prefix}/", recursive=True):
+            client.remove_object(bucket, obj.object_name)
+    except Exception as e:
+        logger.warning(f"could not clean up {prefix}: {e}")
+
+
+def cleanup_chunked_job(r: redis.Redis, parent_id: str, bucket: str) -> None:
+    """Borra las partes intermedias de MinIO y el estado de Redis tras el merge."""
+    remove_work_objects(bucket, parent_id)
+    r.delete(STATE_KEY.format(parent_id), DONE_KEY.format(parent_id))
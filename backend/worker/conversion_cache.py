@@ -0,0 +1,241 @@
+# backend/worker/conversion_cache.py
+"""
+Caché de conversiones direccionada por contenido.
+
+Clave = sha256(huella del original + target + firma de parámetros de ffmpeg).
+Las salidas cacheadas viven en MinIO bajo `cache/<clave>/...` (copias
+server-side de la primera conversión) y los metadatos en Redis:
+
+- convcache:entry:<clave>  hash con bucket, prefix, objetos, tamaño, hits y refs
+- convcache:lru            zset clave -> último uso (para desalojo LRU)
+- convcache:bytes          bytes totales ocupados por la caché
+
+`refs` cuenta las copias en curso desde una entrada: mientras sea > 0 la
+entrada no se puede desalojar (sus objetos se están leyendo).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Optional
+
+import redis
+from minio import Minio
+from minio.commonconfig import CopySource, ComposeSource
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE_ENABLED = os.getenv("CONVERSION_CACHE_ENABLED", "true").lower() == "true"
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", str(50 * 1024**3)))
+CONVERSION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSION_CACHE_MAX_ENTRIES", "5000"))
+CACHE_PREFIX = "cache"
+
+ENTRY_KEY = "convcache:entry:{}"
+LRU_KEY = "convcache:lru"
+BYTES_KEY = "convcache:bytes"
+
+# Tiempo máximo que una entrada puede quedar a medio registrar (worker caído)
+_COPYING_TTL = 3600
+
+# copy_object de S3 sólo admite objetos de hasta 5 GiB; por encima se usa compose
+_MAX_SINGLE_COPY = 5 * 1024**3
+
+cache_lookups_total = Counter(
+    "worker_conversion_cache_lookups_total",
+    "Búsquedas en la caché de conversiones",
+    ["worker_id", "result"],  # hit | miss
+)
+cache_evictions_total = Counter(
+    "worker_conversion_cache_evictions_total",
+    "Entradas desalojadas de la caché de conversiones",
+    ["worker_id"],
+)
+cache_bytes = Gauge(
+    "worker_conversion_cache_bytes",
+    "Bytes ocupados por la caché de conversiones",
+    ["worker_id"],
+)
+
+# Si la entrada existe: fija una referencia, cuenta el hit y la marca como usada
+_ACQUIRE_LUA = """
+if redis.call('HGET', KEYS[1], 'state') ~= 'ready' then
+  return nil
+end
+redis.call('HINCRBY', KEYS[1], 'refs', 1)
+redis.call('HINCRBY', KEYS[1], 'hits', 1)
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# Borra la entrada sólo si nadie la está copiando; devuelve {bucket, objetos}
+_EVICT_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  redis.call('ZREM', KEYS[2], ARGV[1])
+  return nil
+end
+if tonumber(redis.call('HGET', KEYS[1], 'refs') or '0') > 0 then
+  return nil
+end
+local bucket = redis.call('HGET', KEYS[1], 'bucket')
+local objects = redis.call('HGET', KEYS[1], 'objects')
+local size = tonumber(redis.call('HGET', KEYS[1], 'size_bytes') or '0')
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('DECRBY', KEYS[3], size)
+return {bucket, objects}
+"""
+
+
+def cache_key(source_fingerprint: str, target: str, signature: str) -> str:
+    raw = f"{source_fingerprint}|{target}|{signature}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def source_fingerprint(client: Minio, job: dict) -> Optional[str]:
+    """
+    Huella del original: el sha256 calculado por la API al subirlo o,
+    para medias antiguos, el ETag + tamaño del objeto en MinIO.
+    """
+    if job.get("content_sha256"):
+        return f"sha256:{job['content_sha256']}"
+    bucket = job.get("source_bucket")
+    obj = job.get("source_object")
+    if not bucket or not obj:
+        return None
+    st = client.stat_object(bucket, obj)
+    return f"etag:{st.etag}:{st.size}"
+
+
+def _copy(client: Minio, bucket: str, src: str, dst: str, size: int) -> None:
+    if size > _MAX_SINGLE_COPY:
+        client.compose_object(bucket, dst, [ComposeSource(bucket, src)])
+    else:
+        client.copy_object(bucket, dst, CopySource(bucket, src))
+
+
+class ConversionCache:
+    def __init__(self, r: redis.Redis, client: Minio, worker_id: str):
+        self.r = r
+        self.client = client
+        self.worker_id = worker_id
+
+    def acquire(self, key: str) -> Optional[dict]:
+        """Busca la clave; si existe deja una referencia fijada (llamar a release)."""
+        return self.acquire_first([key])[1]
+
+    def acquire_first(self, keys: list[str]) -> tuple[Optional[str], Optional[dict]]:
+        """
+        Como acquire con varias claves aceptables, en orden de preferencia:
+        devuelve (clave, entrada) de la primera que exista o (None, None).
+        Cuenta un solo hit/miss por búsqueda.
+        """
+        for key in keys:
+            entry = self._acquire(key)
+            if entry is not None:
+                cache_lookups_total.labels(worker_id=self.worker_id, result="hit").inc()
+                return key, entry
+        cache_lookups_total.labels(worker_id=self.worker_id, result="miss").inc()
+        return None, None
+
+    def _acquire(self, key: str) -> Optional[dict]:
+        raw = self.r.register_script(_ACQUIRE_LUA)(
+            keys=[ENTRY_KEY.format(key), LRU_KEY], args=[time.time(), key]
+        )
+        if not raw:
+            return None
+        it = iter(raw)
+        entry = {k.decode(): v.decode() for k, v in zip(it, it)}
+        entry["objects"] = json.loads(entry["objects"])
+        entry["size_bytes"] = int(entry["size_bytes"])
+        return entry
+
+    def release(self, key: str) -> None:
+        self.r.hincrby(ENTRY_KEY.format(key), "refs", -1)
+
+    def copy_to(self, entry: dict, bucket: str, prefix: str) -> None:
+        """Copia server-side la salida cacheada al prefijo del job."""
+        for name, size in entry["objects"]:
+            _copy(
+                self.client,
+                bucket,
+                f"{entry['prefix']}/{name}",
+                f"{prefix}/{name}",
+                size,
+            )
+
+    def store(
+        self,
+        key: str,
+        bucket: str,
+        job_prefix: str,
+        objects: list[tuple[str, int]],
+        output_object: str,
+    ) -> None:
+        """
+        Registra la salida recién subida de un job como entrada de la caché.
+        `objects` son (nombre relativo al prefijo, tamaño) y `output_object`
+        el nombre relativo del archivo principal.
+        """
+        entry_key = ENTRY_KEY.format(key)
+        # Si otro worker ya la registró (mismo original en paralelo) no duplicamos
+        if not self.r.hsetnx(entry_key, "state", "copying"):
+            return
+        self.r.expire(entry_key, _COPYING_TTL)
+
+        cache_prefix = f"{CACHE_PREFIX}/{key}"
+        size_bytes = sum(size for _, size in objects)
+        try:
+            for name, size in objects:
+                _copy(self.client, bucket, f"{job_prefix}/{name}", f"{cache_prefix}/{name}", size)
+        except Exception:
+            self.r.delete(entry_key)
+            raise
+
+        pipe = self.r.pipeline()
+        pipe.hset(entry_key, mapping={
+            "state": "ready",
+            "bucket": bucket,
+            "prefix": cache_prefix,
+            "objects": json.dumps(objects),
+            "output_object": output_object,
+            "size_bytes": size_bytes,
+            "created_at": time.time(),
+            "hits": 0,
+            "refs": 0,
+        })
+        pipe.persist(entry_key)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.incrby(BYTES_KEY, size_bytes)
+        pipe.execute()
+        self.evict()
+
+    def evict(self) -> None:
+        """Desaloja por LRU hasta volver a los límites de bytes y de entradas."""
+        evict_script = self.r.register_script(_EVICT_LUA)
+        skipped = 0
+        while True:
+            total = int(self.r.get(BYTES_KEY) or 0)
+            count = self.r.zcard(LRU_KEY)
+            cache_bytes.labels(worker_id=self.worker_id).set(total)
+            if total <= CONVERSION_CACHE_MAX_BYTES and count <= CONVERSION_CACHE_MAX_ENTRIES:
+                return
+            # Las entradas fijadas (refs > 0) se saltan y se prueba la siguiente
+            oldest = self.r.zrange(LRU_KEY, skipped, skipped)
+            if not oldest:
+                return
+            key = oldest[0].decode()
+            evicted = evict_script(
+                keys=[ENTRY_KEY.format(key), LRU_KEY, BYTES_KEY], args=[key]
+            )
+            if evicted is None:
+                skipped += 1
+                continue
+            bucket, objects = evicted[0].decode(), evicted[1]
+            for name, _ in json.loads(objects):
+                try:
+                    self.client.remove_object(bucket, f"{CACHE_PREFIX}/{key}/{name}")
+                except Exception as e:
+                    logger.warning(f"conversion cache: could not remove {key}/{name}: {e}")
+            cache_evictions_total.labels(worker_id=self.worker_id).inc()
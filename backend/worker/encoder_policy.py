@@ -0,0 +1,91 @@
+# backend/worker/encoder_policy.py
+"""
+Preset de x264 adaptativo según la profundidad de la cola.
+
+Con la cola vacía (<= ENCODER_QUEUE_IDLE jobs pendientes) se codifica con el
+preset más lento permitido (mejor compresión); con la cola llena
+(>= ENCODER_QUEUE_BUSY) con el más rápido, para absorber picos sin
+sobredimensionar los workers. Entre ambos se interpola sobre los presets de
+x264. La calidad (CRF) no cambia: el preset sólo mueve el compromiso entre
+velocidad y tamaño, dentro de los límites ENCODER_PRESET_FAST / _SLOW.
+"""
+import os
+import logging
+from typing import Optional
+
+import redis
+from prometheus_client import Counter, Gauge
+
+from api import job_queue
+from ffmpeg_tasks import X264_PRESETS
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_PRESET_ENABLED = os.getenv("ADAPTIVE_PRESET_ENABLED", "true").lower() == "true"
+
+
+def _preset_env(name: str, default: str) -> str:
+    """Preset de x264 de una variable de entorno; uno desconocido usa el default."""
+    value = os.getenv(name, default).strip().lower()
+    if value not in X264_PRESETS:
+        logger.warning(f"{name}={value!r} is not an x264 preset, using {default!r}")
+        return default
+    return value
+
+
+# Límites de calidad: nunca más rápido que FAST ni más lento que SLOW
+ENCODER_PRESET_FAST = _preset_env("ENCODER_PRESET_FAST", "superfast")
+ENCODER_PRESET_SLOW = _preset_env("ENCODER_PRESET_SLOW", "medium")
+# Jobs pendientes a partir de los cuales la cola se considera ociosa / saturada
+ENCODER_QUEUE_IDLE = int(os.getenv("ENCODER_QUEUE_IDLE", "0"))
+ENCODER_QUEUE_BUSY = int(os.getenv("ENCODER_QUEUE_BUSY", "20"))
+
+encoder_preset_total = Counter(
+    "worker_encoder_preset_total",
+    "Veces que la política adaptativa eligió cada preset de x264",
+    ["worker_id", "preset"],
+)
+encoder_queue_depth = Gauge(
+    "worker_encoder_queue_depth",
+    "Jobs pendientes vistos al elegir el último preset",
+    ["worker_id"],
+)
+
+
+def _preset_range() -> tuple[str, ...]:
+    """Presets permitidos, del más rápido al más lento."""
+    fast = X264_PRESETS.index(ENCODER_PRESET_FAST)
+    slow = X264_PRESETS.index(ENCODER_PRESET_SLOW)
+    if fast > slow:
+        fast, slow = slow, fast
+    return X264_PRESETS[fast:slow + 1]
+
+
+def preset_for_queue_depth(depth: int) -> str:
+    """Preset para una cola con `depth` jobs pendientes."""
+    presets = _preset_range()
+    if depth <= ENCODER_QUEUE_IDLE:
+        return presets[-1]
+    if depth >= ENCODER_QUEUE_BUSY:
+        return presets[0]
+    load = (depth - ENCODER_QUEUE_IDLE) / (ENCODER_QUEUE_BUSY - ENCODER_QUEUE_IDLE)
+    return presets[round((1 - load) * (len(presets) - 1))]
+
+
+def choose_preset(r: redis.Redis, queue: str, worker_id: str) -> Optional[str]:
+    """
+    Elige el preset para el job que está por empezar mirando la cola.
+    None (preset por defecto de cada target) si la política está desactivada
+    o no se pudo leer la cola.
+    """
+    if not ADAPTIVE_PRESET_ENABLED:
+        return None
+    try:
+        depth = job_queue.pending_count(r, queue)
+    except redis.RedisError as e:
+        logger.warning(f"[{worker_id}] could not read queue depth: {e}")
+        return None
+    preset = preset_for_queue_depth(depth)
+    encoder_queue_depth.labels(worker_id=worker_id).set(depth)
+    encoder_preset_total.labels(worker_id=worker_id, preset=preset).inc()
+    return preset
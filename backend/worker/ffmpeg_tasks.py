@@ -1,27 +1,351 @@
 # backend/api/worker/ffmpeg_tasks.py
 import os
+import json
+import hashlib
+import logging
+import threading
 import subprocess
+from collections import deque
 from pathlib import Path
+from typing import Callable, Collection, Optional
 
+from waveform import PeaksBuilder, PEAKS_PCM_ARGS, PEAKS_VERSION
+from previews import preview_output_args, write_thumbnails_vtt, previews_signature
 
-def run_ffmpeg(cmd: list[str]) -> None:
-    """Ejecuta ffmpeg y lanza error si falla."""
-    proc = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+logger = logging.getLogger(__name__)
+
+
+# Parámetros de codificación por target. Son la única fuente de verdad:
+# los usan los comandos de abajo y la firma de la caché de conversiones,
+# así que cambiar cualquiera invalida automáticamente lo cacheado.
+MP3_OUTPUT_ARGS = [
+    "-vn",              # sin video
+    "-ar", "44100",     # sample rate
+    "-ac", "2",         # 2 canales
+    "-b:a", "192k",     # bitrate de audio
+]
+MP4_VIDEO_ARGS = [
+    "-c:v", "libx264",
+    "-preset", "veryfast",
+    "-crf", "23",
+]
+MP4_AUDIO_ARGS = [
+    "-c:a", "aac",
+    "-b:a", "128k",
+]
+MP4_OUTPUT_ARGS = [
+    *MP4_VIDEO_ARGS,
+    *MP4_AUDIO_ARGS,
+    "-movflags", "+faststart",
+]
+HLS_VIDEO_ARGS = [
+    "-c:v", "libx264",
+]
+HLS_AUDIO_ARGS = [
+    "-c:a", "aac",
+]
+HLS_MUXER_ARGS = [
+    "-start_number", "0",
+    "-hls_time", "5",
+    "-hls_list_size", "0",
+    "-hls_flags", "temp_file",
+    "-f", "hls",
+]
+HLS_OUTPUT_ARGS = [
+    *HLS_VIDEO_ARGS,
+    *HLS_AUDIO_ARGS,
+    *HLS_MUXER_ARGS,
+]
+# Escalera ABR (HLS multi-bitrate). "audio" es una variante sólo de audio.
+HLS_LADDER_PRESETS = {
+    "1080p": {"height": 1080, "video_bitrate": "5000k", "maxrate": "5350k", "bufsize": "7500k", "audio_bitrate": "128k"},
+    "720p": {"height": 720, "video_bitrate": "2800k", "maxrate": "2996k", "bufsize": "4200k", "audio_bitrate": "128k"},
+    "480p": {"height": 480, "video_bitrate": "1400k", "maxrate": "1498k", "bufsize": "2100k", "audio_bitrate": "96k"},
+    "360p": {"height": 360, "video_bitrate": "800k", "maxrate": "856k", "bufsize": "1200k", "audio_bitrate": "96k"},
+    "audio": {"height": None, "audio_bitrate": "64k"},
+}
+HLS_MASTER_PLAYLIST = "master.m3u8"
+
+TARGET_OUTPUT_ARGS = {
+    "mp3": MP3_OUTPUT_ARGS,
+    "mp4": MP4_OUTPUT_ARGS,
+    "hls": HLS_OUTPUT_ARGS,
+}
+
+# Camino rápido (remux): si los códecs del original ya son los del target se
+# copian las pistas tal cual (sin decodificar) y sólo cambia el contenedor.
+# Los -map explícitos evitan arrastrar subtítulos/datos que el contenedor no admite.
+MP3_REMUX_ARGS = [
+    "-map", "0:a:0",
+    "-c:a", "copy",
+]
+MP4_REMUX_ARGS = [
+    "-map", "0:v:0",
+    "-map", "0:a:0?",
+    "-c", "copy",
+    "-movflags", "+faststart",
+]
+HLS_REMUX_ARGS = [
+    "-map", "0:v:0",
+    "-map", "0:a:0?",
+    "-c", "copy",
+    *HLS_MUXER_ARGS,
+]
+TARGET_REMUX_ARGS = {
+    "mp3": MP3_REMUX_ARGS,
+    "mp4": MP4_REMUX_ARGS,
+    "hls": HLS_REMUX_ARGS,
+}
+# Códecs que el target puede llevar sin recodificar. H.264 sólo en 8 bits
+# 4:2:0: el resto (p.ej. High 10) no lo reproducen muchos navegadores.
+REMUX_AUDIO_CODECS = {"mp3": ("mp3",), "mp4": ("aac",), "hls": ("aac",)}
+REMUX_VIDEO_CODECS = ("h264",)
+REMUX_PIX_FMTS = ("yuv420p", "yuvj420p")
+
+
+# Presets de x264 del más rápido (peor compresión) al más lento
+X264_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow",
+)
+
+
+def with_preset(args: list[str], preset: Optional[str]) -> list[str]:
+    """
+    Devuelve los parámetros con el preset de x264 indicado (reemplaza el
+    del target o lo añade tras libx264). Sin preset, o si los parámetros no
+    codifican con x264 (mp3, remux), se devuelven tal cual.
+    """
+    if not preset or "libx264" not in args:
+        return args
+    if preset not in X264_PRESETS:
+        raise ValueError(f"unknown x264 preset: {preset}")
+    args = list(args)
+    if "-preset" in args:
+        args[args.index("-preset") + 1] = preset
+    else:
+        at = args.index("libx264") + 1
+        args[at:at] = ["-preset", preset]
+    return args
+
+
+def target_output_args(
+    target: str, remux: bool = False, preset: Optional[str] = None
+) -> list[str]:
+    """Parámetros de salida del target: transcodificación (con `preset`) o copia de pistas."""
+    args = TARGET_REMUX_ARGS if remux else TARGET_OUTPUT_ARGS
+    if target not in args:
+        raise ValueError(f"unsupported target: {target}")
+    return args[target] if remux else with_preset(args[target], preset)
+
+
+def can_remux(target: str, probe: Optional[dict]) -> bool:
+    """
+    True si el original (según su probe) ya tiene los códecs del target y
+    basta con cambiar de contenedor. Sin probe siempre se transcodifica.
+    """
+    if not probe or target not in TARGET_REMUX_ARGS:
+        return False
+    audio_codec = probe.get("audio_codec")
+    video_codec = probe.get("video_codec")
+    if target == "mp3":
+        return audio_codec in REMUX_AUDIO_CODECS["mp3"]
+    if video_codec not in REMUX_VIDEO_CODECS or probe.get("video_pix_fmt") not in REMUX_PIX_FMTS:
+        return False
+    return audio_codec is None or audio_codec in REMUX_AUDIO_CODECS[target]
+
+
+def conversion_signature(
+    target: str,
+    ladder: Optional[list[str]] = None,
+    remux: bool = False,
+    preset: Optional[str] = None,
+    peaks: bool = False,
+    previews: bool = False,
+) -> str:
+    """
+    Huella (sha256) del conjunto exacto de parámetros de ffmpeg de un target
+    (y de la escalera ABR, el peaks.bin o las vistas previas si los hay).
+    Dos jobs con el mismo original y la misma firma producen la misma salida.
+    """
+    params = {"target": target, "args": target_output_args(target, remux, preset)}
+    if ladder:
+        params["ladder"] = [[name, HLS_LADDER_PRESETS[name]] for name in ladder]
+    if peaks:
+        params["peaks"] = [PEAKS_VERSION, *PEAKS_PCM_ARGS]
+    if previews:
+        params["previews"] = previews_signature()
+    raw = json.dumps(params)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+ProgressCallback = Callable[[dict], None]
+
+
+def _parse_progress_block(block: dict) -> dict:
+    """Convierte un bloque de `-progress` (clave=valor) en segundos y velocidad."""
+    out_time = None
+    raw_us = block.get("out_time_us") or block.get("out_time_ms")  # ambos en µs
+    if raw_us and raw_us != "N/A":
+        try:
+            out_time = max(0.0, int(raw_us) / 1_000_000)
+        except ValueError:
+            out_time = None
+    speed = None
+    raw_speed = (block.get("speed") or "").strip().rstrip("x")
+    if raw_speed and raw_speed != "N/A":
+        try:
+            speed = float(raw_speed)
+        except ValueError:
+            speed = None
+    return {
+        "out_time": out_time,
+        "speed": speed,
+        "frame": block.get("frame"),
+        "done": block.get("progress") == "end",
+    }
+
+
+def _read_pcm(fd: int, sink: Callable[[bytes], None], errors: list[Exception]) -> None:
+    """
+    Entrega a `sink` el PCM del pipe hasta que ffmpeg lo cierre. Si `sink`
+    falla se guarda el error en `errors` y se sigue vaciando el pipe para que
+    ffmpeg no se bloquee.
+    """
+    with os.fdopen(fd, "rb") as pipe:
+        while True:
+            data = pipe.read(64 * 1024)
+            if not data:
+                return
+            if errors:
+                continue
+            try:
+                sink(data)
+            except Exception as e:
+                errors.append(e)
+
+
+def run_ffmpeg(
+    cmd: list[str],
+    progress: Optional[ProgressCallback] = None,
+    pcm_sink: Optional[Callable[[bytes], None]] = None,
+) -> Optional[Exception]:
+    """
+    Ejecuta ffmpeg y lanza error si falla.
+    ffmpeg escribe su progreso legible por máquina (`-progress pipe:1`) en
+    stdout; cada bloque se entrega a `progress` mientras el proceso corre.
+    stderr se drena en otro hilo y se conserva su final para el error.
+    Con `pcm_sink` se agrega una salida más con el audio en PCM
+    (PEAKS_PCM_ARGS) por un pipe propio, que se entrega a `pcm_sink` en la
+    misma pasada (p. ej. PeaksBuilder.feed). Si `pcm_sink` falla, ffmpeg
+    termina igual y se devuelve ese error: lo que recibió quedó incompleto.
+    """
+    cmd = [cmd[0], "-nostats", "-progress", "pipe:1", *cmd[1:]]
+    pass_fds: tuple[int, ...] = ()
+    pcm_errors: list[Exception] = []
+    if pcm_sink is not None:
+        pcm_read, pcm_write = os.pipe()
+        cmd += [*PEAKS_PCM_ARGS, f"pipe:{pcm_write}"]
+        pass_fds = (pcm_write,)
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            pass_fds=pass_fds,
+        )
+    finally:
+        if pcm_sink is not None:
+            os.close(pcm_write)  # sólo ffmpeg escribe; así llega EOF al terminar
+    if pcm_sink is not None:
+        pcm_reader = threading.Thread(target=_read_pcm, args=(pcm_read, pcm_sink, pcm_errors), daemon=True)
+        pcm_reader.start()
+
+    stderr_tail: deque[str] = deque(maxlen=200)
+    drain = threading.Thread(
+        target=lambda: stderr_tail.extend(proc.stderr), daemon=True
     )
-    if proc.returncode != 0:
+    drain.start()
+
+    block: dict = {}
+    for line in proc.stdout:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value
+        if key == "progress":  # fin de bloque
+            if progress is not None:
+                try:
+                    progress(_parse_progress_block(block))
+                except Exception:
+                    pass  # el reporte de progreso nunca tumba la conversión
+            block = {}
+
+    returncode = proc.wait()
+    drain.join()
+    if pcm_sink is not None:
+        pcm_reader.join()
+    if returncode != 0:
         raise RuntimeError(
-            f"ffmpeg failed with code {proc.returncode}\nCOMMAND: {' '.join(cmd)}\nSTDERR:\n{proc.stderr}"
+            f"ffmpeg failed with code {returncode}\nCOMMAND: {' '.join(cmd)}\nSTDERR:\n{''.join(stderr_tail)}"
         )
+    return pcm_errors[0] if pcm_errors else None
+
+
+def write_peaks(peaks: PeaksBuilder, peaks_path: str, pcm_error: Optional[Exception]) -> None:
+    """
+    Escribe peaks.bin salvo que el PCM se haya cortado: sin el archivo el job
+    no publica forma de onda, en vez de publicar (y cachear) una truncada.
+    """
+    if pcm_error is not None:
+        logger.warning(f"Waveform peaks skipped, PCM sink failed: {pcm_error!r}")
+        return
+    peaks.write(peaks_path)
+
+
+def previews_args(previews_dir: Optional[str], duration: Optional[float]) -> list[str]:
+    """Salidas extra de vistas previas (previews.py); sin duración conocida no se generan."""
+    if not previews_dir or not duration:
+        return []
+    return preview_output_args(previews_dir, duration)
+
+
+def finish_previews(previews_dir: Optional[str], duration: Optional[float]) -> None:
+    """Escribe la pista WebVTT de las hojas que acaba de generar ffmpeg."""
+    if previews_dir and duration:
+        write_thumbnails_vtt(previews_dir, duration)
+
 
+def input_args(input_path: str) -> list[str]:
+    """
+    Argumentos de entrada para ffmpeg.
+    Si la entrada es una URL (modo streaming desde MinIO) se activa la
+    reconexión para que un corte de red no tumbe una conversión larga.
+    """
+    if input_path.startswith(("http://", "https://")):
+        return [
+            "-reconnect", "1",
+            "-reconnect_on_network_error", "1",
+            "-reconnect_delay_max", "10",
+            "-i", input_path,
+        ]
+    return ["-i", input_path]
 
-def convert_to_mp3(input_path: str, output_path: str) -> str:
+
+def convert_to_mp3(
+    input_path: str,
+    output_path: str,
+    progress: Optional[ProgressCallback] = None,
+    remux: bool = False,
+    peaks_path: Optional[str] = None,
+) -> str:
     """
     Convierte cualquier audio de entrada (wav, mp3, flac, ogg, etc.) a MP3.
-    No hace copy, siempre recodifica para que sea seguro.
+    Con remux=True (el original ya es MP3, ver can_remux) copia la pista de
+    audio sin recodificar.
+    Con `peaks_path` escribe además los picos de la forma de onda
+    (waveform.py), calculados en la misma pasada de ffmpeg.
     """
     out = Path(output_path)
     out.parent.mkdir(parents=True, exist_ok=True)
@@ -29,21 +353,34 @@ def convert_to_mp3(input_path: str, output_path: str) -> str:
     cmd = [
         "ffmpeg",
         "-y",               # sobreescribir
-        "-i", input_path,   # entrada
-        "-vn",              # sin video
-        "-ar", "44100",     # sample rate
-        "-ac", "2",         # 2 canales
-        "-b:a", "192k",     # bitrate de audio
+        *input_args(input_path),  # entrada (archivo local o URL)
+        *target_output_args("mp3", remux),
         out.as_posix(),
     ]
-    run_ffmpeg(cmd)
+    peaks = PeaksBuilder() if peaks_path else None
+    pcm_error = run_ffmpeg(cmd, progress, pcm_sink=peaks.feed if peaks else None)
+    if peaks:
+        write_peaks(peaks, peaks_path, pcm_error)
     return out.as_posix()
 
 
-def convert_to_mp4_h264(input_path: str, output_path: str) -> str:
+def convert_to_mp4_h264(
+    input_path: str,
+    output_path: str,
+    progress: Optional[ProgressCallback] = None,
+    remux: bool = False,
+    preset: Optional[str] = None,
+    previews_dir: Optional[str] = None,
+    duration: Optional[float] = None,
+) -> str:
     """
     Convierte a MP4 con video H.264 y audio AAC.
     Funciona con entradas de video comunes (mp4, mkv, mov, etc.)
+    Con remux=True (el original ya es H.264/AAC) sólo cambia el contenedor
+    y mueve el índice al principio (+faststart), sin recodificar.
+    `preset` reemplaza el preset de x264 por defecto (ver encoder_policy).
+    Con `previews_dir` (y la `duration` del original) genera además póster,
+    sprites y pista WebVTT desde los mismos frames decodificados.
     """
     out = Path(output_path)
     out.parent.mkdir(parents=True, exist_ok=True)
@@ -51,22 +388,33 @@ def convert_to_mp4_h264(input_path: str, output_path: str) -> str:
     cmd = [
         "ffmpeg",
         "-y",
-        "-i", input_path,
-        "-c:v", "libx264",
-        "-preset", "veryfast",
-        "-crf", "23",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        "-movflags", "+faststart",
+        *input_args(input_path),
+        *target_output_args("mp4", remux, preset),
         out.as_posix(),
+        *previews_args(previews_dir, duration),
     ]
-    run_ffmpeg(cmd)
+    run_ffmpeg(cmd, progress)
+    finish_previews(previews_dir, duration)
     return out.as_posix()
 
 
-def convert_to_hls(input_path: str, output_dir: str, playlist_name: str = "index.m3u8") -> str:
+def convert_to_hls(
+    input_path: str,
+    output_dir: str,
+    playlist_name: str = "index.m3u8",
+    progress: Optional[ProgressCallback] = None,
+    remux: bool = False,
+    preset: Optional[str] = None,
+    previews_dir: Optional[str] = None,
+    duration: Optional[float] = None,
+) -> str:
     """
     Convierte el video a HLS (lista .m3u8 + segmentos .ts) en el directorio indicado.
+    Los segmentos se escriben como .tmp y se renombran al cerrarse
+    (`temp_file`), para poder subirlos mientras la conversión sigue.
+    Con remux=True sólo segmenta (sin recodificar); los cortes caen en los
+    keyframes del original, así que los segmentos pueden durar más de hls_time.
+    `previews_dir` y `duration` como en convert_to_mp4_h264.
     """
     out_dir = Path(output_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -75,14 +423,266 @@ def convert_to_hls(input_path: str, output_dir: str, playlist_name: str = "index
     cmd = [
         "ffmpeg",
         "-y",
-        "-i", input_path,
-        "-c:v", "libx264",
-        "-c:a", "aac",
-        "-start_number", "0",
-        "-hls_time", "5",
-        "-hls_list_size", "0",
-        "-f", "hls",
+        *input_args(input_path),
+        *target_output_args("hls", remux, preset),
         playlist_path.as_posix(),
+        *previews_args(previews_dir, duration),
     ]
-    run_ffmpeg(cmd)
+    run_ffmpeg(cmd, progress)
+    finish_previews(previews_dir, duration)
     return playlist_path.as_posix()
+
+
+def convert_to_targets(
+    input_path: str,
+    outputs: list[tuple[str, str]],
+    progress: Optional[ProgressCallback] = None,
+    remux: Collection[str] = (),
+    preset: Optional[str] = None,
+    peaks_path: Optional[str] = None,
+    previews_dir: Optional[str] = None,
+    duration: Optional[float] = None,
+) -> list[str]:
+    """
+    Fan-out: genera varios targets del mismo original con UN solo ffmpeg.
+    `outputs` son pares (target, ruta): el .mp3/.mp4 o la playlist HLS.
+    ffmpeg decodifica cada pista de entrada una vez y reparte los frames a
+    todos los encoders; cada salida usa exactamente los mismos parámetros que
+    su conversión individual (misma firma de caché). Los targets de `remux`
+    copian las pistas en vez de recodificarlas; el resto usa `preset`.
+    Con `peaks_path` también escribe los picos de la forma de onda y con
+    `previews_dir` (y `duration`) las vistas previas del video.
+    """
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *input_args(input_path),
+    ]
+    paths = []
+    for target, path in outputs:
+        out = Path(path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        cmd += [*target_output_args(target, target in remux, preset), out.as_posix()]
+        paths.append(out.as_posix())
+    cmd += previews_args(previews_dir, duration)
+    peaks = PeaksBuilder() if peaks_path else None
+    pcm_error = run_ffmpeg(cmd, progress, pcm_sink=peaks.feed if peaks else None)
+    if peaks:
+        write_peaks(peaks, peaks_path, pcm_error)
+    finish_previews(previews_dir, duration)
+    return paths
+
+
+def resolve_hls_ladder(ladder: list[str], source_height: Optional[int], has_video: bool = True) -> list[str]:
+    """
+    Valida la escalera pedida y quita las variantes de video más altas que
+    el original (no se escala hacia arriba), dejando siempre al menos una.
+    """
+    unknown = [name for name in ladder if name not in HLS_LADDER_PRESETS]
+    if unknown:
+        raise ValueError(f"unknown HLS renditions: {unknown}")
+    names = list(dict.fromkeys(ladder))  # sin duplicados, en orden
+    video = [n for n in names if HLS_LADDER_PRESETS[n]["height"]]
+    audio = [n for n in names if not HLS_LADDER_PRESETS[n]["height"]]
+    if not has_video:
+        return audio or ["audio"]
+    if source_height:
+        fitting = [n for n in video if HLS_LADDER_PRESETS[n]["height"] <= source_height]
+        if not fitting and video:
+            # Original más pequeño que toda la escalera: la variante más baja
+            fitting = [min(video, key=lambda n: HLS_LADDER_PRESETS[n]["height"])]
+        video = fitting
+    return video + audio
+
+
+def convert_to_hls_abr(
+    input_path: str,
+    output_dir: str,
+    ladder: list[str],
+    *,
+    has_audio: bool = True,
+    progress: Optional[ProgressCallback] = None,
+    preset: Optional[str] = None,
+    previews_dir: Optional[str] = None,
+    duration: Optional[float] = None,
+) -> str:
+    """
+    HLS adaptativo: decodifica el original UNA vez, lo reparte con `split`
+    y codifica todas las variantes de la escalera en el mismo ffmpeg.
+    Cada variante queda en <output_dir>/<nombre>/index.m3u8 y la playlist
+    maestra en <output_dir>/master.m3u8.
+    Los keyframes se fuerzan cada hls_time para que los segmentos de todas
+    las variantes queden alineados y el reproductor pueda cambiar entre ellas.
+    `previews_dir` y `duration` como en convert_to_mp4_h264.
+    """
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    video = [n for n in ladder if HLS_LADDER_PRESETS[n]["height"]]
+    audio_only = [n for n in ladder if not HLS_LADDER_PRESETS[n]["height"]]
+    if not has_audio:
+        audio_only = []
+
+    filter_complex = []
+    if video:
+        splits = "".join(f"[v{i}]" for i in range(len(video)))
+        graph = [f"[0:v]split={len(video)}{splits}"]
+        graph += [
+            f"[v{i}]scale=-2:{HLS_LADDER_PRESETS[name]['height']}[v{i}o]"
+            for i, name in enumerate(video)
+        ]
+        filter_complex = ["-filter_complex", ";".join(graph)]
+
+    maps, codec_args, var_streams = [], [], []
+    audio_index = 0
+    for i, name in enumerate(video):
+        preset = HLS_LADDER_PRESETS[name]
+        maps += ["-map", f"[v{i}o]"]
+        codec_args += [
+            f"-b:v:{i}", preset["video_bitrate"],
+            f"-maxrate:v:{i}", preset["maxrate"],
+            f"-bufsize:v:{i}", preset["bufsize"],
+        ]
+        entry = f"v:{i}"
+        if has_audio:
+            maps += ["-map", "0:a:0"]
+            codec_args += [f"-b:a:{audio_index}", preset["audio_bitrate"]]
+            entry += f",a:{audio_index}"
+            audio_index += 1
+        var_streams.append(f"{entry},name:{name}")
+    for name in audio_only:
+        maps += ["-map", "0:a:0"]
+        codec_args += [f"-b:a:{audio_index}", HLS_LADDER_PRESETS[name]["audio_bitrate"]]
+        var_streams.append(f"a:{audio_index},name:{name}")
+        audio_index += 1
+    if not var_streams:
+        raise ValueError("HLS ladder has no renditions for this source")
+
+    hls_time = HLS_MUXER_ARGS[HLS_MUXER_ARGS.index("-hls_time") + 1]
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *input_args(input_path),
+        *filter_complex,
+        *maps,
+        *with_preset(HLS_VIDEO_ARGS, preset),
+        *HLS_AUDIO_ARGS,
+        *codec_args,
+        "-force_key_frames", f"expr:gte(t,n_forced*{hls_time})",
+        "-var_stream_map", " ".join(var_streams),
+        "-master_pl_name", HLS_MASTER_PLAYLIST,
+        "-hls_segment_filename", (out_dir / "%v" / "seg_%05d.ts").as_posix(),
+        *HLS_MUXER_ARGS,
+        (out_dir / "%v" / "index.m3u8").as_posix(),
+        *(previews_args(previews_dir, duration) if video else []),
+    ]
+    run_ffmpeg(cmd, progress)
+    if video:
+        finish_previews(previews_dir, duration)
+    return (out_dir / HLS_MASTER_PLAYLIST).as_posix()
+
+
+# --- Modo por partes (split & merge) para videos largos ---
+
+TARGET_VIDEO_ARGS = {"mp4": MP4_VIDEO_ARGS, "hls": HLS_VIDEO_ARGS}
+
+
+def split_video_at_keyframes(input_path: str, output_dir: str, chunk_seconds: int) -> list[str]:
+    """
+    Corta la pista de video en partes de ~chunk_seconds sin recodificar
+    (stream copy), así que los cortes caen siempre en keyframes.
+    El audio no se parte: se codifica entero al unir.
+    Devuelve las rutas de las partes en orden.
+    """
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *input_args(input_path),
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(chunk_seconds),
+        "-reset_timestamps", "1",
+        (out_dir / "part_%04d.mkv").as_posix(),
+    ]
+    run_ffmpeg(cmd)
+    return sorted(p.as_posix() for p in out_dir.glob("part_*.mkv"))
+
+
+def encode_video_chunk(
+    input_path: str,
+    output_path: str,
+    target: str,
+    progress: Optional[ProgressCallback] = None,
+    preset: Optional[str] = None,
+) -> str:
+    """
+    Codifica una parte (sólo video) con los mismos parámetros del target.
+    Todas las partes de un video usan el mismo `preset` (el del job original).
+    """
+    out = Path(output_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        *input_args(input_path),
+        "-map", "0:v:0",
+        "-an",
+        *with_preset(TARGET_VIDEO_ARGS[target], preset),
+        out.as_posix(),
+    ]
+    run_ffmpeg(cmd, progress)
+    return out.as_posix()
+
+
+def merge_video_chunks(
+    chunk_sources: list[str],
+    audio_source: str,
+    target: str,
+    output_path: str,
+    progress: Optional[ProgressCallback] = None,
+) -> str:
+    """
+    Une las partes ya codificadas (stream copy, sin recodificar video) y
+    codifica el audio del original en la misma pasada.
+    - mp4: output_path es el .mp4 final.
+    - hls: output_path es la playlist; los segmentos se cortan en su carpeta.
+    `chunk_sources` pueden ser rutas locales o URLs firmadas.
+    """
+    out = Path(output_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    concat_list = out.parent / "concat.txt"
+    concat_list.write_text(
+        "".join(f"file '{src}'\n" for src in chunk_sources), encoding="utf-8"
+    )
+
+    if target == "mp4":
+        output_args = [*MP4_AUDIO_ARGS, "-movflags", "+faststart"]
+    elif target == "hls":
+        output_args = [*HLS_AUDIO_ARGS, *HLS_MUXER_ARGS]
+    else:
+        raise ValueError(f"unsupported chunked target: {target}")
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-f", "concat",
+        "-safe", "0",
+        "-protocol_whitelist", "file,http,https,tcp,tls,crypto",
+        "-i", concat_list.as_posix(),
+        *input_args(audio_source),
+        "-map", "0:v:0",
+        "-map", "1:a:0?",
+        "-c:v", "copy",
+        *output_args,
+        out.as_posix(),
+    ]
+    try:
+        run_ffmpeg(cmd, progress)
+    finally:
+        concat_list.unlink(missing_ok=True)
+    return out.as_posix()
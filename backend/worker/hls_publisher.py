@@ -0,0 +1,141 @@
+# backend/worker/hls_publisher.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Optional
+
+from minio_client import get_shared_minio_client, upload_object, MINIO_UPLOAD_THREADS
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+PLAYLIST_SUFFIX = ".m3u8"
+
+
+class HlsSegmentPublisher:
+    """
+    Sube a MinIO los segmentos HLS a medida que ffmpeg los termina.
+
+    - ffmpeg se lanza con `-hls_flags temp_file`, así que un .ts sólo aparece
+      con su nombre final cuando ya está completo: cualquier segmento visible
+      se puede subir.
+    - Las subidas van en paralelo (MINIO_UPLOAD_THREADS por job) sobre el
+      cliente MinIO compartido por todos los slots.
+    - Las playlists (.m3u8) se suben al final, cuando ya están todos los
+      segmentos que referencian.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        hls_dir: str,
+        *,
+        max_workers: int = MINIO_UPLOAD_THREADS,
+        poll_interval: float = 0.5,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.hls_dir = Path(hls_dir)
+        self.poll_interval = poll_interval
+        self._client = get_shared_minio_client()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hls-upload"
+        )
+        self._submitted: dict[Path, Future] = {}
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    # --- ciclo de vida ---
+
+    def start(self) -> "HlsSegmentPublisher":
+        """Empieza a vigilar el directorio mientras ffmpeg sigue codificando."""
+        self._watcher = threading.Thread(
+            target=self._watch, name="hls-watch", daemon=True
+        )
+        self._watcher.start()
+        return self
+
+    def finish(self) -> int:
+        """
+        Llamar cuando ffmpeg terminó bien: sube lo que falte, espera todas
+        las subidas y por último publica las playlists.
+        Devuelve el número de objetos subidos.
+        """
+        self._stop_watcher()
+        try:
+            self._scan_segments()
+            for fut in list(self._submitted.values()):
+                fut.result()  # propaga el primer error de subida
+
+            playlists = sorted(
+                p for p in self.hls_dir.rglob(f"*{PLAYLIST_SUFFIX}") if p.is_file()
+            )
+            # Variantes primero y la playlist maestra (la de la raíz) al final
+            playlists.sort(key=lambda p: len(p.relative_to(self.hls_dir).parts), reverse=True)
+            for p in playlists:
+                self._upload(p)
+            return len(self._submitted) + len(playlists)
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def abort(self) -> None:
+        """
+        ffmpeg falló: deja de vigilar, descarta las subidas pendientes y borra
+        de MinIO los segmentos que ya se habían subido (o empezado a subir),
+        para no dejar una salida a medias bajo el prefijo.
+        """
+        self._stop_watcher()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for path, fut in self._submitted.items():
+            if fut.cancelled():
+                continue
+            object_name = self._object_name(path)
+            try:
+                self._client.remove_object(self.bucket, object_name)
+            except Exception as e:
+                logger.warning(f"hls publisher: could not remove {object_name}: {e}")
+
+    # --- internos ---
+
+    def _stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._scan_segments()
+            except Exception as e:
+                # El escaneo final en finish() vuelve a intentarlo
+                logger.warning(f"hls publisher scan error: {e}")
+
+    def _scan_segments(self) -> None:
+        if not self.hls_dir.exists():
+            return
+        for item in self.hls_dir.rglob("*"):
+            if not item.is_file() or item in self._submitted:
+                continue
+            if item.suffix not in CONTENT_TYPES or item.suffix == PLAYLIST_SUFFIX:
+                continue  # .tmp en escritura o playlists (van al final)
+            self._submitted[item] = self._pool.submit(self._upload, item)
+
+    def _object_name(self, path: Path) -> str:
+        return f"{self.prefix}/{path.relative_to(self.hls_dir).as_posix()}"
+
+    def _upload(self, path: Path) -> None:
+        upload_object(
+            self.bucket,
+            self._object_name(path),
+            str(path),
+            content_type=CONTENT_TYPES.get(path.suffix, "application/octet-stream"),
+            client=self._client,
+        )
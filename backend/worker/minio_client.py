@@ -1,30 +1,190 @@
 import os
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import threading
+from typing import Optional
+
+import urllib3
 from minio import Minio
 from minio.error import S3Error
+from prometheus_client import Counter, Histogram
 
 MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
+# Transferencias grandes: partes (GET por rangos / multipart) en paralelo
+MINIO_PART_SIZE = max(5 * 1024**2, int(os.getenv("MINIO_PART_SIZE", str(16 * 1024**2))))
+MINIO_PARALLEL_THRESHOLD = int(os.getenv("MINIO_PARALLEL_THRESHOLD", str(64 * 1024**2)))
+MINIO_TRANSFER_CONCURRENCY = max(1, int(os.getenv("MINIO_TRANSFER_CONCURRENCY", "4")))
+# Subidas simultáneas de archivos sueltos por job (segmentos HLS, partes de un video partido)
+MINIO_UPLOAD_THREADS = max(1, int(os.getenv("MINIO_UPLOAD_THREADS", "4")))
+# Conexiones HTTP del cliente compartido, que usan todos los slots del proceso.
+# Con block=True un hilo sin conexión libre espera, así que por defecto alcanza
+# para el peor caso de cada slot en modo pipeline sin esperar a otro slot: subir
+# segmentos del job actual (MINIO_UPLOAD_THREADS) mientras sube el anterior y
+# descarga el siguiente (MINIO_TRANSFER_CONCURRENCY cada uno).
+_WORKER_CONCURRENCY = max(1, int(os.getenv("WORKER_CONCURRENCY", "1")))
+MINIO_POOL_SIZE = int(os.getenv(
+    "MINIO_POOL_SIZE",
+    str(_WORKER_CONCURRENCY * (MINIO_UPLOAD_THREADS + 2 * MINIO_TRANSFER_CONCURRENCY)),
+))
+
+transfer_bytes_total = Counter(
+    "worker_minio_transfer_bytes_total",
+    "Bytes transferidos con MinIO",
+    ["direction"],  # download | upload
+)
+transfer_duration_seconds = Histogram(
+    "worker_minio_transfer_duration_seconds",
+    "Duración de cada transferencia con MinIO",
+    ["direction"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+transfer_throughput = Histogram(
+    "worker_minio_transfer_throughput_bytes_per_second",
+    "Throughput de cada transferencia con MinIO",
+    ["direction"],
+    buckets=(1e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9),
+)
+
+_shared_client: Optional[Minio] = None
+_shared_client_lock = threading.Lock()
 
 
 def get_minio_client() -> Minio:
-    return Minio(
-        MINIO_ENDPOINT,
-        access_key=MINIO_ACCESS_KEY,
-        secret_key=MINIO_SECRET_KEY,
-        secure=MINIO_SECURE,
+    """Cliente del worker: siempre el compartido (conserva el pool de conexiones)."""
+    return get_shared_minio_client()
+
+
+def get_shared_minio_client() -> Minio:
+    """
+    Cliente único por proceso con un pool urllib3 de MINIO_POOL_SIZE
+    conexiones, para reutilizar conexiones entre muchas subidas pequeñas.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            http_client = urllib3.PoolManager(
+                maxsize=MINIO_POOL_SIZE,
+                block=True,
+                timeout=urllib3.Timeout(connect=10, read=300),
+                retries=urllib3.Retry(
+                    total=5,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504],
+                ),
+            )
+            _shared_client = Minio(
+                MINIO_ENDPOINT,
+                access_key=MINIO_ACCESS_KEY,
+                secret_key=MINIO_SECRET_KEY,
+                secure=MINIO_SECURE,
+                http_client=http_client,
+            )
+        return _shared_client
+
+
+def _observe_transfer(direction: str, size: int, started: float) -> None:
+    elapsed = max(time.monotonic() - started, 1e-6)
+    transfer_bytes_total.labels(direction=direction).inc(size)
+    transfer_duration_seconds.labels(direction=direction).observe(elapsed)
+    transfer_throughput.labels(direction=direction).observe(size / elapsed)
+
+
+def _download_range(client: Minio, bucket: str, object_name: str, etag: str,
+                    dest: Path, offset: int, length: int) -> None:
+    # If-Match: si el objeto cambia a mitad de la descarga falla en vez de mezclar versiones
+    resp = client.get_object(
+        bucket, object_name, offset=offset, length=length,
+        request_headers={"If-Match": etag},
     )
+    try:
+        with open(dest, "r+b") as f:
+            f.seek(offset)
+            for data in resp.stream(1024 * 1024):
+                f.write(data)
+    finally:
+        resp.close()
+        resp.release_conn()
 
 
 def download_object(bucket: str, object_name: str, dest_path: str) -> str:
-    client = get_minio_client()
-    Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
-    client.fget_object(bucket, object_name, dest_path)
+    """
+    Descarga un objeto a disco. Por encima de MINIO_PARALLEL_THRESHOLD se
+    piden MINIO_TRANSFER_CONCURRENCY rangos de MINIO_PART_SIZE a la vez, cada
+    uno escrito en su posición del archivo. El archivo sólo aparece en
+    dest_path cuando está completo.
+    """
+    client = get_shared_minio_client()
+    dest = Path(dest_path)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+
+    st = client.stat_object(bucket, object_name)
+    if st.size < MINIO_PARALLEL_THRESHOLD:
+        client.fget_object(bucket, object_name, dest_path)
+        _observe_transfer("download", st.size, started)
+        return dest_path
+
+    tmp = dest.with_name(dest.name + ".part")
+    with open(tmp, "wb") as f:
+        f.truncate(st.size)
+    ranges = [
+        (offset, min(MINIO_PART_SIZE, st.size - offset))
+        for offset in range(0, st.size, MINIO_PART_SIZE)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=MINIO_TRANSFER_CONCURRENCY) as pool:
+            futures = [
+                pool.submit(_download_range, client, bucket, object_name, st.etag, tmp, offset, length)
+                for offset, length in ranges
+            ]
+            for future in futures:
+                future.result()
+        tmp.replace(dest)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    _observe_transfer("download", st.size, started)
     return dest_path
 
 
-def upload_object(bucket: str, object_name: str, file_path: str, content_type: str = "application/octet-stream") -> None:
+def upload_object(
+    bucket: str,
+    object_name: str,
+    file_path: str,
+    content_type: str = "application/octet-stream",
+    client: Optional[Minio] = None,
+) -> None:
+    """
+    Sube un archivo. Los archivos grandes van en multipart con partes de
+    MINIO_PART_SIZE subidas en paralelo (MINIO_TRANSFER_CONCURRENCY).
+    """
+    client = client or get_shared_minio_client()
+    size = os.path.getsize(file_path)
+    started = time.monotonic()
+    client.fput_object(
+        bucket,
+        object_name,
+        file_path,
+        content_type=content_type,
+        part_size=MINIO_PART_SIZE,
+        num_parallel_uploads=MINIO_TRANSFER_CONCURRENCY if size >= MINIO_PARALLEL_THRESHOLD else 1,
+    )
+    _observe_transfer("upload", size, started)
+
+
+def presigned_download_url(bucket: str, object_name: str, expires_in_hours: int = 12) -> str:
+    """
+    URL firmada para que ffmpeg lea el objeto directamente por HTTP
+    (sin copiarlo antes a disco). ffmpeg usa peticiones Range para hacer seek.
+    """
     client = get_minio_client()
-    client.fput_object(bucket, object_name, file_path, content_type=content_type)
\ No newline at end of file
+    return client.presigned_get_object(
+        bucket,
+        object_name,
+        expires=datetime.timedelta(hours=expires_in_hours),
+    )
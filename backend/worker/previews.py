@@ -0,0 +1,113 @@
+# backend/worker/previews.py
+"""
+Vistas previas de los videos (mp4 / hls), generadas por el mismo ffmpeg que
+codifica el video: se agregan salidas extra que reutilizan los frames ya
+decodificados, así que no hace falta otra pasada sobre el original.
+
+- poster.jpg          un frame representativo (al 10 % del video, como
+                      mucho a los PREVIEW_POSTER_MAX_SECONDS).
+- sprite_001.jpg ...  hojas de PREVIEW_COLUMNS x PREVIEW_ROWS miniaturas de
+                      PREVIEW_TILE_WIDTH x PREVIEW_TILE_HEIGHT, una cada
+                      PREVIEW_INTERVAL segundos, para el scrubbing.
+- thumbnails.vtt      pista WebVTT que asigna a cada intervalo su miniatura
+                      (`sprite_001.jpg#xywh=x,y,w,h`).
+
+Todo queda en <carpeta del job>/previews y se publica en
+<output_prefix>/previews/.
+"""
+import math
+from pathlib import Path
+
+PREVIEWS_DIRNAME = "previews"
+PREVIEW_POSTER_NAME = "poster.jpg"
+PREVIEW_SPRITE_PATTERN = "sprite_%03d.jpg"
+PREVIEW_VTT_NAME = "thumbnails.vtt"
+
+PREVIEW_INTERVAL = 10  # segundos entre miniaturas
+PREVIEW_TILE_WIDTH = 160
+PREVIEW_TILE_HEIGHT = 90
+PREVIEW_COLUMNS = 10
+PREVIEW_ROWS = 10
+PREVIEW_POSTER_WIDTH = 1280
+PREVIEW_POSTER_MAX_SECONDS = 10.0
+
+PREVIEW_CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".vtt": "text/vtt",
+}
+
+
+def poster_time(duration: float) -> float:
+    return min(PREVIEW_POSTER_MAX_SECONDS, duration / 10)
+
+
+def preview_output_args(previews_dir: str, duration: float) -> list[str]:
+    """Salidas de ffmpeg (póster y hojas de sprites) a agregar tras las del target."""
+    out = Path(previews_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    w, h = PREVIEW_TILE_WIDTH, PREVIEW_TILE_HEIGHT
+    return [
+        "-map", "0:v:0",
+        "-vf", (
+            f"select='gte(t,{poster_time(duration):.3f})',"
+            f"scale='min({PREVIEW_POSTER_WIDTH},iw)':-2"
+        ),
+        "-frames:v", "1",
+        "-update", "1",
+        "-q:v", "3",
+        (out / PREVIEW_POSTER_NAME).as_posix(),
+        "-map", "0:v:0",
+        "-vf", (
+            f"fps=1/{PREVIEW_INTERVAL},"
+            f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+            f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,"
+            f"tile={PREVIEW_COLUMNS}x{PREVIEW_ROWS}"
+        ),
+        "-q:v", "5",
+        "-f", "image2",
+        (out / PREVIEW_SPRITE_PATTERN).as_posix(),
+    ]
+
+
+def _vtt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, rest = divmod(ms, 3_600_000)
+    m, rest = divmod(rest, 60_000)
+    s, ms = divmod(rest, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def write_thumbnails_vtt(previews_dir: str, duration: float) -> str:
+    """Escribe thumbnails.vtt para las hojas que generó preview_output_args."""
+    out = Path(previews_dir) / PREVIEW_VTT_NAME
+    per_sheet = PREVIEW_COLUMNS * PREVIEW_ROWS
+    lines = ["WEBVTT", ""]
+    for i in range(max(1, math.ceil(duration / PREVIEW_INTERVAL))):
+        start = i * PREVIEW_INTERVAL
+        end = min(duration, start + PREVIEW_INTERVAL)
+        sheet, cell = divmod(i, per_sheet)
+        row, col = divmod(cell, PREVIEW_COLUMNS)
+        sprite = PREVIEW_SPRITE_PATTERN % (sheet + 1)
+        x, y = col * PREVIEW_TILE_WIDTH, row * PREVIEW_TILE_HEIGHT
+        lines += [
+            f"{_vtt_time(start)} --> {_vtt_time(end)}",
+            f"{sprite}#xywh={x},{y},{PREVIEW_TILE_WIDTH},{PREVIEW_TILE_HEIGHT}",
+            "",
+        ]
+    out.write_text("\n".join(lines), encoding="utf-8")
+    return out.as_posix()
+
+
+def preview_files(previews_dir: Path) -> list[Path]:
+    """Archivos generados (póster, hojas y pista), en orden estable."""
+    if not previews_dir.is_dir():
+        return []
+    return sorted(p for p in previews_dir.iterdir() if p.suffix in PREVIEW_CONTENT_TYPES)
+
+
+def previews_signature() -> list:
+    """Parámetros que afectan a las vistas previas (van en la firma de caché)."""
+    return [
+        PREVIEW_INTERVAL, PREVIEW_TILE_WIDTH, PREVIEW_TILE_HEIGHT,
+        PREVIEW_COLUMNS, PREVIEW_ROWS, PREVIEW_POSTER_WIDTH, PREVIEW_POSTER_MAX_SECONDS,
+    ]
@@ -0,0 +1,142 @@
+# backend/worker/progress.py
+import os
+import time
+import logging
+from typing import Optional, Sequence
+
+from google.cloud import firestore
+from prometheus_client import Gauge, Histogram
+
+from api.firebase_db import get_job_status_writer
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto (segundos) se escribe el progreso de un job en Firestore
+PROGRESS_UPDATE_INTERVAL = float(os.getenv("PROGRESS_UPDATE_INTERVAL", "5"))
+
+encode_progress_percent = Gauge(
+    "worker_encode_progress_percent",
+    "Porcentaje completado del job en curso",
+    ["worker_id", "slot"],
+)
+encode_eta_seconds = Gauge(
+    "worker_encode_eta_seconds",
+    "Segundos estimados para terminar el job en curso",
+    ["worker_id", "slot"],
+)
+encode_last_progress_timestamp = Gauge(
+    "worker_encode_last_progress_timestamp",
+    "Última vez (epoch) que ffmpeg reportó avance; si no sube, el encode está colgado",
+    ["worker_id", "slot"],
+)
+encode_speed = Gauge(
+    "worker_encode_speed",
+    "Velocidad actual de codificación (múltiplo de tiempo real)",
+    ["worker_id", "target"],
+)
+encode_speed_ratio = Histogram(
+    "worker_encode_speed_ratio",
+    "Velocidad media de codificación por job (múltiplo de tiempo real)",
+    ["worker_id", "target"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+encode_duration_seconds = Histogram(
+    "worker_encode_duration_seconds",
+    "Tiempo de pared de cada ejecución de ffmpeg",
+    ["worker_id", "target"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600, 7200),
+)
+
+
+class JobProgress:
+    """
+    Recibe los bloques de progreso de ffmpeg (ver run_ffmpeg) de un job y:
+    - calcula porcentaje, velocidad y ETA con la duración del original,
+    - actualiza las métricas Prometheus del slot / target,
+    - escribe progress_percent, encode_speed y eta_seconds en jobs.<job_id>
+      (en cada job de `job_ids`: un fan-out avanza igual para todas sus
+      salidas) como mucho cada PROGRESS_UPDATE_INTERVAL segundos.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        slot: str,
+        target: str,
+        *,
+        media_id: Optional[str] = None,
+        job_ids: Sequence[str] = (),
+        duration: Optional[float] = None,
+    ):
+        self.worker_id = worker_id
+        self.slot = slot
+        self.target = target or "unknown"
+        self.media_id = media_id
+        self.job_ids = [j for j in job_ids if j]
+        self.duration = duration if duration and duration > 0 else None
+        self.started = time.monotonic()
+        self._last_write = 0.0
+        self._last_out_time = 0.0
+        # Rellenados por finish(): tiempo de pared y segundos de media codificados
+        self.elapsed = 0.0
+        self.media_seconds = 0.0
+        encode_progress_percent.labels(worker_id=worker_id, slot=slot).set(0)
+        encode_last_progress_timestamp.labels(worker_id=worker_id, slot=slot).set_to_current_time()
+
+    def __call__(self, sample: dict) -> None:
+        out_time = sample.get("out_time")
+        speed = sample.get("speed")
+        if out_time is not None and out_time > self._last_out_time:
+            self._last_out_time = out_time
+            encode_last_progress_timestamp.labels(
+                worker_id=self.worker_id, slot=self.slot
+            ).set_to_current_time()
+        if speed is not None:
+            encode_speed.labels(worker_id=self.worker_id, target=self.target).set(speed)
+
+        percent = eta = None
+        if self.duration and out_time is not None:
+            percent = min(100.0, 100.0 * out_time / self.duration)
+            if speed:
+                eta = max(0.0, (self.duration - out_time) / speed)
+        if sample.get("done"):
+            percent, eta = 100.0, 0.0
+        if percent is not None:
+            encode_progress_percent.labels(worker_id=self.worker_id, slot=self.slot).set(percent)
+        if eta is not None:
+            encode_eta_seconds.labels(worker_id=self.worker_id, slot=self.slot).set(eta)
+
+        now = time.monotonic()
+        if not self.media_id or not self.job_ids or percent is None:
+            return
+        if not sample.get("done") and now - self._last_write < PROGRESS_UPDATE_INTERVAL:
+            return
+        self._last_write = now
+        fields = dict(
+            progress_percent=round(percent, 1),
+            encode_speed=round(speed, 2) if speed is not None else None,
+            eta_seconds=round(eta) if eta is not None else None,
+            progress_updated_at=firestore.SERVER_TIMESTAMP,
+        )
+        # No bloquea el encode: el escritor de estados lo agrupa y lo vuelca
+        writer = get_job_status_writer()
+        for job_id in self.job_ids:
+            writer.update_job(self.media_id, job_id, **fields)
+
+    @property
+    def reported(self) -> bool:
+        """True si ffmpeg llegó a reportar avance (hubo un encode real)."""
+        return self._last_out_time > 0
+
+    def finish(self) -> None:
+        """Registra la duración y la velocidad media del encode ya terminado."""
+        elapsed = time.monotonic() - self.started
+        encode_duration_seconds.labels(worker_id=self.worker_id, target=self.target).observe(elapsed)
+        media_seconds = self._last_out_time or self.duration
+        self.elapsed = elapsed
+        self.media_seconds = media_seconds or 0.0
+        if media_seconds and elapsed > 0:
+            encode_speed_ratio.labels(
+                worker_id=self.worker_id, target=self.target
+            ).observe(media_seconds / elapsed)
+        encode_eta_seconds.labels(worker_id=self.worker_id, slot=self.slot).set(0)
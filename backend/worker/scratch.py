@@ -0,0 +1,263 @@
+# backend/worker/scratch.py
+"""
+Espacio temporal del worker en disco (OUTPUT_BASE_DIR):
+
+- jobs/<nombre>/    salidas y archivos intermedios de un job. Se borran al
+                    terminar el job (ya subido a MinIO o fallido).
+- sources/<clave>/  originales descargados de MinIO, en una caché LRU acotada
+                    por SOURCE_CACHE_MAX_BYTES y direccionada por source_object:
+                    los varios targets de un mismo media suelen caer en el
+                    mismo worker y así se descarga una sola vez.
+
+Un original en uso por algún job queda fijado (pins > 0) y no se desaloja.
+Cada slot trabaja dentro de un `scope()`: lo que reserva (carpetas de job,
+originales fijados) se libera al salir del scope. En el modo pipeline del
+worker un mismo job pasa por varios hilos (descarga, encode, subida): su scope
+se abre con `open_scope()`, cada hilo lo usa con `activate()` y el último lo
+cierra con `close_scope()`.
+"""
+import os
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from prometheus_client import Counter, Gauge
+
+from minio_client import download_object
+
+logger = logging.getLogger(__name__)
+
+SOURCE_CACHE_ENABLED = os.getenv("SOURCE_CACHE_ENABLED", "true").lower() == "true"
+SOURCE_CACHE_MAX_BYTES = int(os.getenv("SOURCE_CACHE_MAX_BYTES", str(10 * 1024**3)))
+
+source_cache_requests_total = Counter(
+    "worker_source_cache_requests_total",
+    "Originales pedidos a la caché local de descargas",
+    ["worker_id", "result"],  # hit | miss
+)
+source_cache_hit_ratio = Gauge(
+    "worker_source_cache_hit_ratio",
+    "Fracción de originales servidos desde la caché local desde el arranque",
+    ["worker_id"],
+)
+scratch_disk_bytes = Gauge(
+    "worker_scratch_disk_bytes",
+    "Bytes ocupados en el disco temporal del worker",
+    ["worker_id", "kind"],  # sources | jobs
+)
+scratch_disk_free_bytes = Gauge(
+    "worker_scratch_disk_free_bytes",
+    "Bytes libres en el volumen de OUTPUT_BASE_DIR",
+    ["worker_id"],
+)
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for p in path.rglob("*"):
+        try:
+            if p.is_file():
+                total += p.stat().st_size
+        except OSError:
+            continue  # borrado mientras se recorría
+    return total
+
+
+class _Source:
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.pins = 0
+
+
+class ScratchSpace:
+    def __init__(self, base_dir: str, worker_id: str, max_source_bytes: int = SOURCE_CACHE_MAX_BYTES):
+        self.base = Path(base_dir)
+        self.jobs_dir = self.base / "jobs"
+        self.sources_dir = self.base / "sources"
+        self.worker_id = worker_id
+        self.max_source_bytes = max_source_bytes
+        self._lock = threading.Lock()
+        self._sources: "OrderedDict[str, _Source]" = OrderedDict()  # LRU: el más viejo primero
+        self._downloads: dict[str, threading.Event] = {}
+        self._hits = 0
+        self._misses = 0
+        self._local = threading.local()
+
+    def recover(self) -> None:
+        """
+        Al arrancar: borra las carpetas de jobs que dejó un proceso anterior
+        (nadie las va a terminar) y vuelve a indexar los originales en disco.
+        """
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.sources_dir.mkdir(parents=True, exist_ok=True)
+
+        found = []
+        for entry in self.sources_dir.iterdir():
+            files = [p for p in entry.iterdir() if p.is_file()] if entry.is_dir() else []
+            # Una descarga a medias (sin archivo o con restos de minio) no sirve
+            if len(files) != 1 or files[0].name.endswith((".minio", ".part")):
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink()
+                continue
+            st = files[0].stat()
+            found.append((st.st_mtime, entry.name, _Source(files[0], st.st_size)))
+        with self._lock:
+            for _, key, source in sorted(found):
+                self._sources[key] = source
+        self._evict()
+        self._update_metrics()
+        logger.info(f"[{self.worker_id}] scratch space at {self.base}, {len(found)} cached source(s)")
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """Todo lo que el hilo reserve dentro del scope se libera al salir."""
+        scope = self.open_scope()
+        try:
+            with self.activate(scope):
+                yield
+        finally:
+            self.close_scope(scope)
+
+    def open_scope(self) -> dict:
+        """Scope sin hilo asociado; se usa con activate() y se libera con close_scope()."""
+        return {"dirs": [], "sources": []}
+
+    @contextmanager
+    def activate(self, scope: dict) -> Iterator[None]:
+        """Lo que el hilo reserve mientras tanto queda en `scope` (no lo cierra)."""
+        previous = self._current_scope()
+        self._local.scope = scope
+        try:
+            yield
+        finally:
+            self._local.scope = previous
+
+    def close_scope(self, scope: dict) -> None:
+        """Libera los originales fijados y borra las carpetas del scope."""
+        with self._lock:
+            for key in scope["sources"]:
+                source = self._sources.get(key)
+                if source is not None:
+                    source.pins -= 1
+        for path in scope["dirs"]:
+            shutil.rmtree(path, ignore_errors=True)
+        self._evict()
+        self._update_metrics()
+
+    def _current_scope(self) -> Optional[dict]:
+        return getattr(self._local, "scope", None)
+
+    def job_dir(self, name: str) -> Path:
+        """Carpeta de trabajo de un job; se borra al cerrar el scope actual."""
+        path = self.jobs_dir / name
+        path.mkdir(parents=True, exist_ok=True)
+        scope = self._current_scope()
+        if scope is not None and path not in scope["dirs"]:
+            scope["dirs"].append(path)
+        return path
+
+    def source(self, bucket: str, object_name: str, job_id: str) -> str:
+        """
+        Ruta local del original: desde la caché si ya se descargó o
+        descargándolo ahora. Queda fijado hasta que se cierre el scope.
+        Si otro slot ya lo está descargando, espera a esa descarga.
+        Con la caché desactivada se descarga en la carpeta del job.
+        """
+        ext = Path(object_name).suffix or ".bin"
+        if not SOURCE_CACHE_ENABLED:
+            dest = self.job_dir(job_id) / f"input{ext}"
+            if dest.exists():
+                return str(dest)  # ya descargado (prefetch del modo pipeline)
+            return download_object(bucket, object_name, str(dest))
+
+        key = hashlib.sha256(f"{bucket}/{object_name}".encode("utf-8")).hexdigest()
+        while True:
+            with self._lock:
+                cached = self._sources.get(key)
+                if cached is not None:
+                    cached.pins += 1
+                    self._sources.move_to_end(key)
+                    self._hits += 1
+                    break
+                pending = self._downloads.get(key)
+                if pending is None:
+                    pending = self._downloads[key] = threading.Event()
+                    self._misses += 1
+                    break
+            pending.wait()
+
+        if cached is not None:
+            source_cache_requests_total.labels(worker_id=self.worker_id, result="hit").inc()
+            self._pin_in_scope(key)
+            self._update_metrics()
+            return str(cached.path)
+
+        source_cache_requests_total.labels(worker_id=self.worker_id, result="miss").inc()
+        dest = self.sources_dir / key / f"input{ext}"
+        try:
+            download_object(bucket, object_name, str(dest))
+            entry = _Source(dest, dest.stat().st_size)
+            entry.pins = 1
+            with self._lock:
+                self._sources[key] = entry
+        except Exception:
+            shutil.rmtree(dest.parent, ignore_errors=True)
+            raise
+        finally:
+            with self._lock:
+                self._downloads.pop(key, None)
+            pending.set()
+
+        self._pin_in_scope(key)
+        self._evict()
+        self._update_metrics()
+        return str(dest)
+
+    def _pin_in_scope(self, key: str) -> None:
+        scope = self._current_scope()
+        if scope is not None:
+            scope["sources"].append(key)
+        else:
+            # Sin scope nadie lo liberaría: no se deja fijado
+            with self._lock:
+                self._sources[key].pins -= 1
+
+    def _evict(self) -> None:
+        """Desaloja originales no fijados, del menos usado al más, hasta el límite."""
+        doomed = []
+        with self._lock:
+            total = sum(s.size for s in self._sources.values())
+            for key, source in list(self._sources.items()):
+                if total <= self.max_source_bytes:
+                    break
+                if source.pins > 0:
+                    continue
+                del self._sources[key]
+                total -= source.size
+                doomed.append(source.path.parent)
+        for path in doomed:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _update_metrics(self) -> None:
+        with self._lock:
+            sources = sum(s.size for s in self._sources.values())
+            lookups = self._hits + self._misses
+            ratio = self._hits / lookups if lookups else 0.0
+        source_cache_hit_ratio.labels(worker_id=self.worker_id).set(ratio)
+        scratch_disk_bytes.labels(worker_id=self.worker_id, kind="sources").set(sources)
+        scratch_disk_bytes.labels(worker_id=self.worker_id, kind="jobs").set(_dir_size(self.jobs_dir))
+        try:
+            scratch_disk_free_bytes.labels(worker_id=self.worker_id).set(
+                shutil.disk_usage(self.base).free
+            )
+        except OSError:
+            pass
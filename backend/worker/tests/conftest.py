@@ -0,0 +1,10 @@
+# backend/worker/tests/conftest.py
+# Mismo layout que en el contenedor: backend/ (paquete api) y backend/worker/
+# (módulos del worker importados por nombre) en el path.
+import sys
+from pathlib import Path
+
+WORKER_DIR = Path(__file__).resolve().parents[1]
+for path in (WORKER_DIR.parent, WORKER_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
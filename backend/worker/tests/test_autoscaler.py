@@ -0,0 +1,213 @@
+# backend/worker/tests/test_autoscaler.py
+"""
+Autoscaler.step con un launcher en memoria, un reloj manual y la cola y el
+registro de workers simulados (sin Redis).
+"""
+from typing import List
+
+import pytest
+
+import autoscaler
+from autoscaler import Autoscaler, WorkerLauncher
+
+
+class FakeLauncher(WorkerLauncher):
+    def __init__(self):
+        self._running: List[str] = []
+        self._draining: List[str] = []
+        self.started: List[str] = []
+
+    def start(self, worker_id: str, index: int) -> None:
+        self._running.append(worker_id)
+        self.started.append(worker_id)
+
+    def stop(self, worker_id: str) -> None:
+        self._running.remove(worker_id)
+        self._draining.append(worker_id)
+
+    def running(self) -> List[str]:
+        return sorted(self._running)
+
+    def draining(self) -> List[str]:
+        return sorted(self._draining)
+
+    def shutdown(self, timeout: float) -> None:
+        self._draining += self._running
+        self._running = []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeCluster:
+    """Lo que step lee de Redis: estadísticas de la cola y registro de workers."""
+
+    def __init__(self):
+        self.pending = 0
+        self.leased = 0
+        self.workers: List[dict] = []
+
+    def queue_stats(self, r, queue):
+        return {"pending": self.pending, "leased": self.leased, "dead": 0, "lag_seconds": 0.0}
+
+    def list_workers(self, r, include_stale=False):
+        return [dict(w) for w in self.workers]
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    cluster = FakeCluster()
+    monkeypatch.setattr(autoscaler.job_queue, "queue_stats", cluster.queue_stats)
+    monkeypatch.setattr(autoscaler.worker_registry, "list_workers", cluster.list_workers)
+    # Valores por defecto, independientes del entorno de quien corre las pruebas
+    for name, value in {
+        "AUTOSCALER_MIN_WORKERS": 1,
+        "AUTOSCALER_MAX_WORKERS": 4,
+        "AUTOSCALER_TARGET_DRAIN_SECONDS": 300.0,
+        "AUTOSCALER_SCALE_UP_COOLDOWN": 30.0,
+        "AUTOSCALER_SCALE_DOWN_STABLE": 300.0,
+        "AUTOSCALER_MIN_ENCODE_SPEED": 0.3,
+        "AUTOSCALER_DEFAULT_JOB_SECONDS": 60.0,
+        "WORKER_CONCURRENCY": 1,
+    }.items():
+        monkeypatch.setattr(autoscaler, name, value)
+    return cluster
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def launcher():
+    return FakeLauncher()
+
+
+@pytest.fixture
+def scaler(cluster, clock, launcher):
+    return Autoscaler(r=None, launcher=launcher, queue="convert", clock=clock)
+
+
+def test_launcher_is_abstract():
+    with pytest.raises(TypeError):
+        WorkerLauncher()
+
+
+def test_starts_min_workers_with_empty_queue(scaler, launcher):
+    assert scaler.step() == "scale_up"
+    assert launcher.running() == ["autoscaled_0"]
+    assert scaler.step() == "hold"
+    assert launcher.running() == ["autoscaled_0"]
+
+
+def test_target_is_clamped_to_max_workers(scaler, cluster, launcher):
+    # 1000 jobs de 60 s en 300 s: 200 slots, muy por encima del máximo
+    cluster.pending = 1000
+    assert scaler.step() == "scale_up"
+    assert len(launcher.running()) == autoscaler.AUTOSCALER_MAX_WORKERS
+
+
+def test_min_workers_counts_fixed_capacity_apart(scaler, cluster, launcher):
+    # Workers externos (compose) cubren la demanda; igual se mantiene el mínimo propio
+    cluster.pending = 10
+    cluster.workers = [
+        {"worker_id": f"worker_{i}", "last_seen": 0.0, "slots": 1, "busy": 1} for i in range(5)
+    ]
+    assert scaler.step() == "scale_up"
+    assert launcher.running() == ["autoscaled_0"]
+
+
+def test_scale_up_waits_for_cooldown(scaler, cluster, clock, launcher):
+    scaler.step()  # arranca el mínimo
+    cluster.pending = 1000
+    clock.now = 10.0
+    assert scaler.step() == "cooldown"
+    assert len(launcher.running()) == 1
+
+    clock.now = 30.0
+    assert scaler.step() == "scale_up"
+    assert launcher.running() == [f"autoscaled_{i}" for i in range(4)]
+
+
+def test_scale_up_blocked_by_slow_encode(scaler, cluster, clock, launcher):
+    # worker_a (fijo) codificó 10 s de media en 100 s de encode: 0.1x tiempo real
+    cluster.workers = [
+        {"worker_id": "worker_a", "last_seen": 0.0, "slots": 1, "busy": 1,
+         "media_seconds": 0.0, "encode_seconds": 0.0}
+    ]
+    scaler.step()
+    cluster.workers = [
+        {"worker_id": "worker_a", "last_seen": 100.0, "slots": 1, "busy": 1,
+         "media_seconds": 10.0, "encode_seconds": 100.0}
+    ]
+    cluster.pending = 1000
+    clock.now = 100.0
+    assert scaler.step() == "slow_encode"
+    assert scaler.encode_speed == pytest.approx(0.1)
+    assert len(launcher.running()) == 1
+
+
+def test_slow_encode_does_not_block_reaching_min(scaler, launcher):
+    scaler.encode_speed = 0.01
+    assert scaler.step() == "scale_up"
+    assert launcher.running() == ["autoscaled_0"]
+
+
+def test_scale_down_one_at_a_time_after_stable_surplus(scaler, cluster, clock, launcher):
+    cluster.pending = 1000
+    scaler.step()
+    assert len(launcher.running()) == 4
+
+    # La cola se vació: sobran 3 workers; se detiene el menos ocupado
+    cluster.pending = 0
+    cluster.workers = [
+        {"worker_id": f"autoscaled_{i}", "last_seen": 0.0, "slots": 1, "busy": 0 if i == 2 else 1}
+        for i in range(4)
+    ]
+    clock.now = 100.0
+    assert scaler.step() == "hold"  # empieza a contar el excedente
+    clock.now = 399.0
+    assert scaler.step() == "hold"
+    clock.now = 400.0
+    assert scaler.step() == "scale_down"
+    assert launcher.draining() == ["autoscaled_2"]
+    assert len(launcher.running()) == 3
+
+    # El siguiente paso vuelve a esperar el periodo completo
+    clock.now = 600.0
+    assert scaler.step() == "hold"
+    clock.now = 700.0
+    assert scaler.step() == "scale_down"
+    assert len(launcher.running()) == 2
+
+
+def test_surplus_resets_when_demand_returns(scaler, cluster, clock, launcher):
+    cluster.pending = 1000
+    scaler.step()
+
+    cluster.pending = 0
+    clock.now = 100.0
+    scaler.step()
+    # Vuelve la demanda justo a la capacidad actual: se reinicia la espera
+    cluster.pending = 20  # 20 * 60 / 300 = 4 slots
+    clock.now = 200.0
+    assert scaler.step() == "hold"
+    cluster.pending = 0
+    clock.now = 450.0
+    assert scaler.step() == "hold"
+    clock.now = 750.0
+    assert scaler.step() == "scale_down"
+
+
+def test_never_scales_below_min(scaler, cluster, clock, launcher):
+    scaler.step()
+    for t in range(1, 10):
+        clock.now = t * 1000.0
+        assert scaler.step() == "hold"
+    assert launcher.running() == ["autoscaled_0"]
@@ -0,0 +1,103 @@
+# backend/worker/waveform.py
+"""
+Picos de la forma de onda (peaks.bin) para dibujar el audio en el frontend
+sin decodificarlo en el navegador.
+
+ffmpeg entrega, en la misma pasada que genera el mp3, el audio en mono a
+PEAKS_SAMPLE_RATE Hz como PCM s16le por un pipe (ver ffmpeg_tasks.run_ffmpeg);
+PeaksBuilder lo reduce al vuelo a pares (mín, máx) cada PEAKS_SAMPLES_PER_PEAK
+muestras, así que nunca guarda el audio completo. Al final agrega niveles más
+gruesos (cada uno junta PEAKS_LEVEL_FACTOR picos del anterior) para que el
+cliente elija el que se ajuste al ancho en pantalla.
+
+Formato (little-endian):
+
+    cabecera  "PEAK" | u16 versión | u16 niveles | u32 sample rate
+    por nivel u32 muestras por pico | u32 picos
+    datos     por nivel, del más fino al más grueso: picos × (i8 mín, i8 máx)
+
+Los valores son las muestras s16 escaladas a 8 bits (-128..127).
+"""
+import sys
+import struct
+from array import array
+from pathlib import Path
+
+PEAKS_FILENAME = "peaks.bin"
+PEAKS_MAGIC = b"PEAK"
+PEAKS_VERSION = 1
+PEAKS_SAMPLE_RATE = 8000
+PEAKS_SAMPLES_PER_PEAK = 256  # ~31 picos por segundo en el nivel más fino
+PEAKS_LEVEL_FACTOR = 4
+PEAKS_MAX_LEVELS = 6
+# No se agregan niveles más gruesos que esto (picos por nivel)
+PEAKS_MIN_LEVEL_PEAKS = 512
+
+# Salida adicional de ffmpeg con el audio que consume PeaksBuilder
+PEAKS_PCM_ARGS = [
+    "-map", "0:a:0",
+    "-ac", "1",
+    "-ar", str(PEAKS_SAMPLE_RATE),
+    "-c:a", "pcm_s16le",
+    "-f", "s16le",
+]
+
+
+class PeaksBuilder:
+    """Reduce PCM s16le mono a picos a medida que llega (ver feed)."""
+
+    def __init__(self, samples_per_peak: int = PEAKS_SAMPLES_PER_PEAK):
+        self.samples_per_peak = samples_per_peak
+        self.mins = array("b")
+        self.maxs = array("b")
+        self._carry = b""  # byte suelto de una muestra partida entre lecturas
+        self._samples = array("h")  # muestras que todavía no completan un pico
+
+    def feed(self, data: bytes) -> None:
+        data = self._carry + data
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        samples = array("h")
+        samples.frombytes(data[:usable])
+        if sys.byteorder == "big":
+            samples.byteswap()
+        self._samples.extend(samples)
+
+        n = self.samples_per_peak
+        full = len(self._samples) - len(self._samples) % n
+        for i in range(0, full, n):
+            block = self._samples[i:i + n]
+            self.mins.append(min(block) >> 8)
+            self.maxs.append(max(block) >> 8)
+        del self._samples[:full]
+
+    def levels(self) -> list[tuple[int, array, array]]:
+        """(muestras por pico, mínimos, máximos) de cada nivel, del más fino al más grueso."""
+        mins, maxs = self.mins, self.maxs
+        if self._samples:  # último pico incompleto
+            mins, maxs = array("b", mins), array("b", maxs)
+            mins.append(min(self._samples) >> 8)
+            maxs.append(max(self._samples) >> 8)
+
+        levels = [(self.samples_per_peak, mins, maxs)]
+        while len(levels) < PEAKS_MAX_LEVELS and len(mins) > PEAKS_MIN_LEVEL_PEAKS:
+            f = PEAKS_LEVEL_FACTOR
+            mins = array("b", (min(mins[i:i + f]) for i in range(0, len(mins), f)))
+            maxs = array("b", (max(maxs[i:i + f]) for i in range(0, len(maxs), f)))
+            levels.append((levels[-1][0] * f, mins, maxs))
+        return levels
+
+    def write(self, path: str) -> str:
+        levels = self.levels()
+        out = Path(path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        with open(out, "wb") as f:
+            f.write(struct.pack("<4sHHI", PEAKS_MAGIC, PEAKS_VERSION, len(levels), PEAKS_SAMPLE_RATE))
+            for samples_per_peak, mins, _ in levels:
+                f.write(struct.pack("<II", samples_per_peak, len(mins)))
+            for _, mins, maxs in levels:
+                pairs = array("b", bytes(2 * len(mins)))
+                pairs[0::2] = mins
+                pairs[1::2] = maxs
+                f.write(pairs.tobytes())
+        return out.as_posix()
@@ -2,38 +2,105 @@
 import os
 import json
 import time
+import signal
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Collection, List, Optional, Tuple, Union
 
 import redis
 import psutil
-from prometheus_client import start_http_server, Counter, Gauge
-from google.cloud import firestore
+from prometheus_client import start_http_server, Counter, Gauge, Histogram
 
 
 from ffmpeg_tasks import (
     convert_to_mp3,
     convert_to_mp4_h264,
     convert_to_hls,
+    convert_to_hls_abr,
+    convert_to_targets,
+    resolve_hls_ladder,
+    can_remux,
+    conversion_signature,
+    X264_PRESETS,
+    encode_video_chunk,
+    merge_video_chunks,
+    ProgressCallback,
 )
-from minio_client import download_object, upload_object
-
-from api.firebase_db import (
-    mark_media_job_processing,
-    mark_media_job_done,
-    mark_media_job_failed,
-    update_media_job_fields,
+from minio_client import (
+    upload_object,
+    presigned_download_url,
+    get_shared_minio_client,
+)
+from conversion_cache import (
+    ConversionCache,
+    CONVERSION_CACHE_ENABLED,
+    cache_key,
+    source_fingerprint,
 )
+from hls_publisher import HlsSegmentPublisher
+from waveform import PEAKS_FILENAME
+from previews import PREVIEWS_DIRNAME, PREVIEW_VTT_NAME, PREVIEW_CONTENT_TYPES, preview_files
+from progress import JobProgress
+from encoder_policy import choose_preset
+from scratch import ScratchSpace
+from chunked_jobs import (
+    should_chunk,
+    start_chunked_job,
+    complete_chunk,
+    fail_chunked_job,
+    chunked_job_failed,
+    cleanup_chunked_job,
+)
+
+from api import job_queue, worker_registry
+from api.media_probe import probe_media
+from api.firebase_db import get_job_status_writer
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 REDIS_QUEUE = os.getenv("REDIS_QUEUE", "convert")
+# Espera entre sondeos cuando la cola está vacía
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1"))
+# Cada cuánto cada slot busca leases vencidos de workers caídos
+QUEUE_RECLAIM_INTERVAL = float(os.getenv("QUEUE_RECLAIM_INTERVAL", "15"))
 
 WORKER_ID = os.getenv("WORKER_ID", "worker_a")
 METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))
+# Número de jobs que este proceso ejecuta en paralelo (un ffmpeg por slot)
+WORKER_CONCURRENCY = max(1, int(os.getenv("WORKER_CONCURRENCY", "1")))
 
 OUTPUT_BASE_DIR = os.getenv("OUTPUT_BASE_DIR", "/tmp/media_jobs")
+# "download": copia el original a disco antes de convertir
+# "stream": ffmpeg lee el original directamente de MinIO (URL firmada)
+WORKER_INPUT_MODE = os.getenv("WORKER_INPUT_MODE", "download").lower()
+# Si el original ya tiene los códecs del target se copia sin recodificar
+REMUX_FAST_PATH_ENABLED = os.getenv("REMUX_FAST_PATH_ENABLED", "true").lower() == "true"
+# Modo pipeline: cada slot arrienda y descarga el job siguiente mientras
+# codifica el actual y sube las salidas del anterior en segundo plano
+WORKER_PIPELINE_ENABLED = os.getenv("WORKER_PIPELINE_ENABLED", "false").lower() == "true"
+# Picos de la forma de onda (peaks.bin) junto a cada mp3
+WAVEFORM_PEAKS_ENABLED = os.getenv("WAVEFORM_PEAKS_ENABLED", "true").lower() == "true"
+# Póster, sprites y pista WebVTT de miniaturas junto a cada mp4/hls
+VIDEO_PREVIEWS_ENABLED = os.getenv("VIDEO_PREVIEWS_ENABLED", "true").lower() == "true"
+
+# Disco temporal: carpetas por job + caché LRU de originales descargados
+scratch = ScratchSpace(OUTPUT_BASE_DIR, WORKER_ID)
+# Los cambios de estado de los jobs se escriben en Firestore en segundo plano
+status_writer = get_job_status_writer()
+
+# Contadores acumulados que el worker publica en el registro (autoscaler, monitor)
+_stats = {"busy": 0, "jobs_done": 0, "jobs_failed": 0, "media_seconds": 0.0, "encode_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+# Subidas que el slot deja para la etapa de subida (modo pipeline)
+_pipeline_local = threading.local()
+
+_shared_redis: Optional[redis.Redis] = None
+_conversion_cache: Optional[ConversionCache] = None
+_shared_lock = threading.Lock()
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,7 +109,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 jobs_in_progress = Gauge(
-    "worker_jobs_in_progress", "Current jobs in progress", ["worker_id"]
+    "worker_jobs_in_progress", "Current jobs in progress", ["worker_id", "slot"]
 )
 jobs_done_total = Counter(
     "worker_jobs_done_total", "Jobs finished", ["worker_id"]
@@ -50,6 +117,27 @@ jobs_done_total = Counter(
 jobs_failed_total = Counter(
     "worker_jobs_failed_total", "Jobs failed", ["worker_id"]
 )
+jobs_reclaimed_total = Counter(
+    "worker_jobs_reclaimed_total",
+    "Jobs recuperados de workers caídos (requeued | dead)",
+    ["worker_id", "outcome"],
+)
+pipeline_prefetched_total = Counter(
+    "worker_pipeline_prefetched_total",
+    "Jobs arrendados y descargados mientras el slot codificaba otro",
+    ["worker_id"],
+)
+pipeline_upload_wait_seconds = Histogram(
+    "worker_pipeline_upload_wait_seconds",
+    "Tiempo que un slot esperó a que terminara la subida del job anterior",
+    ["worker_id"],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300),
+)
+conversions_by_path_total = Counter(
+    "worker_conversions_by_path_total",
+    "Conversiones por camino tomado (remux | transcode)",
+    ["worker_id", "target", "path"],
+)
 # Métricas de uso de recursos del worker
 system_cpu_percent = Gauge(
     "system_cpu_percent",
@@ -93,11 +181,31 @@ def get_redis_client() -> redis.Redis:
     return client
 
 
+def get_shared_redis() -> redis.Redis:
+    """Cliente Redis del proceso para tareas fuera del loop de los slots (caché, partes)."""
+    global _shared_redis
+    with _shared_lock:
+        if _shared_redis is None:
+            _shared_redis = get_redis_client()
+        return _shared_redis
+
+
+def count_stats(**deltas) -> None:
+    with _stats_lock:
+        for key, delta in deltas.items():
+            _stats[key] += delta
+
+
 def get_local_input(job_id: str, job: dict) -> str:
     """
-    Obtiene el archivo de entrada local para el job.
+    Obtiene la entrada de ffmpeg para el job.
     - Si viene local_path/source_path en el job, usa eso.
-    - Si viene source_bucket + source_object, lo descarga de MinIO.
+    - Si viene source_bucket + source_object:
+        * modo "stream": devuelve una URL firmada y ffmpeg lee de MinIO
+          mientras decodifica (sin copia local).
+        * modo "download": lo descarga de MinIO a la caché local de
+          originales (scratch.py); otro target del mismo media lo reutiliza.
+    El modo se puede forzar por job con la clave "input_mode".
     """
     local_path = job.get("local_path") or job.get("source_path")
     if local_path:
@@ -105,18 +213,76 @@ def get_local_input(job_id: str, job: dict) -> str:
 
     source_bucket = job.get("source_bucket")
     source_object = job.get("source_object")
+    input_mode = (job.get("input_mode") or WORKER_INPUT_MODE).lower()
+    if source_bucket and source_object and input_mode == "stream":
+        return presigned_download_url(source_bucket, source_object)
+
     if source_bucket and source_object:
-        dest_dir = Path(OUTPUT_BASE_DIR) / job_id
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        ext = Path(source_object).suffix or ".bin"
-        dest_path = dest_dir / f"input{ext}"
-        return download_object(source_bucket, source_object, str(dest_path))
+        return scratch.source(source_bucket, source_object, job_id)
 
     raise ValueError(
         "job must include local_path/source_path or source_bucket/source_object"
     )
 
 
+def probe_source(job: dict) -> dict:
+    """
+    Probe (códecs, resolución, duración) del original: el que hizo la API
+    al subirlo o, si el job no lo trae, ffprobe sobre la entrada (sólo lee
+    la cabecera, sin descargar el archivo). {} si no se pudo obtener.
+    """
+    if job.get("source_probe"):
+        return job["source_probe"]
+    source = job.get("local_path") or job.get("source_path")
+    if not source and job.get("source_bucket") and job.get("source_object"):
+        source = presigned_download_url(job["source_bucket"], job["source_object"])
+    return (probe_media(source) if source else None) or {}
+
+
+def choose_encoder_preset(job: dict) -> Optional[str]:
+    """
+    Preset de x264 para el job: el que ya trae (p.ej. las partes de un video
+    partido heredan el del original) o el que dicta la profundidad de la cola.
+    """
+    if job.get("encoder_preset"):
+        return job["encoder_preset"]
+    return choose_preset(get_shared_redis(), REDIS_QUEUE, WORKER_ID)
+
+
+def encoder_preset_for(target: str, remux: bool, preset: Optional[str]) -> Optional[str]:
+    """Preset que se registra en el job: sólo las salidas con video x264 lo usan."""
+    return None if remux or target == "mp3" else preset
+
+
+def wants_peaks(target: str) -> bool:
+    """Los mp3 llevan al lado los picos de su forma de onda (waveform.py)."""
+    return target == "mp3" and WAVEFORM_PEAKS_ENABLED
+
+
+def previews_duration(job: dict, target: str, probe: dict, remux: bool) -> Optional[float]:
+    """
+    Los mp4/hls con video llevan póster, sprites y pista WebVTT (previews.py),
+    salvo previews=false en el job. Un remux no decodifica el video y las
+    vistas previas lo obligarían a decodificarlo entero, así que ahí sólo se
+    generan con previews=true. Devuelve la duración del original, que ubica
+    las miniaturas, o None si no llevan (o no se sabe si hay video).
+    """
+    if not VIDEO_PREVIEWS_ENABLED or job.get("previews") is False:
+        return None
+    if remux and job.get("previews") is not True:
+        return None
+    if target not in ("mp4", "hls") or not probe or probe.get("video_codec") is None:
+        return None
+    return job.get("source_duration") or probe.get("duration") or None
+
+
+def use_remux(job: dict, target: str, probe: dict) -> bool:
+    """Camino rápido: copiar pistas en vez de recodificar (remux=false en el job lo desactiva)."""
+    if not REMUX_FAST_PATH_ENABLED or job.get("remux") is False:
+        return False
+    return can_remux(target, probe)
+
+
 def upload_result_if_needed(
     job: dict, job_id: str, local_path: str, is_hls: bool = False
 ) -> None:
@@ -137,150 +303,1076 @@ def upload_result_if_needed(
         upload_object(output_bucket, object_name, local_path)
         return
 
-    # HLS: subimos todos los archivos del directorio
-    hls_dir = Path(local_path).parent
-    for item in hls_dir.iterdir():
-        if item.is_file():
-            object_name = f"{output_prefix}/{item.name}"
-            upload_object(output_bucket, object_name, str(item))
+    # HLS: subimos todos los archivos del directorio (en paralelo, playlists al final)
+    HlsSegmentPublisher(output_bucket, output_prefix, str(Path(local_path).parent)).finish()
+
+
+def get_conversion_cache() -> Optional[ConversionCache]:
+    """Caché de conversiones compartida por todos los slots (None si está desactivada)."""
+    global _conversion_cache
+    if not CONVERSION_CACHE_ENABLED:
+        return None
+    if _conversion_cache is None:
+        cache = ConversionCache(get_shared_redis(), get_shared_minio_client(), WORKER_ID)
+        with _shared_lock:
+            if _conversion_cache is None:
+                _conversion_cache = cache
+    return _conversion_cache
+
+
+def cache_signatures(target: str, preset: Optional[str], **params) -> list[tuple[Optional[str], str]]:
+    """
+    Firmas aceptables para la caché, como (preset, firma): la del preset
+    elegido y las de los presets más lentos. La CRF es la misma, así que una
+    salida más lenta es igual de buena y más chica: lo convertido con la cola
+    ociosa ("medium") también sirve cuando la cola cargada pide "veryfast".
+    """
+    if preset not in X264_PRESETS:
+        return [(preset, conversion_signature(target, preset=preset, **params))]
+    return [
+        (p, conversion_signature(target, preset=p, **params))
+        for p in X264_PRESETS[X264_PRESETS.index(preset):]
+    ]
+
+
+def lookup_cached_conversion(
+    job: dict, target: str, signatures: list[tuple[Optional[str], str]]
+) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Calcula la clave de caché del job y, si ya existe esa conversión (con
+    cualquiera de las firmas de cache_signatures), la copia server-side al
+    output_prefix del job. Devuelve (clave, resultado): la clave es la de la
+    primera firma (donde se guarda la salida si hay que convertir) y el
+    resultado es None si hay que convertir; si no, trae el encoder_preset con
+    el que se hizo. Un fallo de la caché nunca tumba el job.
+    """
+    output_bucket = job.get("output_bucket")
+    output_prefix = job.get("output_prefix")
+    try:
+        cache = get_conversion_cache()
+        if cache is None or not output_bucket or not output_prefix:
+            return None, None
+        fingerprint = source_fingerprint(cache.client, job)
+        if not fingerprint:
+            return None, None
+        keys = {cache_key(fingerprint, target, signature): preset for preset, signature in signatures}
+        key = next(iter(keys))
+
+        hit_key, entry = cache.acquire_first(list(keys))
+        if entry is None:
+            return key, None
+        try:
+            cache.copy_to(entry, output_bucket, output_prefix)
+        finally:
+            cache.release(hit_key)
+    except Exception as e:
+        logger.warning(f"[{WORKER_ID}] conversion cache unavailable: {e}")
+        return None, None
+
+    sizes = dict(entry["objects"])
+    output_size_bytes = None if target == "hls" else sizes.get(entry["output_object"])
+    return key, {
+        "output_object": f"{output_prefix}/{entry['output_object']}",
+        "output_size_bytes": output_size_bytes,
+        "conversion_cache": "hit",
+        "encoder_preset": keys[hit_key],
+        **auxiliary_fields(output_prefix, sizes),
+    }
+
+
+def auxiliary_files(out_dir: Path) -> list[tuple[str, Path]]:
+    """
+    Archivos que acompañan a la salida en la carpeta del job (peaks.bin,
+    previews/...), como (nombre relativo al output_prefix, ruta local).
+    """
+    files = []
+    peaks = out_dir / PEAKS_FILENAME
+    if peaks.is_file():
+        files.append((PEAKS_FILENAME, peaks))
+    for path in preview_files(out_dir / PREVIEWS_DIRNAME):
+        files.append((f"{PREVIEWS_DIRNAME}/{path.name}", path))
+    return files
 
 
-def process_job(job: dict) -> str:
+def auxiliary_fields(output_prefix: Optional[str], names: Collection[str]) -> dict:
+    """Campos del job que apuntan a los archivos auxiliares publicados."""
+    fields = {}
+    if PEAKS_FILENAME in names:
+        fields["peaks_object"] = f"{output_prefix}/{PEAKS_FILENAME}"
+    if f"{PREVIEWS_DIRNAME}/{PREVIEW_VTT_NAME}" in names:
+        fields["previews_prefix"] = f"{output_prefix}/{PREVIEWS_DIRNAME}"
+    return fields
+
+
+def upload_auxiliary_files(job: dict, extras: list[tuple[str, Path]]) -> None:
+    if not job.get("output_bucket") or not job.get("output_prefix"):
+        return
+    for name, path in extras:
+        upload_object(
+            job["output_bucket"],
+            f"{job['output_prefix']}/{name}",
+            str(path),
+            PREVIEW_CONTENT_TYPES.get(path.suffix, "application/octet-stream"),
+        )
+
+
+def store_cached_conversion(
+    key: str,
+    job: dict,
+    out_path: Path,
+    output_name: str,
+    extras: list[tuple[str, Path]] = (),
+) -> None:
+    """
+    Registra en la caché la salida que se acaba de subir (archivo o carpeta
+    HLS) junto con sus archivos auxiliares (ver auxiliary_files).
+    """
+    files = [out_path] if out_path.is_file() else [p for p in out_path.rglob("*") if p.is_file()]
+    base = out_path.parent if out_path.is_file() else out_path
+    objects = [(p.relative_to(base).as_posix(), p.stat().st_size) for p in files]
+    objects += [(name, path.stat().st_size) for name, path in extras]
+    try:
+        get_conversion_cache().store(
+            key, job["output_bucket"], job["output_prefix"], objects, output_name
+        )
+    except Exception as e:
+        logger.warning(f"[{WORKER_ID}] could not store conversion in cache: {e}")
+
+
+def encode_hls_with_publisher(job: dict, hls_out_dir: Path, encode: Callable[[], str]) -> str:
+    """
+    Ejecuta `encode` (que escribe HLS en hls_out_dir y devuelve la playlist)
+    subiendo los segmentos a MinIO mientras ffmpeg sigue codificando.
+    """
+    output_bucket = job.get("output_bucket")
+    output_prefix = job.get("output_prefix")
+    if not output_bucket or not output_prefix:
+        return encode()
+
+    publisher = HlsSegmentPublisher(
+        output_bucket, output_prefix, str(hls_out_dir)
+    ).start()
+    try:
+        playlist_path = encode()
+    except Exception:
+        publisher.abort()
+        raise
+    publisher.finish()
+    return playlist_path
+
+
+def defer_or_run(job_id: str, action: Callable[[], None]) -> None:
+    """
+    En modo pipeline deja `action` para la etapa de subida (finish_job), así el
+    slot pasa al job siguiente; si no, la ejecuta ya.
+    """
+    uploads = getattr(_pipeline_local, "uploads", None)
+    if uploads is None:
+        action()
+    else:
+        uploads.append((job_id, action))
+
+
+def file_result(
+    job: dict, out_file: Path, cache_key_: Optional[str], extras: list[tuple[str, Path]] = ()
+) -> dict:
+    """
+    Sube un resultado mp3/mp4 con sus archivos auxiliares (peaks.bin,
+    previews/...), lo registra en la caché y arma los campos de salida.
+    """
+    def publish() -> None:
+        upload_result_if_needed(job, job.get("job_id", "unknown"), str(out_file), is_hls=False)
+        upload_auxiliary_files(job, extras)
+        if cache_key_:
+            store_cached_conversion(cache_key_, job, out_file, out_file.name, extras)
+
+    defer_or_run(job.get("job_id", "unknown"), publish)
+    return {
+        "output_path": str(out_file),
+        "output_object": f"{job.get('output_prefix')}/{out_file.name}",
+        "output_size_bytes": out_file.stat().st_size,
+        "conversion_cache": "miss",
+        **auxiliary_fields(job.get("output_prefix"), [name for name, _ in extras]),
+    }
+
+
+def hls_result(
+    job: dict, playlist_path: str, cache_key_: Optional[str], extras: list[tuple[str, Path]] = ()
+) -> dict:
+    """
+    Registra en la caché una salida HLS ya publicada (los segmentos se suben
+    durante el encode), sube sus vistas previas y arma los campos de salida.
+    """
+    playlist = Path(playlist_path)
+
+    def publish() -> None:
+        upload_auxiliary_files(job, extras)
+        if cache_key_:
+            store_cached_conversion(cache_key_, job, playlist.parent, playlist.name, extras)
+
+    defer_or_run(job.get("job_id", "unknown"), publish)
+    return {
+        "output_path": playlist_path,
+        "output_object": f"{job.get('output_prefix')}/{playlist.name}",
+        "output_size_bytes": None,
+        "conversion_cache": "miss",
+        **auxiliary_fields(job.get("output_prefix"), [name for name, _ in extras]),
+    }
+
+
+def process_chunk_job(job: dict, progress: Optional[ProgressCallback] = None) -> dict:
+    """Sub-job de un video partido: codifica una parte y, si es la última, encola el merge."""
+    job_id = job["job_id"]
+    r = get_shared_redis()
+    if chunked_job_failed(r, job["parent_job_id"]):
+        logger.info(f"[{WORKER_ID}] chunk {job_id} skipped, {job['parent_job_id']} already failed")
+        return {"output_path": None, "deferred": True}
+    try:
+        src_path = get_local_input(job_id, job)
+        out_file = scratch.job_dir(job_id) / "part.mkv"
+        encode_video_chunk(
+            src_path, str(out_file), job["target"], progress=progress,
+            preset=job.get("encoder_preset"),
+        )
+        upload_object(job["output_bucket"], job["output_object"], str(out_file), "video/x-matroska")
+    except Exception:
+        fail_chunked_job(r, job)
+        raise
+
+    merge_job = complete_chunk(r, job)
+    if merge_job is not None:
+        job_queue.enqueue(r, REDIS_QUEUE, merge_job)
+        logger.info(f"[{WORKER_ID}] all chunks of {job['parent_job_id']} done, merge enqueued")
+    return {"output_path": str(out_file), "deferred": True}
+
+
+def process_merge_job(job: dict, progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Último paso de un video partido: une las partes codificadas (sin
+    recodificar el video), codifica el audio del original y publica la salida.
+    """
+    parent_id = job["parent_job_id"]
+    target = job["target"]
+    bucket = job["output_bucket"]
+    chunk_sources = [presigned_download_url(bucket, obj) for obj in job["chunk_objects"]]
+    out_dir = scratch.job_dir(job["job_id"])
+    try:
+        audio_source = get_local_input(job["job_id"], job)
+        if target == "mp4":
+            out_file = out_dir / "output.mp4"
+            merge_video_chunks(chunk_sources, audio_source, target, str(out_file), progress=progress)
+            result = file_result(job, out_file, job.get("cache_key"))
+        else:
+            hls_out_dir = out_dir / "hls"
+            playlist_path = encode_hls_with_publisher(
+                job,
+                hls_out_dir,
+                lambda: merge_video_chunks(
+                    chunk_sources, audio_source, target, str(hls_out_dir / "index.m3u8"),
+                    progress=progress,
+                ),
+            )
+            result = hls_result(job, playlist_path, job.get("cache_key"))
+    finally:
+        # Con éxito o sin él, las partes intermedias ya no sirven
+        cleanup_chunked_job(get_shared_redis(), parent_id, bucket)
+    result["conversion_path"] = "transcode"
+    result["encoder_preset"] = job.get("encoder_preset")
+    return result
+
+
+def fanout_output_job(job: dict, output: dict) -> dict:
+    """Vista de una salida de un job fan-out como si fuera un job de un solo target."""
+    view = {k: v for k, v in job.items() if k != "outputs"}
+    return {
+        **view,
+        "kind": "convert",
+        "job_id": output["job_id"],
+        "target": output["target"],
+        "output_prefix": output["output_prefix"],
+    }
+
+
+def process_fanout_job(job: dict, progress: Optional[ProgressCallback] = None) -> dict:
+    """
+    Job con varios targets del mismo original (kind "fanout"): las salidas
+    que ya están en la caché se copian y el resto sale de UN ffmpeg que
+    decodifica el original una sola vez. Devuelve en "outputs" el resultado
+    de cada salida por job_id, o la excepción si esa salida falló.
+    """
+    outputs: dict[str, Union[dict, Exception]] = {}
+    pending = []  # (job de la salida, clave de caché, ruta local)
+    remux = set()  # targets que sólo cambian de contenedor
+    probe = probe_source(job)
+    preset = choose_encoder_preset(job)
+    for output in job["outputs"]:
+        sub = fanout_output_job(job, output)
+        target = sub["target"]
+        if target not in ("mp3", "mp4", "hls"):
+            outputs[sub["job_id"]] = ValueError(f"unsupported target: {target}")
+            continue
+        if use_remux(job, target, probe):
+            remux.add(target)
+        conversion_path = "remux" if target in remux else "transcode"
+        key, cached = lookup_cached_conversion(
+            sub,
+            target,
+            cache_signatures(
+                target,
+                encoder_preset_for(target, target in remux, preset),
+                remux=target in remux,
+                peaks=wants_peaks(target),
+                previews=previews_duration(job, target, probe, target in remux) is not None,
+            ),
+        )
+        if cached is not None:
+            # encoder_preset: el de la salida cacheada, que puede ser más lento
+            outputs[sub["job_id"]] = {
+                "output_path": None,
+                "conversion_path": conversion_path,
+                **cached,
+            }
+            continue
+        out_dir = scratch.job_dir(sub["job_id"])
+        out_path = out_dir / "hls" / "index.m3u8" if target == "hls" else out_dir / f"output.{target}"
+        pending.append((sub, key, out_path))
+
+    if not pending:
+        return {"output_path": None, "outputs": outputs}
+
+    # El mp3 (si sale de este ffmpeg) lleva sus picos al lado; las vistas
+    # previas se generan una vez y se publican con cada salida de video
+    peaks_file = next(
+        (path.parent / PEAKS_FILENAME for sub, _, path in pending if wants_peaks(sub["target"])),
+        None,
+    )
+    duration = next(
+        (
+            d for d in (
+                previews_duration(job, sub["target"], probe, sub["target"] in remux)
+                for sub, _, _ in pending
+            ) if d
+        ),
+        None,
+    )
+    previews_dir = scratch.job_dir(job["job_id"]) / PREVIEWS_DIRNAME
+    try:
+        src_path = get_local_input(job["job_id"], job)
+        encode = lambda: convert_to_targets(
+            src_path,
+            [(sub["target"], str(path)) for sub, _, path in pending],
+            progress=progress,
+            remux=remux,
+            preset=preset,
+            peaks_path=str(peaks_file) if peaks_file else None,
+            previews_dir=str(previews_dir) if duration else None,
+            duration=duration,
+        )
+        # Los targets no se repiten: como mucho hay una salida HLS que publicar en vivo
+        hls = next(((sub, path) for sub, _, path in pending if sub["target"] == "hls"), None)
+        if hls is not None:
+            encode_hls_with_publisher(hls[0], hls[1].parent, encode)
+        else:
+            encode()
+    except Exception as e:
+        for sub, _, _ in pending:
+            outputs[sub["job_id"]] = e
+        return {"output_path": None, "outputs": outputs}
+
+    for sub, key, path in pending:
+        target = sub["target"]
+        conversion_path = "remux" if target in remux else "transcode"
+        conversions_by_path_total.labels(
+            worker_id=WORKER_ID, target=target, path=conversion_path
+        ).inc()
+        extras = []
+        if wants_peaks(target):
+            extras = auxiliary_files(peaks_file.parent)
+            if not peaks_file.is_file():
+                key = None  # sin forma de onda: no cachear bajo la firma que la promete
+        elif previews_duration(job, target, probe, target in remux):
+            extras = auxiliary_files(previews_dir.parent)
+        try:
+            if target == "hls":
+                result = hls_result(sub, str(path), key, extras)
+            else:
+                result = file_result(sub, path, key, extras)
+            outputs[sub["job_id"]] = {
+                **result,
+                "conversion_path": conversion_path,
+                "encoder_preset": encoder_preset_for(target, target in remux, preset),
+            }
+        except Exception as e:
+            outputs[sub["job_id"]] = e
+    return {"output_path": None, "outputs": outputs}
+
+
+def process_job(job: dict, progress: Optional[ProgressCallback] = None) -> dict:
     """
     Descarga el input (si hace falta), ejecuta ffmpeg según el 'target',
-    sube el resultado a MinIO y devuelve la ruta local del archivo principal
-    (mp3/mp4 o playlist HLS).
+    sube el resultado a MinIO y devuelve los campos de salida del job:
+    output_path (ruta local del archivo principal, mp3/mp4 o playlist HLS),
+    output_object, output_size_bytes y conversion_cache ("hit" | "miss").
+    Si la misma conversión ya está en la caché no se ejecuta ffmpeg.
+    Los videos largos se parten en sub-jobs: entonces devuelve deferred=True
+    y el job se completa cuando termina su merge. Los jobs con varios
+    targets (fan-out) devuelven un resultado por salida (ver process_fanout_job).
+    `progress` recibe el avance de ffmpeg (ver progress.JobProgress).
     """
+    kind = job.get("kind") or "convert"
+    if kind == "chunk":
+        return process_chunk_job(job, progress)
+    if kind == "merge":
+        return process_merge_job(job, progress)
+    if kind == "fanout":
+        return process_fanout_job(job, progress)
+
     job_id = job.get("job_id", "unknown")
     target = job.get("target")
     if not target:
         raise ValueError("job must include 'target'")
+    if target not in ("mp3", "mp4", "hls"):
+        raise ValueError(f"unsupported target: {target}")
+
+    # HLS adaptativo: escalera pedida, ajustada a la resolución del original
+    probe = probe_source(job)
+    ladder = None
+    if target == "hls" and job.get("hls_ladder"):
+        ladder = resolve_hls_ladder(
+            job["hls_ladder"],
+            probe.get("height"),
+            has_video=probe.get("video_codec") is not None if probe else True,
+        )
+
+    # Si los códecs ya son los del target basta con cambiar de contenedor
+    remux = not ladder and use_remux(job, target, probe)
+    conversion_path = "remux" if remux else "transcode"
+    # Preset de x264 según la carga de la cola (forma parte de la firma de caché,
+    # pero también vale una salida cacheada con un preset más lento)
+    preset = None if remux or target == "mp3" else choose_encoder_preset(job)
+    recorded = {"conversion_path": conversion_path, "encoder_preset": preset}
+    peaks = wants_peaks(target)
+    # Un video que se parte no se decodifica entero en un solo ffmpeg: sin vistas previas
+    chunkable = not remux and should_chunk(job)
+    duration = None if chunkable else previews_duration(job, target, probe, remux)
+    previews_dir = str(scratch.job_dir(job_id) / PREVIEWS_DIRNAME) if duration else None
+
+    cache_key_, cached = lookup_cached_conversion(
+        job,
+        target,
+        cache_signatures(
+            target, preset, ladder=ladder, remux=remux, peaks=peaks, previews=bool(duration)
+        ),
+    )
+    if cached is not None:
+        return {"output_path": None, **recorded, **cached}
 
     src_path = get_local_input(job_id, job)
 
-    out_dir = Path(OUTPUT_BASE_DIR) / job_id
-    out_dir.mkdir(parents=True, exist_ok=True)
+    out_dir = scratch.job_dir(job_id)
+
+    # Videos largos: partir en keyframes y repartir las partes entre workers
+    if chunkable:
+        parent = {**job, "cache_key": cache_key_, "encoder_preset": preset}
+        chunks = start_chunked_job(get_shared_redis(), REDIS_QUEUE, parent, src_path, out_dir)
+        if chunks:
+            logger.info(f"[{WORKER_ID}] job {job_id} split into {chunks} chunks")
+            return {"output_path": None, "deferred": True}
+
+    conversions_by_path_total.labels(
+        worker_id=WORKER_ID, target=target, path=conversion_path
+    ).inc()
 
     if target == "mp3":
         out_file = out_dir / "output.mp3"
-        convert_to_mp3(src_path, str(out_file))
-        upload_result_if_needed(job, job_id, str(out_file), is_hls=False)
-        return str(out_file)
+        peaks_file = out_dir / PEAKS_FILENAME if peaks else None
+        convert_to_mp3(
+            src_path, str(out_file), progress=progress, remux=remux,
+            peaks_path=str(peaks_file) if peaks_file else None,
+        )
+        if peaks_file and not peaks_file.is_file():
+            cache_key_ = None  # sin forma de onda: no cachear bajo la firma que la promete
+        return {**file_result(job, out_file, cache_key_, auxiliary_files(out_dir)), **recorded}
 
     if target == "mp4":
         out_file = out_dir / "output.mp4"
-        convert_to_mp4_h264(src_path, str(out_file))
-        upload_result_if_needed(job, job_id, str(out_file), is_hls=False)
-        return str(out_file)
+        convert_to_mp4_h264(
+            src_path, str(out_file), progress=progress, remux=remux, preset=preset,
+            previews_dir=previews_dir, duration=duration,
+        )
+        return {**file_result(job, out_file, cache_key_, auxiliary_files(out_dir)), **recorded}
 
-    if target == "hls":
-        hls_out_dir = out_dir / "hls"
-        playlist_path = convert_to_hls(src_path, str(hls_out_dir))
-        upload_result_if_needed(job, job_id, playlist_path, is_hls=True)
-        return playlist_path  # index.m3u8
+    # target == "hls"
+    hls_out_dir = out_dir / "hls"
+    if ladder:
+        encode = lambda: convert_to_hls_abr(
+            src_path,
+            str(hls_out_dir),
+            ladder,
+            has_audio=probe.get("audio_codec") is not None if probe else True,
+            progress=progress,
+            preset=preset,
+            previews_dir=previews_dir,
+            duration=duration,
+        )
+    else:
+        encode = lambda: convert_to_hls(
+            src_path, str(hls_out_dir), progress=progress, remux=remux, preset=preset,
+            previews_dir=previews_dir, duration=duration,
+        )
+    playlist_path = encode_hls_with_publisher(job, hls_out_dir, encode)
+    result = {**hls_result(job, playlist_path, cache_key_, auxiliary_files(out_dir)), **recorded}
+    if ladder:
+        result["hls_ladder"] = ladder
+    return result
 
-    raise ValueError(f"unsupported target: {target}")
 
+def firestore_job_ids(job: dict) -> list[str]:
+    """
+    Jobs de Firestore (jobs.<job_id>) sobre los que informa un job de la cola:
+    el propio job, el original de un video partido o cada salida de un fan-out.
+    """
+    if job.get("kind") == "fanout":
+        return [o["job_id"] for o in job.get("outputs") or []]
+    job_id = job.get("parent_job_id") or job.get("job_id")
+    return [job_id] if job_id else []
 
-def main() -> None:
-    # Servidor de métricas Prometheus
-    start_http_server(METRICS_PORT)
-    logger.info(f"[{WORKER_ID}] metrics on :{METRICS_PORT}")
 
-    # Conectar a Redis con reintentos
+def record_job_done(job: dict, job_id: str, result: dict) -> None:
+    """Marca el job como done en Firestore junto con su info de salida (sin esperar)."""
+    media_id = job.get("media_id")
+    if not media_id or not job_id:
+        return
+    status_writer.mark_done(
+        media_id,
+        job_id,
+        output_prefix=job.get("output_prefix"),
+        target=job.get("target"),
+        output_bucket=job.get("output_bucket"),
+        **result,
+    )
+
+
+def finish_fanout_job(job: dict, outputs: dict, slot: str) -> None:
+    """Registra en Firestore el resultado de cada salida de un job fan-out por separado."""
+    media_id = job.get("media_id")
+    for output in job["outputs"]:
+        job_id = output["job_id"]
+        result = outputs.get(job_id)
+        if isinstance(result, dict):
+            output_path = result.pop("output_path", None)
+            jobs_done_total.labels(worker_id=WORKER_ID).inc()
+            logger.info(
+                f"[{WORKER_ID}/{slot}] job {job_id} ({output['target']}) finished "
+                f"(cache {result['conversion_cache']}), output at: {output_path or result['output_object']}"
+            )
+            record_job_done(fanout_output_job(job, output), job_id, result)
+            continue
+
+        logger.error(f"[{WORKER_ID}/{slot}] job {job_id} ({output['target']}) failed: {result}")
+        jobs_failed_total.labels(worker_id=WORKER_ID).inc()
+        status_writer.mark_failed(media_id, job_id, details=str(result))
+
+
+def handle_job(job: dict, slot: str) -> None:
+    """
+    Ejecuta un job completo (processing -> ffmpeg/upload -> done|failed)
+    dentro del slot indicado, con su propia contabilidad de jobs_in_progress.
+    Los sub-jobs de un video partido (chunk/merge) reportan sobre el job
+    original (parent_job_id) en Firestore; un job fan-out reporta sobre el
+    job de cada una de sus salidas.
+    """
+    result, error = encode_job(job, slot)
+    finish_job(job, slot, result, error)
+
+
+def encode_job(
+    job: dict, slot: str, uploads: Optional[list] = None
+) -> Tuple[Optional[dict], Optional[Exception]]:
+    """
+    Primera mitad de handle_job: marca processing y ejecuta process_job.
+    Con `uploads` (modo pipeline) las subidas de salidas mp3/mp4 no se hacen
+    aquí sino que se agregan a esa lista para finish_job.
+    Devuelve (resultado, None) o (None, excepción).
+    """
+    jobs_in_progress.labels(worker_id=WORKER_ID, slot=slot).inc()
+    count_stats(busy=1)
+
+    kind = job.get("kind") or "convert"
+    job_ids = firestore_job_ids(job)
+    media_id = job.get("media_id")
+    try:
+        # ---- marcar como processing ----
+        if media_id and kind in ("convert", "fanout"):
+            for jid in job_ids:
+                status_writer.mark_processing(media_id, jid)
+
+        # ---- procesar job (caché | ffmpeg + upload a MinIO) ----
+        # Las partes no tienen duración propia: sólo reportan métricas
+        target = job.get("target")
+        if kind == "fanout":
+            target = "+".join(o["target"] for o in job.get("outputs") or [])
+        progress = JobProgress(
+            WORKER_ID,
+            slot,
+            target,
+            media_id=media_id if kind != "chunk" else None,
+            job_ids=job_ids,
+            duration=job.get("source_duration") if kind != "chunk" else None,
+        )
+        _pipeline_local.uploads = uploads
+        try:
+            result = process_job(job, progress)
+        finally:
+            _pipeline_local.uploads = None
+        if progress.reported:
+            progress.finish()
+            count_stats(media_seconds=progress.media_seconds, encode_seconds=progress.elapsed)
+        return result, None
+    except Exception as e:
+        return None, e
+    finally:
+        jobs_in_progress.labels(worker_id=WORKER_ID, slot=slot).dec()
+        count_stats(busy=-1)
+        update_system_metrics_worker()
+
+
+def finish_job(
+    job: dict,
+    slot: str,
+    result: Optional[dict],
+    error: Optional[Exception],
+    uploads: Optional[list] = None,
+) -> None:
+    """
+    Segunda mitad de handle_job: ejecuta las subidas diferidas y registra
+    done | failed en Firestore. En un fan-out una subida fallida sólo hace
+    fallar su salida.
+    """
+    kind = job.get("kind") or "convert"
+    job_id = job.get("parent_job_id") or job.get("job_id")
+    job_ids = firestore_job_ids(job)
+    media_id = job.get("media_id")
+    try:
+        if error is not None:
+            raise error
+
+        for upload_job_id, upload in uploads or ():
+            try:
+                upload()
+            except Exception as e:
+                if kind != "fanout":
+                    raise
+                result["outputs"][upload_job_id] = e
+
+        count_stats(jobs_done=1)
+        if kind == "fanout":
+            finish_fanout_job(job, result["outputs"], slot)
+            return
+
+        output_path = result.pop("output_path")
+        if result.pop("deferred", False):
+            # split o chunk: el job original se cuenta una sola vez, al terminar su merge
+            logger.info(f"[{WORKER_ID}/{slot}] {kind} job {job.get('job_id')} finished")
+            return
+        jobs_done_total.labels(worker_id=WORKER_ID).inc()
+
+        logger.info(
+            f"[{WORKER_ID}/{slot}] job {job_id} finished "
+            f"(cache {result['conversion_cache']}), output at: {output_path or result['output_object']}"
+        )
+
+        # ---- marcar como done + guardar info de salida ----
+        record_job_done(job, job_id, result)
+
+    except Exception as e:
+        logger.exception(f"[{WORKER_ID}/{slot}] job failed: {e}")
+        jobs_failed_total.labels(worker_id=WORKER_ID).inc()
+        count_stats(jobs_failed=1)
+        for jid in job_ids:
+            status_writer.mark_failed(media_id, jid, details=str(e))
+
+
+class LeaseKeeper:
+    """
+    Renueva en segundo plano el lease de un job mientras se procesa, para que
+    una conversión larga no se considere abandonada. Si el worker muere deja
+    de renovarse y otro worker lo recupera al vencer el plazo.
+    """
+
+    def __init__(self, r: redis.Redis, job_id: str, consumer: str, visibility_timeout: float):
+        self.r = r
+        self.job_id = job_id
+        self.consumer = consumer
+        self.visibility_timeout = visibility_timeout
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"lease-{job_id}", daemon=True
+        )
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        interval = max(1.0, self.visibility_timeout / 3)
+        while not self._stop.wait(interval):
+            try:
+                if not job_queue.heartbeat(
+                    self.r, REDIS_QUEUE, self.job_id, self.consumer, self.visibility_timeout
+                ):
+                    logger.warning(
+                        f"[{self.consumer}] lost lease on job {self.job_id}, it may run twice"
+                    )
+                    return
+            except redis.RedisError as e:
+                logger.warning(f"[{self.consumer}] heartbeat failed for {self.job_id}: {e}")
+
+
+def reclaim_stalled_jobs(r: redis.Redis, slot: str) -> None:
+    """
+    Devuelve a la cola los jobs de workers caídos. Los que agotaron sus
+    intentos se marcan como failed en Firestore para que no queden en
+    'processing' para siempre. También recoge lo que una API de la versión
+    anterior haya dejado en la lista vieja (deploy escalonado).
+    """
+    migrated = job_queue.migrate_legacy_list(r, REDIS_QUEUE)
+    if migrated:
+        logger.warning(f"[{WORKER_ID}/{slot}] moved {migrated} job(s) from the legacy list")
+    requeued, dead = job_queue.reclaim_expired(r, REDIS_QUEUE)
+    for job_id in requeued:
+        logger.warning(f"[{WORKER_ID}/{slot}] reclaimed stalled job {job_id}")
+        jobs_reclaimed_total.labels(worker_id=WORKER_ID, outcome="requeued").inc()
+    for job in dead:
+        logger.error(f"[{WORKER_ID}/{slot}] job {job.get('job_id')} exhausted its attempts")
+        jobs_reclaimed_total.labels(worker_id=WORKER_ID, outcome="dead").inc()
+        if not job.get("media_id"):
+            continue
+        for job_id in firestore_job_ids(job):
+            status_writer.mark_failed(
+                job["media_id"],
+                job_id,
+                details=f"worker lost the job {job_queue.QUEUE_MAX_ATTEMPTS} times",
+            )
+
+
+def lease_next_job(r: redis.Redis, consumer: str) -> Optional[Tuple[str, dict, dict]]:
+    """
+    Arrienda el siguiente job de la cola: (job_id, payload, lease) o None si
+    está vacía. Un payload que no es JSON se descarta (ack) y se sigue.
+    """
     while True:
+        leased = job_queue.lease(r, REDIS_QUEUE, consumer)
+        if leased is None:
+            return None
+
+        job_id = leased["job_id"]
         try:
-            r = get_redis_client()
-            break
+            job = json.loads(leased["raw"].decode("utf-8"))
+        except json.JSONDecodeError:
+            logger.error(f"[{consumer}] invalid JSON: {leased['raw']}")
+            jobs_failed_total.labels(worker_id=WORKER_ID).inc()
+            job_queue.ack(r, REDIS_QUEUE, job_id, consumer)
+            continue
+
+        if leased["attempt"] > 1:
+            logger.info(f"[{consumer}] job {job_id} attempt {leased['attempt']}")
+        return job_id, job, leased
+
+
+def run_slot(slot: str, stop_event: threading.Event) -> None:
+    """
+    Loop de un slot de trabajo: arrienda jobs de la cola de uno en uno hasta
+    que se pida el apagado. El job en curso siempre se termina (y se confirma)
+    antes de salir.
+    """
+    r = None
+    consumer = f"{WORKER_ID}/{slot}"
+    last_reclaim = 0.0
+    logger.info(f"[{consumer}] listening on queue '{REDIS_QUEUE}'")
+
+    while not stop_event.is_set():
+        try:
+            # Conectar a Redis con reintentos
+            if r is None:
+                r = get_redis_client()
+
+            # Cualquier worker sano recupera los jobs de workers caídos
+            if time.monotonic() - last_reclaim >= QUEUE_RECLAIM_INTERVAL:
+                last_reclaim = time.monotonic()
+                reclaim_stalled_jobs(r, slot)
+
+            next_job = lease_next_job(r, consumer)
+            if next_job is None:
+                update_system_metrics_worker()
+                stop_event.wait(QUEUE_POLL_INTERVAL)
+                continue
+            job_id, job, leased = next_job
+
+            # Al cerrar el scope se borran las carpetas del job y se liberan sus originales
+            with LeaseKeeper(r, job_id, consumer, leased["visibility_timeout"]), scratch.scope():
+                handle_job(job, slot)
+            # Terminado (done o failed): ya no debe reintentarse
+            job_queue.ack(r, REDIS_QUEUE, job_id, consumer)
+
+        except redis.ConnectionError as e:
+            logger.error(f"[{consumer}] redis lost: {e}")
+            r = None
+            stop_event.wait(5)
         except Exception as e:
-            logger.error(f"Redis connection failed: {e}")
-            time.sleep(5)
+            logger.exception(f"[{consumer}] loop error: {e}")
+            stop_event.wait(2)
+
+    logger.info(f"[{consumer}] stopped")
+
+
+class PipelinedJob:
+    """
+    Job arrendado que recorre las etapas del modo pipeline (descarga ->
+    encode -> subida), cada una en un hilo distinto. El lease se renueva y
+    sus archivos temporales viven desde que se arrienda hasta que se confirma.
+    """
+
+    def __init__(self, r: redis.Redis, consumer: str, job_id: str, job: dict, leased: dict):
+        self.r = r
+        self.consumer = consumer
+        self.job_id = job_id
+        self.job = job
+        self.keeper = LeaseKeeper(r, job_id, consumer, leased["visibility_timeout"]).__enter__()
+        self.scope = scratch.open_scope()
+        self.uploads: List[Tuple[str, Callable[[], None]]] = []
+
+    def prefetch(self) -> None:
+        """Deja el original en disco (en modo stream sólo firma la URL)."""
+        try:
+            with scratch.activate(self.scope):
+                get_local_input(self.job_id, self.job)
+        except Exception as e:
+            # El encode lo vuelve a intentar y, si falla, el job falla ahí
+            logger.warning(f"[{self.consumer}] prefetch of {self.job_id} failed: {e}")
+
+    def encode(self, slot: str) -> Tuple[Optional[dict], Optional[Exception]]:
+        with scratch.activate(self.scope):
+            return encode_job(self.job, slot, self.uploads)
+
+    def complete(self, slot: str, result: Optional[dict], error: Optional[Exception]) -> None:
+        """Sube las salidas, registra el resultado y confirma el job."""
+        try:
+            with scratch.activate(self.scope):
+                finish_job(self.job, slot, result, error, self.uploads)
+        finally:
+            self.release()
+        try:
+            job_queue.ack(self.r, REDIS_QUEUE, self.job_id, self.consumer)
+        except redis.RedisError as e:
+            logger.error(f"[{self.consumer}] could not ack job {self.job_id}: {e}")
+
+    def release(self) -> None:
+        """
+        Deja de renovar el lease y borra los archivos temporales. Sin ack, un
+        job soltado así lo recupera otro worker cuando vence el lease.
+        """
+        try:
+            self.keeper.__exit__(None, None, None)
+        finally:
+            scratch.close_scope(self.scope)
+
 
-    logger.info(f"[{WORKER_ID}] listening on queue '{REDIS_QUEUE}'")
+def run_slot_pipelined(slot: str, stop_event: threading.Event) -> None:
+    """
+    Loop de un slot en modo pipeline: mientras ffmpeg codifica el job actual,
+    un hilo arrienda y descarga el siguiente y otro sube las salidas del
+    anterior. Hay como mucho un job por etapa, así que disco y memoria quedan
+    acotados a tres jobs por slot; si la subida anterior no terminó, el slot
+    la espera antes de entregar otra. Al apagarse también se procesa el job
+    que ya se había arrendado por adelantado.
+
+    Sólo se arrienda por adelantado en modo download: en modo stream no hay
+    descarga que solapar, y el job quedaría retenido durante todo el encode
+    actual (otro worker libre no podría tomarlo, se saltaría el orden de
+    prioridad de la cola y contaría doble como leased para el autoscaler).
+    Ahí el pipeline sólo solapa la subida del job anterior.
+    """
+    r = None
+    consumer = f"{WORKER_ID}/{slot}"
+    last_reclaim = 0.0
+    prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{WORKER_ID}-{slot}-prefetch")
+    uploader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{WORKER_ID}-{slot}-upload")
+    next_job: Optional[Future] = None
+    finishing: Optional[Future] = None
+    lease_ahead = WORKER_INPUT_MODE == "download"
+    logger.info(
+        f"[{consumer}] listening on queue '{REDIS_QUEUE}' "
+        f"(pipelined{', lease-ahead' if lease_ahead else ''})"
+    )
+
+    def lease_and_prefetch() -> Optional[PipelinedJob]:
+        leased = lease_next_job(r, consumer)
+        if leased is None:
+            return None
+        item = PipelinedJob(r, consumer, *leased)
+        item.prefetch()
+        return item
 
-    # Loop principal
     while True:
         try:
-            item = r.blpop(REDIS_QUEUE, timeout=5)
-            if item is None:
+            if r is None:
+                r = get_redis_client()
+
+            if time.monotonic() - last_reclaim >= QUEUE_RECLAIM_INTERVAL:
+                last_reclaim = time.monotonic()
+                reclaim_stalled_jobs(r, slot)
+
+            # Un job ya arrendado por adelantado se procesa aunque se esté apagando
+            if next_job is not None:
+                future, next_job = next_job, None
+                current = future.result()
+                if current is not None:
+                    pipeline_prefetched_total.labels(worker_id=WORKER_ID).inc()
+            elif stop_event.is_set():
+                break
+            else:
+                current = lease_and_prefetch()
+
+            if current is None:
+                if stop_event.is_set():
+                    break
                 update_system_metrics_worker()
+                stop_event.wait(QUEUE_POLL_INTERVAL)
                 continue
 
-            _, data = item
             try:
-                job = json.loads(data.decode("utf-8"))
-            except json.JSONDecodeError:
-                logger.error(f"[{WORKER_ID}] invalid JSON: {data}")
-                jobs_failed_total.labels(worker_id=WORKER_ID).inc()
-                continue
+                if lease_ahead and not stop_event.is_set():
+                    next_job = prefetcher.submit(lease_and_prefetch)
 
-            jobs_in_progress.labels(worker_id=WORKER_ID).inc()
+                result, error = current.encode(slot)
 
-            try:
-                job_id = job.get("job_id")
-                media_id = job.get("media_id")
-
-                # ---- marcar como processing ----
-                if media_id and job_id:
-                    mark_media_job_processing(media_id, job_id)
-
-                # ---- procesar job (ffmpeg + upload a MinIO) ----
-                output_path = process_job(job)
-                logger.info(
-                    f"[{WORKER_ID}] job {job_id} finished, output at: {output_path}"
-                )
-                jobs_done_total.labels(worker_id=WORKER_ID).inc()
-
-                # ---- marcar como done + guardar info de salida ----
-                if media_id and job_id:
-                    target = job.get("target")
-                    output_prefix = job.get("output_prefix")
-                    output_bucket = job.get("output_bucket")
-
-                    output_size_bytes = None
-                    if target == "hls":
-                        # Playlist principal
-                        object_name = f"{output_prefix}/index.m3u8"
-                    else:
-                        ext = Path(output_path).suffix
-                        object_name = f"{output_prefix}/output{ext}"
-                        try:
-                            output_size_bytes = Path(output_path).stat().st_size
-                        except OSError:
-                            output_size_bytes = None
-
-                    update_media_job_fields(
-                        media_id,
-                        job_id,
-                        status="done",
-                        output_prefix=output_prefix,
-                        target=target,
-                        output_bucket=output_bucket,
-                        output_object=object_name,
-                        output_size_bytes=output_size_bytes,
-                        updated_at=firestore.SERVER_TIMESTAMP,
+                if finishing is not None:
+                    waited = time.monotonic()
+                    try:
+                        finishing.result()
+                    except Exception as e:
+                        # El job anterior ya se soltó (release) en su complete
+                        logger.exception(f"[{consumer}] upload stage failed: {e}")
+                    finally:
+                        finishing = None
+                    pipeline_upload_wait_seconds.labels(worker_id=WORKER_ID).observe(
+                        time.monotonic() - waited
                     )
-                    # opcional, redundante pero claro
-                    mark_media_job_done(media_id, job_id)
-
-            except Exception as e:
-                logger.exception(f"[{WORKER_ID}] job failed: {e}")
-                jobs_failed_total.labels(worker_id=WORKER_ID).inc()
-                try:
-                    if media_id and job_id:
-                        mark_media_job_failed(media_id, job_id, details=str(e))
-                except Exception:
-                    pass
+                finishing = uploader.submit(current.complete, slot, result, error)
+                current = None
             finally:
-                jobs_in_progress.labels(worker_id=WORKER_ID).dec()
-                update_system_metrics_worker()
+                # No llegó a la etapa de subida: sin soltarlo, su lease se
+                # renovaría para siempre y nadie lo volvería a tomar
+                if current is not None:
+                    logger.warning(f"[{consumer}] releasing job {current.job_id} unacked")
+                    current.release()
 
         except redis.ConnectionError as e:
-            logger.error(f"[{WORKER_ID}] redis lost: {e}")
-            time.sleep(5)
+            logger.error(f"[{consumer}] redis lost: {e}")
+            r = None
+            stop_event.wait(5)
+        except Exception as e:
+            logger.exception(f"[{consumer}] loop error: {e}")
+            stop_event.wait(2)
+
+    if finishing is not None:
+        try:
+            finishing.result()
         except Exception as e:
-            logger.exception(f"[{WORKER_ID}] loop error: {e}")
-            time.sleep(2)
+            logger.exception(f"[{consumer}] upload stage failed: {e}")
+    uploader.shutdown(wait=True)
+    prefetcher.shutdown(wait=True)
+    logger.info(f"[{consumer}] stopped")
+
+
+def run_registry_heartbeat(stop_event: threading.Event, done_event: threading.Event) -> None:
+    """
+    Publica el estado del worker en el registro (api/worker_registry.py)
+    hasta que todos los slots terminen; mientras drena se anuncia como draining.
+    """
+    while True:
+        try:
+            with _stats_lock:
+                info = dict(_stats)
+            worker_registry.heartbeat(
+                get_shared_redis(),
+                WORKER_ID,
+                {
+                    **info,
+                    "slots": WORKER_CONCURRENCY,
+                    "pid": os.getpid(),
+                    "draining": stop_event.is_set(),
+                },
+            )
+        except redis.RedisError as e:
+            logger.warning(f"[{WORKER_ID}] registry heartbeat failed: {e}")
+        if done_event.wait(worker_registry.WORKER_HEARTBEAT_INTERVAL):
+            break
+    try:
+        worker_registry.unregister(get_shared_redis(), WORKER_ID)
+    except redis.RedisError:
+        pass
+
+
+def main() -> None:
+    # Servidor de métricas Prometheus
+    start_http_server(METRICS_PORT)
+    logger.info(f"[{WORKER_ID}] metrics on :{METRICS_PORT}")
+
+    # Restos de una ejecución anterior: carpetas de jobs y originales en disco
+    scratch.recover()
+
+    # Apagado limpio: SIGTERM/SIGINT dejan de tomar jobs nuevos y esperan
+    # a que cada slot termine el job que tenga en curso.
+    stop_event = threading.Event()
+
+    def _request_stop(signum, _frame):
+        logger.info(
+            f"[{WORKER_ID}] signal {signum} received, draining {WORKER_CONCURRENCY} slot(s)"
+        )
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    # Un hilo por slot: ffmpeg corre como subproceso, así que los hilos
+    # sólo esperan I/O y no compiten por el GIL.
+    slots = []
+    for i in range(WORKER_CONCURRENCY):
+        slot = f"slot{i}"
+        jobs_in_progress.labels(worker_id=WORKER_ID, slot=slot).set(0)
+        t = threading.Thread(
+            target=run_slot_pipelined if WORKER_PIPELINE_ENABLED else run_slot,
+            args=(slot, stop_event),
+            name=f"{WORKER_ID}-{slot}",
+        )
+        t.start()
+        slots.append(t)
+
+    logger.info(f"[{WORKER_ID}] running with {WORKER_CONCURRENCY} slot(s)")
+
+    # Registro de workers vivos (monitor y autoscaler)
+    slots_done = threading.Event()
+    registry = threading.Thread(
+        target=run_registry_heartbeat, args=(stop_event, slots_done),
+        name=f"{WORKER_ID}-registry", daemon=True,
+    )
+    registry.start()
+
+    while any(t.is_alive() for t in slots):
+        for t in slots:
+            t.join(timeout=1)
+    slots_done.set()
+    registry.join(timeout=5)
+
+    # Lo que quede por escribir en Firestore antes de salir
+    status_writer.close()
+    logger.info(f"[{WORKER_ID}] shutdown complete")
 
 
 if __name__ == "__main__":